@@ -7,32 +7,41 @@ if [ -z $1 ]
     PACKAGER_DOCKER_PATH=$(pwd)
 fi
 
-setup_jocker_env()
+BUILD_REPORT=$PACKAGER_DOCKER_PATH/build-report.json
+
+# the Dockerfiles are rendered in-process (see render_templates.py), so only
+# jinja2 and pyyaml are needed, and only installed if missing.
+check_build_requirements()
 {
-  sudo pip install virtualenv
-  virtualenv docker_build_env
-  source docker_build_env/bin/activate && \
-  pip install git+https://github.com/nir0s/jocker.git
+  python -c "import jinja2, yaml" 2> /dev/null || sudo pip install jinja2 pyyaml
 }
 
-# $1 - docker image name
-build_cloudify_image()
+# downloads the artifacts installed in the images through the local download
+# cache (see download_cache.py), so that rebuilds don't fetch them again.
+# the artifacts pinned by artifacts.sha256 (written by
+# `download_cache.py checksums --vars vars.py > artifacts.sha256`) aren't
+# revalidated either.
+fetch_artifacts()
 {
-  # docker build sometimes failes for no reason. Retry
-  for i in 1 2 3 4 5
-  do sudo docker build -t $1 $PACKAGER_DOCKER_PATH && break || sleep 2; done
+  CHECKSUMS=""
+  if [ -f $PACKAGER_DOCKER_PATH/artifacts.sha256 ]; then
+    CHECKSUMS="--checksums $PACKAGER_DOCKER_PATH/artifacts.sha256"
+  fi
+  python $PACKAGER_DOCKER_PATH/../download_cache.py warm --vars $PACKAGER_DOCKER_PATH/vars.py $CHECKSUMS --export $PACKAGER_DOCKER_PATH/artifacts
 }
 
+# renders the Dockerfiles and builds their stages (see build_images.py), the
+# report of the previous build, if any, is compared to the new one.
 build_image()
 {
-  DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
-  setup_jocker_env
-  jocker -t $PACKAGER_DOCKER_PATH/Dockerfile.template -o $PACKAGER_DOCKER_PATH/Dockerfile -f $PACKAGER_DOCKER_PATH/vars.py
-  echo Building cloudify OSS stack image.
-  build_cloudify_image cloudify:latest
-  jocker -t $PACKAGER_DOCKER_PATH/Dockerfile-commercial.template -o $PACKAGER_DOCKER_PATH/Dockerfile -f $PACKAGER_DOCKER_PATH/vars.py
-  echo Building cloudify commercial stack image.
-  build_cloudify_image cloudify-commercial:latest
+  check_build_requirements
+  fetch_artifacts
+  COMPARE=""
+  if [ -f $BUILD_REPORT ]; then
+    mv $BUILD_REPORT $PACKAGER_DOCKER_PATH/build-report.previous.json
+    COMPARE="--compare $PACKAGER_DOCKER_PATH/build-report.previous.json"
+  fi
+  python $PACKAGER_DOCKER_PATH/build_images.py --vars $PACKAGER_DOCKER_PATH/vars.py --docker "sudo -E docker" --report $BUILD_REPORT $COMPARE
 }
 
 main()
@@ -40,4 +49,4 @@ main()
   build_image
 }
 
-main
\ No newline at end of file
+main
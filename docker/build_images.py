@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Builds the cloudify docker images and reports where the time goes.
+
+Dockerfile.template and Dockerfile-commercial.template are rendered from
+vars.py (see render_templates.py) and their stages are built in the order
+of BUILD_PLAN (the stages of each group concurrently), each one tagged as
+its own image. The plain BuildKit progress output of every build is
+parsed into its steps (with their duration, or whether they were cached)
+and, once built, the layers and size of every image are read.
+
+All of that is written to a JSON report, which includes the commit it was
+built from. Pass the report of an earlier build to --compare to print the
+change in build time and size of every stage. Only steps that were built
+(not cached) in both builds count towards the compared build times.
+
+usage:
+    build_images.py [--vars vars.py] [--report build-report.json]
+                    [--compare OLD_REPORT] [--docker "sudo -E docker"]
+    build_images.py --compare OLD_REPORT --report NEW_REPORT --no-build
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import logging
+import argparse
+import datetime
+import subprocess
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import generate_components
+import render_templates
+
+DOCKER_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_VERSION = 1
+BUILD_ATTEMPTS = 5
+# stage: (dockerfile, image, extra docker build args)
+STAGES = OrderedDict([
+    ('base', ('Dockerfile', 'cloudify-stage-base', [])),
+    ('riemann', ('Dockerfile', 'cloudify-stage-riemann', [])),
+    ('logstash', ('Dockerfile', 'cloudify-stage-logstash', [])),
+    ('elasticsearch', ('Dockerfile', 'cloudify-stage-elasticsearch', [])),
+    ('influxdb', ('Dockerfile', 'cloudify-stage-influxdb', [])),
+    ('celery', ('Dockerfile', 'cloudify-stage-celery', [])),
+    ('manager', ('Dockerfile', 'cloudify-stage-manager', [])),
+    ('webui', ('Dockerfile-commercial', 'cloudify-stage-webui', [])),
+    ('oss', ('Dockerfile', 'cloudify:latest', [])),
+    ('commercial', ('Dockerfile-commercial', 'cloudify-commercial:latest',
+                    ['--build-arg', 'OSS_IMAGE=cloudify:latest'])),
+])
+# groups of stages built one after the other, the stages of each group
+# concurrently. The oss and commercial images only assemble cached stages.
+BUILD_PLAN = [
+    ['base'],
+    ['riemann', 'logstash', 'elasticsearch', 'influxdb', 'celery', 'manager',
+     'webui'],
+    ['oss'],
+    ['commercial'],
+]
+
+STEP_HEADER = re.compile(r'^#(\d+) \[([^\]]+)\] (.*)$')
+STEP_DONE = re.compile(r'^#(\d+) DONE ([\d.]+)s$')
+STEP_CACHED = re.compile(r'^#(\d+) CACHED$')
+STEP_ERROR = re.compile(r'^#(\d+) ERROR')
+
+lgr = logging.getLogger('build_images')
+
+
+class BuildError(Exception):
+    pass
+
+
+def parse_steps(output):
+    """returns the steps of a `docker build --progress=plain` output, in
+    the order they started, skipping BuildKit's internal ones.
+
+    Each step is a dict with the stage and step number (e.g. `base 2/6`),
+    the instruction, whether it was cached and its duration in seconds.
+    """
+    steps = OrderedDict()
+    for line in output.splitlines():
+        match = STEP_HEADER.match(line)
+        if match:
+            step_id, name, instruction = match.groups()
+            if name == 'internal' or name.startswith('internal '):
+                continue
+            stage, _, number = name.rpartition(' ')
+            steps.setdefault(step_id, {
+                'stage': stage or name,
+                'step': number,
+                'instruction': instruction,
+                'cached': False,
+                'duration': None,
+                'failed': False,
+            })
+            continue
+        for pattern, key in ((STEP_DONE, 'duration'),
+                             (STEP_CACHED, 'cached'),
+                             (STEP_ERROR, 'failed')):
+            match = pattern.match(line)
+            if match and match.group(1) in steps:
+                step = steps[match.group(1)]
+                step[key] = float(match.group(2)) if key == 'duration' \
+                    else True
+                break
+    return list(steps.values())
+
+
+def parse_history(output):
+    """returns the layers of a `docker history --no-trunc --human=false
+    --format '{{.CreatedBy}}\\t{{.Size}}'` output, base layer first.
+    """
+    layers = []
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        created_by, _, size = line.rpartition('\t')
+        layers.append({'created_by': created_by, 'size': int(size)})
+    return list(reversed(layers))
+
+
+class ImageBuilder(object):
+    def __init__(self, docker_dir=DOCKER_DIR, docker='docker',
+                 logs_dir=None, attempts=BUILD_ATTEMPTS):
+        self.docker_dir = docker_dir
+        self.docker = shlex.split(docker)
+        self.logs_dir = logs_dir or os.path.join(docker_dir, 'build-logs')
+        self.attempts = attempts
+
+    def _docker(self, *args):
+        return subprocess.check_output(self.docker + list(args))
+
+    def render(self, vars_path):
+        variables = render_templates.load_vars(vars_path)
+        renderer = render_templates.Renderer(self.docker_dir)
+        render_templates.render_dockerfiles(
+            variables, self.docker_dir, renderer)
+        generate_components.generate(
+            variables, os.path.join(self.docker_dir, 'components'),
+            renderer=renderer)
+
+    def build_stage(self, stage):
+        """builds `stage` and returns its duration, number of attempts and
+        parsed steps (those of the last attempt).
+        """
+        dockerfile, image, extra_args = STAGES[stage]
+        command = self.docker + [
+            'build', '--progress=plain',
+            '-f', os.path.join(self.docker_dir, dockerfile),
+            '--target', stage, '-t', image] + extra_args + [self.docker_dir]
+        env = dict(os.environ, DOCKER_BUILDKIT='1')
+        log_path = os.path.join(self.logs_dir, '{0}.log'.format(stage))
+        start = time.time()
+        for attempt in range(1, self.attempts + 1):
+            with open(log_path, 'w') as log:
+                returncode = subprocess.call(
+                    command, stdout=log, stderr=subprocess.STDOUT, env=env)
+            if returncode == 0:
+                break
+            # docker build sometimes fails for no reason. Retry
+            lgr.warning('Building stage {0} failed (attempt {1}/{2}), see '
+                        '{3}'.format(stage, attempt, self.attempts, log_path))
+            time.sleep(2)
+        else:
+            raise BuildError('Failed building stage {0}, see {1}'.format(
+                stage, log_path))
+        duration = time.time() - start
+        with open(log_path) as log:
+            steps = parse_steps(log.read())
+        lgr.info('Built stage {0} in {1:.1f}s'.format(stage, duration))
+        return {
+            'image': image,
+            'duration': duration,
+            'attempts': attempt,
+            'log': log_path,
+            'steps': steps,
+        }
+
+    def inspect(self, image):
+        size = int(self._docker('inspect', '--format', '{{.Size}}', image))
+        layers = parse_history(self._docker(
+            'history', '--no-trunc', '--human=false',
+            '--format', '{{.CreatedBy}}\t{{.Size}}', image))
+        return size, layers
+
+    def build(self, plan=BUILD_PLAN):
+        if not os.path.isdir(self.logs_dir):
+            os.makedirs(self.logs_dir)
+        stages = OrderedDict()
+        for group in plan:
+            lgr.info('Building stages: {0}'.format(', '.join(group)))
+            pool = ThreadPool(len(group))
+            try:
+                results = pool.map(self.build_stage, group)
+            finally:
+                pool.close()
+                pool.join()
+            stages.update(zip(group, results))
+        for stage, result in stages.items():
+            result['size'], result['layers'] = self.inspect(result['image'])
+        base_size = stages['base']['size'] if 'base' in stages else 0
+        for stage, result in stages.items():
+            result['own_size'] = result['size'] - base_size
+            result['build_time'] = sum(
+                step['duration'] or 0 for step in result['steps']
+                if not step['cached'] and step['stage'] == stage)
+        return stages
+
+
+def git_commit(path):
+    def git(*args):
+        return subprocess.check_output(
+            ['git', '-C', path] + list(args)).strip()
+    try:
+        return git('rev-parse', 'HEAD'), bool(git('status', '--porcelain'))
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def create_report(stages, duration, docker_dir=DOCKER_DIR):
+    commit, dirty = git_commit(docker_dir)
+    return OrderedDict([
+        ('version', REPORT_VERSION),
+        ('commit', commit),
+        ('dirty', dirty),
+        ('created', datetime.datetime.utcnow().isoformat() + 'Z'),
+        ('duration', duration),
+        ('stages', stages),
+    ])
+
+
+def _uncached_steps(stage_report, stage):
+    return dict(((step['stage'], step['instruction']), step['duration'] or 0)
+                for step in stage_report['steps']
+                if not step['cached'] and step['stage'] == stage)
+
+
+def compare_reports(old, new):
+    """returns a row per stage (in the order of the new report) with the
+    old and new wall time, the change in the time of the steps built by
+    both builds and the old and new image size.
+    """
+    rows = []
+    for stage, result in new['stages'].items():
+        previous = old['stages'].get(stage)
+        if previous is None:
+            rows.append((stage, None, result['duration'], None,
+                         None, result['size']))
+            continue
+        old_steps = _uncached_steps(previous, stage)
+        new_steps = _uncached_steps(result, stage)
+        common = set(old_steps) & set(new_steps)
+        steps_delta = sum(new_steps[key] - old_steps[key] for key in common)
+        rows.append((stage, previous['duration'], result['duration'],
+                     steps_delta if common else None,
+                     previous['size'], result['size']))
+    return rows
+
+
+def print_report(report, stream=sys.stdout):
+    row = '{0:<14} {1:<28} {2:>9} {3:>9} {4:>7} {5:>10} {6:>10}\n'
+    stream.write('commit: {0}{1}\n'.format(
+        report['commit'], ' (dirty)' if report['dirty'] else ''))
+    stream.write(row.format('stage', 'image', 'time (s)', 'built (s)',
+                            'cached', 'size (MB)', 'own (MB)'))
+    for stage, result in report['stages'].items():
+        steps = [step for step in result['steps'] if step['stage'] == stage]
+        stream.write(row.format(
+            stage, result['image'], '{0:.1f}'.format(result['duration']),
+            '{0:.1f}'.format(result['build_time']),
+            '{0}/{1}'.format(sum(step['cached'] for step in steps),
+                             len(steps)),
+            result['size'] // 1024 ** 2, result['own_size'] // 1024 ** 2))
+    stream.write('total: {0:.1f}s\n'.format(report['duration']))
+
+
+def print_comparison(old, new, stream=sys.stdout):
+    def fmt(value, scale=1, unit='s'):
+        return '-' if value is None else '{0:+.1f}{1}'.format(
+            value / float(scale), unit)
+
+    row = '{0:<14} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12}\n'
+    stream.write('comparing {0} to {1}\n'.format(new['commit'],
+                                                 old['commit']))
+    stream.write(row.format('stage', 'old (s)', 'new (s)', 'steps', 'size',
+                            'new (MB)'))
+    for stage, old_time, new_time, steps_delta, old_size, new_size in \
+            compare_reports(old, new):
+        stream.write(row.format(
+            stage, '-' if old_time is None else '{0:.1f}'.format(old_time),
+            '{0:.1f}'.format(new_time), fmt(steps_delta),
+            fmt(None if old_size is None else new_size - old_size,
+                1024 ** 2, 'MB'),
+            new_size // 1024 ** 2))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--vars', default=os.path.join(DOCKER_DIR, 'vars.py'),
+        help='vars file the Dockerfiles are rendered from.')
+    parser.add_argument(
+        '--report', default=os.path.join(DOCKER_DIR, 'build-report.json'),
+        help='Where to write the JSON report (default: %(default)s).')
+    parser.add_argument(
+        '--compare', help='A report of an earlier build to compare to.')
+    parser.add_argument(
+        '--docker', default='docker',
+        help='The docker command, e.g. "sudo -E docker".')
+    parser.add_argument(
+        '--no-build', action='store_true',
+        help="Don't build, only compare --report to --compare.")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    if args.no_build:
+        with open(args.report) as f:
+            report = json.load(f, object_pairs_hook=OrderedDict)
+    else:
+        builder = ImageBuilder(docker=args.docker)
+        start = time.time()
+        builder.render(args.vars)
+        try:
+            stages = builder.build()
+        except BuildError as ex:
+            sys.exit(str(ex))
+        report = create_report(stages, time.time() - start)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+        print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f, object_pairs_hook=OrderedDict)
+        print_comparison(old, report)
+
+
+if __name__ == '__main__':
+    main()
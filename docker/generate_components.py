@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Generates a minimal image per cloudify component from vars.py.
+
+Each component gets its own Dockerfile (rendered from
+Dockerfile-component.template) installing only the reqs of the vars.py
+section it is built from, and a docker-compose file wiring the components
+together is written next to them. The components reach one another by
+their compose service names, so the rest-service and celery services can
+be scaled out, e.g. `docker-compose scale rest-service=3 celery=2` (nginx
+balances over all of the rest-service containers it resolves on start).
+
+usage:
+    generate_components.py [--vars vars.py] [--output-dir components]
+                           [COMPONENT...]
+
+    cd components && docker-compose build && \
+        MANAGEMENT_IP=<ip> docker-compose up -d
+"""
+
+import os
+import logging
+import argparse
+from collections import OrderedDict
+
+import yaml
+
+from render_templates import DOCKER_DIR, Renderer, load_vars, \
+    write_if_changed, copy_shared_files
+
+TEMPLATE = 'Dockerfile-component.template'
+COMPOSE_FILE = 'docker-compose.yml'
+
+# component: the vars.py section its reqs and ports are taken from, the
+# components it depends on and the compose volumes it shares with others.
+# published components publish their `ports`, or their section's if they
+# have none (nginx's section lists ports of the monolithic image which
+# aren't nginx's own).
+COMPONENTS = OrderedDict([
+    ('rabbitmq', {
+        'vars': 'rabbitmq',
+        'depends_on': [],
+        'publish': True,
+    }),
+    ('elasticsearch', {
+        'vars': 'elasticsearch',
+        'depends_on': [],
+    }),
+    ('events_retention', {
+        'vars': 'events_retention',
+        'depends_on': ['elasticsearch'],
+    }),
+    ('influxdb', {
+        'vars': 'influxdb',
+        'depends_on': [],
+    }),
+    ('riemann', {
+        'vars': 'riemann',
+        'depends_on': ['rabbitmq'],
+        'volumes': ['riemann:/etc/service/riemann'],
+    }),
+    ('logstash', {
+        'vars': 'logstash',
+        'depends_on': ['rabbitmq', 'elasticsearch'],
+    }),
+    ('amqp_influx', {
+        'vars': 'manager',
+        'depends_on': ['rabbitmq', 'influxdb'],
+    }),
+    ('rest_service', {
+        'vars': 'manager',
+        'depends_on': ['rabbitmq', 'elasticsearch'],
+        'volumes': ['manager-resources:/opt/manager/resources'],
+    }),
+    ('celery', {
+        'vars': 'celery',
+        'depends_on': ['rabbitmq', 'rest_service', 'riemann'],
+        'environment': {'MANAGEMENT_IP': '${MANAGEMENT_IP}'},
+        'volumes': ['riemann:/etc/service/riemann'],
+    }),
+    ('nginx', {
+        'vars': 'nginx',
+        'depends_on': ['rest_service', 'elasticsearch'],
+        'volumes': ['manager-resources:/opt/manager/resources'],
+        # 53229 is the file server of default.conf
+        'ports': ['80', '443', '8101', '53229'],
+        'publish': True,
+    }),
+])
+
+
+def service_name(component):
+    # compose service names are used as hostnames, which can't contain
+    # underscores.
+    return component.replace('_', '-')
+
+
+def dockerfile_name(component):
+    return 'Dockerfile.{0}'.format(component)
+
+
+def get_context(variables, component):
+    context = dict(variables)
+    context.update(
+        component=component,
+        reqs=variables[COMPONENTS[component]['vars']]['reqs'],
+        hosts=dict((name, service_name(name)) for name in COMPONENTS))
+    return context
+
+
+def generate_compose(variables, components, output_dir):
+    prefix = variables['components']['image_prefix']
+    build_context = os.path.relpath(DOCKER_DIR, output_dir)
+    services = {}
+    volumes = set()
+    for component in components:
+        spec = COMPONENTS[component]
+        service = {
+            'image': '{0}{1}:latest'.format(prefix, service_name(component)),
+            'build': {
+                'context': build_context,
+                'dockerfile': os.path.join(
+                    os.path.relpath(output_dir, DOCKER_DIR),
+                    dockerfile_name(component)),
+            },
+            'restart': 'on-failure',
+        }
+        depends_on = [service_name(dep) for dep in spec['depends_on']
+                      if dep in components]
+        if depends_on:
+            service['depends_on'] = depends_on
+        if spec.get('environment'):
+            service['environment'] = spec['environment']
+        if spec.get('volumes'):
+            service['volumes'] = spec['volumes']
+            volumes.update(volume.split(':')[0] for volume in spec['volumes'])
+        if spec.get('publish'):
+            ports = spec.get('ports', variables[spec['vars']]['ports'])
+            service['ports'] = ['{0}:{0}'.format(port) for port in ports]
+        services[service_name(component)] = service
+    compose = {'version': '2', 'services': services}
+    if volumes:
+        compose['volumes'] = dict((volume, {}) for volume in volumes)
+    return yaml.safe_dump(compose, default_flow_style=False)
+
+
+def generate(variables, output_dir, components=None, renderer=None):
+    """renders the Dockerfiles of `components` and their compose file into
+    `output_dir`, returns the paths of the outputs that changed.
+    """
+    components = components or list(COMPONENTS)
+    renderer = renderer or Renderer()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    # the components are built in the docker dir as well
+    changed = copy_shared_files()
+    for component in components:
+        path = os.path.join(output_dir, dockerfile_name(component))
+        if renderer.render_to(TEMPLATE, get_context(variables, component),
+                              path):
+            changed.append(path)
+    path = os.path.join(output_dir, COMPOSE_FILE)
+    if write_if_changed(path, generate_compose(
+            variables, components, output_dir)):
+        changed.append(path)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--vars', default=os.path.join(DOCKER_DIR, 'vars.py'),
+                        help='vars file (default: %(default)s)')
+    parser.add_argument('--output-dir',
+                        default=os.path.join(DOCKER_DIR, 'components'),
+                        help='where the Dockerfiles and the compose file '
+                             'are written (default: %(default)s)')
+    parser.add_argument('components', nargs='*', metavar='COMPONENT',
+                        help='components to generate, out of {0} (default: '
+                             'all of them)'.format(', '.join(COMPONENTS)))
+    args = parser.parse_args()
+    unknown = set(args.components) - set(COMPONENTS)
+    if unknown:
+        parser.error('unknown components: {0}'.format(
+            ', '.join(sorted(unknown))))
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    generate(load_vars(args.vars), os.path.abspath(args.output_dir),
+             args.components)
+
+
+if __name__ == '__main__':
+    main()
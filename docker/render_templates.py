@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Renders the Dockerfile templates with the VARS of vars.py.
+
+Dockerfile.template, Dockerfile-commercial.template and the logstash config
+they add are rendered in one process (the per-component ones are rendered
+by generate_components.py with the same renderer). The compiled templates are
+cached under the cache dir (so they are only compiled again once changed)
+and an output is only written if its content changed, keeping its mtime
+for tools that rely on it.
+
+The files the images share with the packages (e.g. es_schema_creator.py)
+are copied from package-configuration into the docker dir along with the
+rendering, as the images can't be built with files outside of it.
+
+usage:
+    render_templates.py [--vars vars.py] [--output-dir DIR]
+                        [--cache-dir DIR]
+"""
+
+import os
+import imp
+import errno
+import logging
+import argparse
+import tempfile
+
+import jinja2
+
+DOCKER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('CLOUDIFY_DOWNLOAD_CACHE', os.path.join(
+        os.path.expanduser('~'), '.cache', 'cloudify-packager')),
+    'templates')
+# template: output
+TEMPLATES = [
+    ('Dockerfile.template', 'Dockerfile'),
+    ('Dockerfile-commercial.template', 'Dockerfile-commercial'),
+    ('logstash/config.conf.template', 'logstash/config.conf'),
+]
+PACKAGE_CONFIGURATION_DIR = os.path.join(
+    os.path.dirname(DOCKER_DIR), 'package-configuration')
+# package-configuration file: its copy in the docker dir
+SHARED_FILES = [
+    ('elasticsearch/schema/es_schema_creator.py',
+     'utils/es_schema_creator.py'),
+    ('manager/gunicorn/gunicorn.conf.py', 'rest_service/gunicorn.conf.py'),
+]
+
+lgr = logging.getLogger('render_templates')
+
+
+def load_vars(path):
+    return imp.load_source('docker_vars', path).VARS
+
+
+def write_if_changed(path, content):
+    """writes `content` to `path` unless it already holds it. returns
+    whether it was written.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except IOError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.render-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+class Renderer(object):
+    def __init__(self, template_dir=DOCKER_DIR, cache_dir=DEFAULT_CACHE_DIR):
+        bytecode_cache = None
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        # lstrip_blocks lets block tags sit on their own (indented) lines.
+        self.env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(template_dir),
+            bytecode_cache=bytecode_cache,
+            lstrip_blocks=True, keep_trailing_newline=True)
+
+    def render(self, template, context):
+        return self.env.get_template(template).render(context).encode(
+            'utf-8')
+
+    def render_to(self, template, context, output):
+        """renders `template` into `output`, returns whether it changed.
+        """
+        written = write_if_changed(output, self.render(template, context))
+        lgr.info('{0} {1}'.format(
+            'Rendered' if written else 'Unchanged', output))
+        return written
+
+
+def copy_shared_files(docker_dir=DOCKER_DIR, files=SHARED_FILES):
+    """copies the files shared with the packages into `docker_dir`, returns
+    the paths of the copies that changed.
+    """
+    changed = []
+    for source, output in files:
+        with open(os.path.join(PACKAGE_CONFIGURATION_DIR, source), 'rb') as f:
+            content = f.read()
+        path = os.path.join(docker_dir, output)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if write_if_changed(path, content):
+            lgr.info('Copied {0}'.format(path))
+            changed.append(path)
+    return changed
+
+
+def render_dockerfiles(variables, output_dir=DOCKER_DIR, renderer=None,
+                       templates=TEMPLATES):
+    """renders `templates` into `output_dir` and copies the shared files
+    next to them, returns the paths of the outputs that changed.
+    """
+    renderer = renderer or Renderer()
+    changed = copy_shared_files(output_dir)
+    for template, output in templates:
+        path = os.path.join(output_dir, output)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if renderer.render_to(template, variables, path):
+            changed.append(path)
+    return changed
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--vars', default=os.path.join(DOCKER_DIR, 'vars.py'),
+        help='vars file (default: %(default)s)')
+    parser.add_argument(
+        '--output-dir', default=DOCKER_DIR,
+        help='where the Dockerfiles are written (default: %(default)s)')
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_CACHE_DIR,
+        help='compiled templates cache (default: %(default)s)')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    render_dockerfiles(load_vars(args.vars), args.output_dir,
+                       Renderer(cache_dir=args.cache_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import unittest
+from StringIO import StringIO
+from collections import OrderedDict
+
+import build_images
+
+BUILD_OUTPUT = """#1 [internal] load build definition from Dockerfile
+#1 DONE 0.1s
+
+#2 [internal] load metadata for docker.io/phusion/baseimage:0.9.15
+#2 DONE 1.2s
+
+#3 [base 1/3] FROM docker.io/phusion/baseimage:0.9.15
+#3 CACHED
+
+#4 [base 2/3] ADD utils/ /opt/tmp/utils/
+#4 DONE 0.3s
+
+#5 [base 3/3] RUN apt-get update
+#5 0.512 Get:1 http://archive.ubuntu.com trusty InRelease
+#5 DONE 12.5s
+
+#6 [riemann 1/2] RUN wget riemann.deb
+#6 ERROR: executor failed running
+"""
+
+
+def _step(stage, instruction, duration=None, cached=False):
+    return {'stage': stage, 'step': '1/1', 'instruction': instruction,
+            'cached': cached, 'duration': duration, 'failed': False}
+
+
+def _report(commit, **stages):
+    return {'commit': commit, 'stages': OrderedDict(
+        (name, {'duration': duration, 'size': size, 'steps': steps})
+        for name, (duration, size, steps) in sorted(stages.items()))}
+
+
+class ParseTests(unittest.TestCase):
+    def test_parse_steps(self):
+        steps = build_images.parse_steps(BUILD_OUTPUT)
+        self.assertEqual(
+            [('base', '1/3', 'FROM docker.io/phusion/baseimage:0.9.15',
+              True, None, False),
+             ('base', '2/3', 'ADD utils/ /opt/tmp/utils/', False, 0.3, False),
+             ('base', '3/3', 'RUN apt-get update', False, 12.5, False),
+             ('riemann', '1/2', 'RUN wget riemann.deb', False, None, True)],
+            [(step['stage'], step['step'], step['instruction'],
+              step['cached'], step['duration'], step['failed'])
+             for step in steps])
+
+    def test_parse_steps_of_empty_output(self):
+        self.assertEqual([], build_images.parse_steps(''))
+
+    def test_parse_history(self):
+        output = '/bin/sh -c apt-get update\t2048\n' \
+                 '/bin/sh -c #(nop) ADD file:abc in /\t1024\n\n'
+        self.assertEqual(
+            [{'created_by': '/bin/sh -c #(nop) ADD file:abc in /',
+              'size': 1024},
+             {'created_by': '/bin/sh -c apt-get update', 'size': 2048}],
+            build_images.parse_history(output))
+
+
+class CompareReportsTests(unittest.TestCase):
+    def test_compare_reports(self):
+        old = _report('old', base=(60, 300, [
+            _step('base', 'RUN apt-get update', 40),
+            _step('base', 'RUN pip install', 10),
+            _step('base', 'RUN removed', 5)]))
+        new = _report('new', base=(50, 320, [
+            _step('base', 'RUN apt-get update', 35),
+            _step('base', 'RUN pip install', 10, cached=True),
+            _step('base', 'RUN added', 5)]))
+        self.assertEqual([('base', 60, 50, -5, 300, 320)],
+                         build_images.compare_reports(old, new))
+
+    def test_compare_reports_without_common_steps(self):
+        old = _report('old', base=(60, 300, [
+            _step('base', 'RUN apt-get update', 40, cached=True)]))
+        new = _report('new', base=(50, 320, [
+            _step('base', 'RUN apt-get update', 35)]))
+        self.assertEqual([('base', 60, 50, None, 300, 320)],
+                         build_images.compare_reports(old, new))
+
+    def test_compare_reports_ignores_steps_of_other_stages(self):
+        old = _report('old', oss=(10, 900, [
+            _step('base', 'RUN apt-get update', 40),
+            _step('oss', 'RUN chmod', 1)]))
+        new = _report('new', oss=(10, 900, [
+            _step('base', 'RUN apt-get update', 20),
+            _step('oss', 'RUN chmod', 2)]))
+        self.assertEqual([('oss', 10, 10, 1, 900, 900)],
+                         build_images.compare_reports(old, new))
+
+    def test_compare_reports_with_a_new_stage(self):
+        old = _report('old', base=(60, 300, []))
+        new = _report('new', base=(60, 300, []), webui=(20, 500, []))
+        self.assertEqual([('base', 60, 60, None, 300, 300),
+                          ('webui', None, 20, None, None, 500)],
+                         build_images.compare_reports(old, new))
+
+    def test_print_comparison(self):
+        old = _report('old', base=(60, 300 * 1024 ** 2, [
+            _step('base', 'RUN apt-get update', 40)]))
+        new = _report('new', base=(50, 320 * 1024 ** 2, [
+            _step('base', 'RUN apt-get update', 35)]))
+        stream = StringIO()
+        build_images.print_comparison(old, new, stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual('comparing new to old', lines[0])
+        self.assertEqual(['base', '60.0', '50.0', '-5.0s', '+20.0MB', '320'],
+                         lines[2].split())
@@ -0,0 +1,104 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+import generate_components
+from render_templates import DOCKER_DIR, Renderer, load_vars
+
+VARIABLES = load_vars(os.path.join(DOCKER_DIR, 'vars.py'))
+
+
+class GenerateComposeTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def _compose(self, components=None):
+        return yaml.safe_load(generate_components.generate_compose(
+            VARIABLES, components or list(generate_components.COMPONENTS),
+            self.temp_dir))
+
+    def test_services(self):
+        services = self._compose()['services']
+        self.assertEqual(
+            ['amqp-influx', 'celery', 'elasticsearch', 'events-retention',
+             'influxdb', 'logstash', 'nginx', 'rabbitmq', 'rest-service',
+             'riemann'], sorted(services))
+        nginx = services['nginx']
+        self.assertEqual('{0}nginx:latest'.format(
+            VARIABLES['components']['image_prefix']), nginx['image'])
+        self.assertEqual(
+            {'context': os.path.relpath(DOCKER_DIR, self.temp_dir),
+             'dockerfile': os.path.join(
+                 os.path.relpath(self.temp_dir, DOCKER_DIR),
+                 'Dockerfile.nginx')}, nginx['build'])
+        self.assertEqual({'MANAGEMENT_IP': '${MANAGEMENT_IP}'},
+                         services['celery']['environment'])
+
+    def test_depends_on(self):
+        services = self._compose()['services']
+        self.assertEqual(['rabbitmq', 'rest-service', 'riemann'],
+                         services['celery']['depends_on'])
+        self.assertEqual(['elasticsearch'],
+                         services['events-retention']['depends_on'])
+        self.assertNotIn('depends_on', services['rabbitmq'])
+
+    def test_depends_on_generated_components_only(self):
+        services = self._compose(['rabbitmq', 'celery'])['services']
+        self.assertEqual(['celery', 'rabbitmq'], sorted(services))
+        self.assertEqual(['rabbitmq'], services['celery']['depends_on'])
+
+    def test_volumes(self):
+        compose = self._compose()
+        self.assertEqual({'manager-resources': {}, 'riemann': {}},
+                         compose['volumes'])
+        self.assertEqual(['riemann:/etc/service/riemann'],
+                         compose['services']['celery']['volumes'])
+        self.assertEqual(['manager-resources:/opt/manager/resources'],
+                         compose['services']['nginx']['volumes'])
+        self.assertNotIn('volumes', self._compose(['rabbitmq']))
+
+    def test_ports(self):
+        services = self._compose()['services']
+        self.assertEqual(['5672:5672'], services['rabbitmq']['ports'])
+        # nginx publishes its own ports rather than its vars.py section's
+        self.assertEqual(['80:80', '443:443', '8101:8101', '53229:53229'],
+                         services['nginx']['ports'])
+        self.assertEqual(
+            ['nginx', 'rabbitmq'],
+            sorted(name for name, service in services.items()
+                   if 'ports' in service))
+
+
+class GetContextTests(unittest.TestCase):
+    def test_context(self):
+        context = generate_components.get_context(VARIABLES, 'amqp_influx')
+        self.assertEqual('amqp_influx', context['component'])
+        self.assertEqual(VARIABLES['manager']['reqs'], context['reqs'])
+        self.assertEqual('amqp-influx', context['hosts']['amqp_influx'])
+        self.assertEqual(VARIABLES['rabbitmq'], context['rabbitmq'])
+
+    def test_render_dockerfile(self):
+        dockerfile = Renderer(cache_dir=None).render(
+            generate_components.TEMPLATE,
+            generate_components.get_context(VARIABLES, 'nginx'))
+        self.assertIn('EXPOSE 80 443 8101 53229\n', dockerfile)
+        self.assertIn('server rest-service:8100;', dockerfile)
@@ -0,0 +1,146 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+import jinja2
+import mock
+
+import render_templates
+
+
+class RendererTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.template_dir = os.path.join(self.temp_dir, 'templates')
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        os.mkdir(self.template_dir)
+        with open(os.path.join(self.template_dir, 'Dockerfile.template'),
+                  'w') as f:
+            f.write('FROM {{ image }}\n'
+                    '{%- for dep in reqs %}\n'
+                    'RUN apt-get install {{ dep }}\n'
+                    '{%- endfor %}\n')
+        self.output = os.path.join(self.temp_dir, 'Dockerfile')
+
+    def _renderer(self):
+        return render_templates.Renderer(self.template_dir, self.cache_dir)
+
+    def _render(self, **context):
+        context.setdefault('image', 'ubuntu')
+        context.setdefault('reqs', ['curl'])
+        return self._renderer().render_to('Dockerfile.template', context,
+                                          self.output)
+
+    def _read(self):
+        with open(self.output) as f:
+            return f.read()
+
+    def _temp_files(self):
+        return [name for name in os.listdir(self.temp_dir)
+                if name.startswith('.render-')]
+
+    def test_render(self):
+        self.assertTrue(self._render(reqs=['curl', 'git']))
+        self.assertEqual('FROM ubuntu\n'
+                         'RUN apt-get install curl\n'
+                         'RUN apt-get install git\n', self._read())
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(self.output).st_mode))
+
+    def test_unchanged_output_is_not_written(self):
+        self._render()
+        os.utime(self.output, (1000, 1000))
+        self.assertFalse(self._render())
+        self.assertEqual(1000, os.path.getmtime(self.output))
+
+    def test_changed_output_is_replaced(self):
+        self._render()
+        os.utime(self.output, (1000, 1000))
+        rename = os.rename
+        renamed = []
+
+        def replace(source, destination):
+            # the output keeps its previous content until it is replaced
+            renamed.append((os.path.dirname(source), destination,
+                            self._read()))
+            rename(source, destination)
+
+        with mock.patch('os.rename', side_effect=replace):
+            self.assertTrue(self._render(image='centos'))
+        self.assertEqual(
+            [(self.temp_dir, self.output,
+              'FROM ubuntu\nRUN apt-get install curl\n')], renamed)
+        self.assertEqual('FROM centos\nRUN apt-get install curl\n',
+                         self._read())
+        self.assertNotEqual(1000, os.path.getmtime(self.output))
+        self.assertEqual([], self._temp_files())
+
+    def test_failed_write_keeps_the_output(self):
+        self._render()
+        with mock.patch('os.rename', side_effect=OSError('no space')):
+            self.assertRaises(OSError, self._render, image='centos')
+        self.assertEqual('FROM ubuntu\nRUN apt-get install curl\n',
+                         self._read())
+        self.assertEqual([], self._temp_files())
+
+    def test_compiled_templates_are_cached(self):
+        self._render()
+        self.assertNotEqual([], os.listdir(self.cache_dir))
+        # a new renderer loads the compiled template from the cache
+        with mock.patch.object(jinja2.Environment, 'compile',
+                               side_effect=AssertionError('compiled')):
+            self.assertTrue(self._render(image='centos'))
+
+    def test_changed_template_is_compiled_again(self):
+        self._render()
+        with open(os.path.join(self.template_dir, 'Dockerfile.template'),
+                  'w') as f:
+            f.write('FROM {{ image }}:latest\n')
+        self.assertTrue(self._render())
+        self.assertEqual('FROM ubuntu:latest\n', self._read())
+
+    def test_without_cache(self):
+        render_templates.Renderer(self.template_dir, None).render_to(
+            'Dockerfile.template', {'image': 'ubuntu', 'reqs': []},
+            self.output)
+        self.assertEqual('FROM ubuntu\n', self._read())
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class RenderDockerfilesTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.renderer = render_templates.Renderer(
+            cache_dir=os.path.join(self.temp_dir, 'cache'))
+        self.variables = render_templates.load_vars(
+            os.path.join(render_templates.DOCKER_DIR, 'vars.py'))
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+
+    def test_render_dockerfiles(self):
+        changed = render_templates.render_dockerfiles(
+            self.variables, self.output_dir, self.renderer)
+        self.assertEqual(
+            sorted(os.path.join(self.output_dir, output) for output in
+                   [output for _, output in render_templates.TEMPLATES] +
+                   [output for _, output in render_templates.SHARED_FILES]),
+            sorted(changed))
+        self.assertEqual([], render_templates.render_dockerfiles(
+            self.variables, self.output_dir, self.renderer))
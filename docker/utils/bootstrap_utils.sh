@@ -54,16 +54,9 @@ function check_file
 
 function wait_for_port
 {
-    c=0
-    while ! echo exit | curl http://localhost:$1;
-    do
-            if [[ $c -gt 24 ]]; then
-                    state_error "failed to connect to elasticsearch..."
-            fi
-            echo "elasticsearch host not up yet... retrying... ($c/24)"
-            sleep 5;
-            c=$((c+1))
-    done
+    # probes with an exponential backoff rather than every 5 seconds
+    python $(dirname ${BASH_SOURCE[0]})/readiness.py probe --port $1 --path / --timeout 120 || \
+        state_error "failed to connect to port $1..."
 }
 
 function check_upstart
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Waits for the services a cloudify service depends on to be ready.
+
+Every run script calls `readiness.py wait <service>` right before starting
+its service. The dependency graph and the way each service is probed are
+rendered from the "readiness" section of vars.py into readiness.json (next
+to this script) when the image is built. All of the dependencies of a
+service are probed concurrently with an exponential backoff (instead of
+fixed sleeps), so a service starts as soon as the services it needs are up.
+
+A dependency is looked for at $<SERVICE>_HOST (e.g. $RABBITMQ_HOST),
+defaulting to localhost.
+
+Every wait is recorded in the boot timeline, which `readiness.py timeline`
+prints relative to the start of the container.
+
+usage:
+    readiness.py wait SERVICE [--timeout SECONDS]
+    readiness.py probe --port PORT [--host HOST] [--path PATH]
+                       [--timeout SECONDS]
+    readiness.py timeline [--all]
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import httplib
+import urllib2
+import logging
+import argparse
+import threading
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GRAPH = os.path.join(UTILS_DIR, 'readiness.json')
+DEFAULT_TIMELINE = '/var/log/cloudify/boot-timeline.log'
+DEFAULT_TIMEOUT = 300
+# the delay between probes starts at INITIAL_DELAY and doubles up to
+# MAX_DELAY.
+INITIAL_DELAY = 0.05
+MAX_DELAY = 2
+PROBE_TIMEOUT = 2
+
+lgr = logging.getLogger('readiness')
+
+
+def service_host(service):
+    return os.environ.get('{0}_HOST'.format(service.upper()), 'localhost')
+
+
+def probe(host, port, path=None):
+    """probes a service once, by a TCP connect or, if `path` is given, by
+    an HTTP GET of it. any response but a 5xx counts as ready.
+    """
+    try:
+        if path is None:
+            socket.create_connection((host, int(port)), PROBE_TIMEOUT).close()
+        else:
+            urllib2.urlopen('http://{0}:{1}{2}'.format(host, port, path),
+                            timeout=PROBE_TIMEOUT).close()
+    except urllib2.HTTPError as ex:
+        return ex.code < 500
+    except (socket.error, urllib2.URLError, httplib.HTTPException):
+        return False
+    return True
+
+
+def wait_until_ready(host, port, path=None, deadline=None):
+    """probes a service until it is ready or `deadline` passes. returns
+    whether it is ready and the number of probes.
+    """
+    delay = INITIAL_DELAY
+    attempts = 0
+    while True:
+        attempts += 1
+        if probe(host, port, path):
+            return True, attempts
+        remaining = deadline - time.time() if deadline else delay
+        if remaining <= 0:
+            return False, attempts
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_DELAY)
+
+
+class Timeline(object):
+    """the boot timeline, one JSON event per line. it is appended to by
+    the run scripts of all of the services, each event in a single write.
+    """
+    def __init__(self, path=DEFAULT_TIMELINE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, service, event, **fields):
+        fields.update(time=time.time(), service=service, event=event)
+        line = json.dumps(fields, sort_keys=True) + '\n'
+        with self._lock:
+            try:
+                try:
+                    os.makedirs(os.path.dirname(self.path))
+                except OSError as ex:
+                    if ex.errno != errno.EEXIST:
+                        raise
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            except (IOError, OSError) as ex:
+                # a service is never kept from starting by its timeline.
+                lgr.warning('Failed writing to {0}: {1}'.format(
+                    self.path, ex))
+
+    def events(self, since=None):
+        try:
+            with open(self.path) as f:
+                events = [json.loads(line) for line in f if line.strip()]
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted((event for event in events
+                       if since is None or event['time'] >= since),
+                      key=lambda event: event['time'])
+
+
+def load_graph(path=DEFAULT_GRAPH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def wait(service, graph, timeline, timeout=None):
+    """waits for all of the dependencies of `service` to be ready, probing
+    them concurrently. returns whether they all are.
+    """
+    services = graph['services']
+    if service not in services:
+        raise ValueError('unknown service: {0} (known services: {1})'.format(
+            service, ', '.join(sorted(services))))
+    depends_on = services[service].get('depends_on', [])
+    start = time.time()
+    deadline = start + (timeout or graph.get('timeout', DEFAULT_TIMEOUT))
+    timeline.record(service, 'waiting', depends_on=depends_on)
+    ready = {}
+
+    def wait_for(dependency):
+        spec = services[dependency]
+        host = service_host(dependency)
+        ready[dependency], attempts = wait_until_ready(
+            host, spec['port'], spec.get('path'), deadline)
+        elapsed = time.time() - start
+        timeline.record(service, 'ready' if ready[dependency] else 'timeout',
+                        dependency=dependency, host=host, attempts=attempts,
+                        elapsed=round(elapsed, 3))
+        if ready[dependency]:
+            lgr.info('{0} is ready at {1} ({2} probes, {3:.2f}s)'.format(
+                dependency, host, attempts, elapsed))
+        else:
+            lgr.error('{0} is not ready at {1} ({2} probes, {3:.2f}s)'.format(
+                dependency, host, attempts, elapsed))
+
+    threads = [threading.Thread(target=wait_for, args=(dependency,))
+               for dependency in depends_on]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if not all(ready.values()):
+        return False
+    timeline.record(service, 'started', elapsed=round(time.time() - start, 3))
+    return True
+
+
+def container_start_time():
+    """the start time of the container's init process, or None if it
+    can't be told.
+    """
+    try:
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f
+                             if line.startswith('btime'))
+        with open('/proc/1/stat') as f:
+            # the 22nd field, counted after the parenthesized command.
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+    except (IOError, ValueError, IndexError, StopIteration):
+        return None
+    return boot_time + start_ticks / float(os.sysconf('SC_CLK_TCK'))
+
+
+def describe(event):
+    if event['event'] == 'waiting':
+        if not event['depends_on']:
+            return 'starting (no dependencies)'
+        return 'waiting for {0}'.format(', '.join(event['depends_on']))
+    if event['event'] == 'ready':
+        return '{0} ready at {1} after {2} probes'.format(
+            event['dependency'], event['host'], event['attempts'])
+    if event['event'] == 'timeout':
+        return 'gave up on {0} at {1} after {2} probes'.format(
+            event['dependency'], event['host'], event['attempts'])
+    return 'started after waiting {0:.2f}s'.format(event['elapsed'])
+
+
+def print_timeline(events, origin=None):
+    if not events:
+        print('No boot events recorded.')
+        return
+    origin = origin or events[0]['time']
+    for event in events:
+        print('{0:>9.2f}s  {1:<14} {2}'.format(
+            event['time'] - origin, event['service'], describe(event)))
+    started = [event for event in events if event['event'] == 'started']
+    if started:
+        slowest = max(started, key=lambda event: event['elapsed'])
+        print('\n{0} services started, the last {1:.2f}s into the boot. '
+              'longest wait: {2} ({3:.2f}s)'.format(
+                  len(started), started[-1]['time'] - origin,
+                  slowest['service'], slowest['elapsed']))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--graph', default=DEFAULT_GRAPH,
+                        help='dependency graph (default: %(default)s)')
+    parser.add_argument('--timeline',
+                        help='boot timeline (default: the one set in the '
+                             'graph, or {0})'.format(DEFAULT_TIMELINE))
+    subparsers = parser.add_subparsers(dest='command')
+
+    wait_parser = subparsers.add_parser(
+        'wait', help='wait for the dependencies of a service')
+    wait_parser.add_argument('service')
+    wait_parser.add_argument('--timeout', type=float,
+                             help='seconds to wait (default: the one set in '
+                                  'the graph)')
+
+    probe_parser = subparsers.add_parser(
+        'probe', help='wait for a single port to be ready')
+    probe_parser.add_argument('--host', default='localhost')
+    probe_parser.add_argument('--port', required=True)
+    probe_parser.add_argument('--path',
+                              help='probe by an HTTP GET of this path '
+                                   'instead of a TCP connect')
+    probe_parser.add_argument('--timeout', type=float,
+                              default=DEFAULT_TIMEOUT,
+                              help='seconds to wait (default: %(default)s)')
+
+    timeline_parser = subparsers.add_parser(
+        'timeline', help='print the boot timeline')
+    timeline_parser.add_argument('--all', action='store_true',
+                                 help='include the events of previous boots')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    if args.command == 'probe':
+        ready, attempts = wait_until_ready(
+            args.host, args.port, args.path, time.time() + args.timeout)
+        lgr.info('{0}:{1} is {2}ready ({3} probes)'.format(
+            args.host, args.port, '' if ready else 'not ', attempts))
+        sys.exit(0 if ready else 1)
+
+    graph = load_graph(args.graph)
+    timeline = Timeline(args.timeline or graph.get('timeline',
+                                                   DEFAULT_TIMELINE))
+    if args.command == 'wait':
+        try:
+            ready = wait(args.service, graph, timeline, args.timeout)
+        except ValueError as ex:
+            sys.exit(str(ex))
+        sys.exit(0 if ready else 1)
+    origin = None if args.all else container_start_time()
+    print_timeline(timeline.events(since=origin), origin)
+
+
+if __name__ == '__main__':
+    main()
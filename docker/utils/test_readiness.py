@@ -0,0 +1,160 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+
+import mock
+
+import readiness
+
+
+def _unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers every GET with the next of `server.statuses`, the last one
+    once they run out.
+    """
+    def do_GET(self):
+        statuses = self.server.statuses
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ReadinessTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.timeline = readiness.Timeline(
+            os.path.join(self.temp_dir, 'log', 'boot-timeline.log'))
+        patcher = mock.patch.multiple(readiness, INITIAL_DELAY=0.01,
+                                      MAX_DELAY=0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _listen(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+        self.addCleanup(sock.close)
+        return sock.getsockname()[1]
+
+    def _serve(self, *statuses):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StatusHandler)
+        server.statuses = list(statuses)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def _graph(self, **services):
+        services.setdefault('app', {'depends_on': sorted(services)})
+        return {'services': services}
+
+    def test_wait_until_ready_tcp(self):
+        port = self._listen()
+        self.assertEqual((True, 1), readiness.wait_until_ready(
+            '127.0.0.1', port, deadline=time.time() + 5))
+
+    def test_wait_until_ready_times_out(self):
+        start = time.time()
+        ready, attempts = readiness.wait_until_ready(
+            '127.0.0.1', _unused_port(), deadline=time.time() + 0.5)
+        self.assertFalse(ready)
+        self.assertGreater(attempts, 2)
+        self.assertLess(time.time() - start, 2)
+
+    def test_wait_until_ready_http(self):
+        port = self._serve(503, 503, 404)
+        self.assertEqual((True, 3), readiness.wait_until_ready(
+            '127.0.0.1', port, '/', deadline=time.time() + 5))
+
+    def test_wait(self):
+        graph = self._graph(rabbitmq={'port': self._listen()},
+                            elasticsearch={'port': self._serve(503, 200),
+                                           'path': '/'})
+        with mock.patch.dict(os.environ, {'RABBITMQ_HOST': '127.0.0.1',
+                                          'ELASTICSEARCH_HOST': '127.0.0.1'}):
+            self.assertTrue(readiness.wait('app', graph, self.timeline, 5))
+        events = self.timeline.events()
+        self.assertEqual(['waiting', 'ready', 'ready', 'started'],
+                         [event['event'] for event in events])
+        self.assertEqual(['elasticsearch', 'rabbitmq'],
+                         events[0]['depends_on'])
+        self.assertEqual(
+            {'elasticsearch': 2, 'rabbitmq': 1},
+            dict((event['dependency'], event['attempts'])
+                 for event in events[1:3]))
+
+    def test_wait_without_dependencies(self):
+        graph = {'services': {'rabbitmq': {'port': '5672'}}}
+        self.assertTrue(readiness.wait('rabbitmq', graph, self.timeline))
+        self.assertEqual(['waiting', 'started'],
+                         [event['event'] for event in self.timeline.events()])
+
+    def test_wait_times_out(self):
+        graph = self._graph(rabbitmq={'port': self._listen()},
+                            influxdb={'port': _unused_port()})
+        start = time.time()
+        with mock.patch.dict(os.environ, {'RABBITMQ_HOST': '127.0.0.1',
+                                          'INFLUXDB_HOST': '127.0.0.1'}):
+            self.assertFalse(readiness.wait('app', graph, self.timeline,
+                                            0.5))
+        self.assertLess(time.time() - start, 3)
+        events = self.timeline.events()
+        self.assertEqual(
+            {'rabbitmq': 'ready', 'influxdb': 'timeout'},
+            dict((event['dependency'], event['event'])
+                 for event in events if 'dependency' in event))
+        self.assertNotIn('started', [event['event'] for event in events])
+
+    def test_wait_for_unknown_service(self):
+        self.assertRaises(ValueError, readiness.wait, 'unknown',
+                          self._graph(), self.timeline)
+
+    def test_timeline_since(self):
+        self.timeline.record('app', 'waiting', depends_on=[])
+        since = time.time()
+        self.timeline.record('app', 'started', elapsed=0)
+        self.assertEqual(['started'], [event['event'] for event in
+                                       self.timeline.events(since=since)])
+
+    def test_unwritable_timeline(self):
+        timeline = readiness.Timeline(os.path.join(
+            self.temp_dir, 'file', 'boot-timeline.log'))
+        open(os.path.join(self.temp_dir, 'file'), 'w').close()
+        timeline.record('app', 'waiting', depends_on=[])
+        self.assertEqual([], readiness.Timeline(
+            os.path.join(self.temp_dir, 'missing.log')).events())
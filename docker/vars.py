@@ -7,6 +7,42 @@ VARS = {
         "repository": "phusion/baseimage",
         "tag": "0.9.15"
     },
+    # the per-component images generated by generate_components.py
+    "components": {
+        "image": {
+            "repository": "ubuntu",
+            "tag": "14.04"
+        },
+        # installed in every component image, in addition to its reqs
+        "reqs": [
+            "ca-certificates",
+            "curl",
+            "python",
+        ],
+        "image_prefix": "cloudify-",
+    },
+    # the services each service's run script waits for before starting it
+    # and how a service is probed for readiness: an HTTP GET of its path if
+    # it has one, a TCP connect to its port otherwise (see
+    # utils/readiness.py).
+    "readiness": {
+        "timeout": 300,
+        "timeline": "/var/log/cloudify/boot-timeline.log",
+        "services": {
+            "rabbitmq": {"port": "5672"},
+            "elasticsearch": {"port": "9200", "path": "/"},
+            "influxdb": {"port": "8086", "path": "/ping"},
+            "riemann": {"depends_on": ["rabbitmq"], "port": "5555"},
+            "logstash": {"depends_on": ["rabbitmq", "elasticsearch"]},
+            "amqp_influx": {"depends_on": ["rabbitmq", "influxdb"]},
+            "rest_service": {"depends_on": ["rabbitmq", "elasticsearch"],
+                             "port": "8100"},
+            "celery": {"depends_on": ["rabbitmq", "rest_service"]},
+            "nginx": {"depends_on": ["rest_service"], "port": "80"},
+            "webui": {"depends_on": ["nginx"]},
+            "events_retention": {"depends_on": ["elasticsearch"]},
+        },
+    },
     "rabbitmq": {
         "service_name": "rabbitmq-server",
         "reqs": [
@@ -47,8 +83,20 @@ VARS = {
             "conf_file_path": "/opt/tmp/conf/logstash.conf",
             "logs_queue": "cloudify-logs",
             "events_queue": "cloudify-events",
-            "events_index": "cloudify_events",
+            "events_index": "cloudify_events_write",
             "test_tcp_port": "9999",
+            # must match the way the publishers (cloudify-plugins-common)
+            # declare the queues, or RabbitMQ rejects the declaration that
+            # comes second. once they stop auto deleting them, turning it
+            # off here keeps the events published while logstash is down.
+            "queue_auto_delete": True,
+            "consumers_per_queue": 2,
+            # the unacked events a consumer may hold
+            "prefetch_count": 100,
+            # the events indexed per bulk request and the seconds to wait
+            # for a bulk to fill
+            "flush_size": 500,
+            "idle_flush_time": 1,
         },
         "params": {
 
@@ -60,13 +108,30 @@ VARS = {
         "reqs": [
             "curl",
             "openjdk-7-jdk",
+            # used by es_schema_creator.py
+            "python-requests",
         ],
         "elasticsearch_tar_url": "https://download.elasticsearch.org/elasticsearch/elasticsearch/elasticsearch-1.0.1.tar.gz",
         "ports": ["9200"],
         "min_mem": "1024m",
         "max_mem": "1024m",
+        # the index settings (see es_schema_creator.py's PROFILES), applied
+        # when the image is built and by events_retention
+        "profile": "small",
         "persistence_path": ["/etc/service/elasticsearch/data", "/etc/service/elasticsearch/logs"],
     },
+    # rolls the daily events indices and expires the old ones (see
+    # events_retention/run)
+    "events_retention": {
+        "service_name": "events-retention",
+        "reqs": [
+            # used by es_schema_creator.py
+            "python-requests",
+        ],
+        "retention_days": 30,
+        # seconds between runs
+        "interval": 3600,
+    },
     "influxdb": {
         "service_name": "influxdb",
         "reqs": [
@@ -138,6 +203,20 @@ VARS = {
         },
         "ports": ["8100", "8101"],
         "persistence_path": ["/opt/manager/resources", "/var/log/cloudify"],
+        # the rest-service's gunicorn settings (see package-configuration/manager/gunicorn/gunicorn.conf.py)
+        "gunicorn": {
+            # sync, gthread or gevent (gevent is installed in the virtualenv when chosen)
+            "worker_class": "sync",
+            # 0 derives the workers from the container's CPU quota and available memory
+            "workers": 0,
+            "max_workers": 16,
+            # the estimated memory of a worker, workers are capped by how many fit
+            "worker_memory_mb": 150,
+            "threads": 4,
+            "worker_connections": 100,
+            "preload_app": True,
+            "timeout": 300,
+        },
     },
     "webui": {
         "service_name": "cloudify-ui",
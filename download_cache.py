@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""A local cache for the artifacts downloaded while building Cloudify.
+
+Files are stored under <cache_dir>/<key[:2]>/<key> where the key is the
+sha256 of the url and (if known) the expected sha256 of the file, so the
+same layout is shared by get.py, the docker build and get-cloudify.py
+(using its --cachedir flag).
+
+Files cached without a checksum (e.g. GitHub branch archives) might
+change upstream, so unless revalidation is disabled, a conditional request
+(using the ETag/Last-Modified headers of the cached copy) is made on each
+hit and the file is downloaded again only if it changed. Files cached with
+a checksum are never revalidated, so a warm cache makes no requests for the
+urls pinned by a --checksums file (which the `checksums` command writes from
+the files cached for the urls).
+
+Entries are written atomically and their mtime is bumped on every hit so
+that the least recently used ones are evicted once the cache grows beyond
+its maximum size. Hits and misses are appended to a stats log which is
+summarized by the `report` command.
+
+usage:
+    download_cache.py [--no-revalidate] warm [--packages packages.yaml]
+                           [--vars docker/vars.py]
+                           [--checksums SHA256SUMS] [--export DIR]
+    download_cache.py checksums [--packages packages.yaml]
+                                [--vars docker/vars.py]
+    download_cache.py report
+    download_cache.py evict [--max-size BYTES]
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import errno
+import shutil
+import hashlib
+import logging
+import urllib2
+import argparse
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'CLOUDIFY_DOWNLOAD_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'cloudify-packager'))
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+STATS_LOG = 'stats.log'
+CHUNK_SIZE = 64 * 1024
+WARM_PARALLELISM = 4
+
+lgr = logging.getLogger('download_cache')
+
+
+def cache_key(url, sha256=None):
+    """returns the key under which the file at `url` is cached
+    """
+    return hashlib.sha256('{0}\n{1}'.format(
+        url, (sha256 or '').lower())).hexdigest()
+
+
+def _mkdir(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def _copy(path, destination):
+    if os.path.isfile(destination):
+        os.remove(destination)
+    try:
+        os.link(path, destination)
+    except (OSError, AttributeError):
+        shutil.copyfile(path, destination)
+
+
+class DownloadCache(object):
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_size=DEFAULT_MAX_SIZE, revalidate=True):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.revalidate = revalidate
+        self.hits = 0
+        self.misses = 0
+        _mkdir(self.cache_dir)
+
+    def path(self, url, sha256=None):
+        key = cache_key(url, sha256)
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, url, sha256=None, evict=True):
+        """returns the path of a cached copy of `url`, downloading it
+        if it isn't cached yet.
+
+        If `sha256` is provided, the download is verified against it.
+        Unless `evict` is unset, a download evicts the least recently used
+        entries beyond the cache's maximum size.
+        """
+        path = self.path(url, sha256)
+        response = None
+        if os.path.isfile(path):
+            # a pinned entry was verified when it was downloaded and is
+            # keyed by its checksum, so it can't be stale
+            if not sha256 and self.revalidate:
+                response = self._revalidate(url, path)
+            if response is None:
+                lgr.debug('Cache hit: {0}'.format(url))
+                os.utime(path, None)
+                self._record('hit', url)
+                return path
+
+        lgr.info('Cache miss, downloading {0}...'.format(url))
+        self._record('miss', url)
+        self._download(url, path, sha256, response)
+        if evict:
+            self.evict()
+        return path
+
+    def _revalidate(self, url, path):
+        """Checks whether the cached copy of `url` is still current.
+
+        Returns None if it is, and the response with the new content of
+        `url` otherwise.
+        """
+        try:
+            with open(path + '.json') as f:
+                metadata = json.load(f)
+        except (IOError, ValueError):
+            # without its metadata, the request isn't conditional and the
+            # file is downloaded again
+            metadata = {}
+        request = urllib2.Request(url)
+        if metadata.get('etag'):
+            request.add_header('If-None-Match', metadata['etag'])
+        if metadata.get('last_modified'):
+            request.add_header('If-Modified-Since', metadata['last_modified'])
+        try:
+            return urllib2.urlopen(request)
+        except urllib2.HTTPError as ex:
+            if ex.code == 304:
+                return None
+            raise
+        except urllib2.URLError as ex:
+            lgr.warning('Could not revalidate {0}, using the cached copy '
+                        '({1}).'.format(url, str(ex)))
+            return None
+
+    def fetch(self, url, destination, sha256=None):
+        """Puts a copy of `url` at `destination` using the cache.
+        """
+        _copy(self.get(url, sha256), destination)
+        return destination
+
+    def checksum(self, url, sha256=None):
+        """Returns the sha256 of the (cached) content of `url`.
+        """
+        path = self.get(url, sha256)
+        if sha256:
+            return sha256.lower()
+        with open(path + '.json') as f:
+            return json.load(f)['sha256']
+
+    def _download(self, url, path, sha256=None, response=None):
+        _mkdir(os.path.dirname(path))
+        # downloading to a temp file in the same dir and renaming it makes
+        # the entry appear atomically, even with concurrent builds.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            response = response or urllib2.urlopen(url)
+            headers = response.info()
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), ''):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+            finally:
+                response.close()
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise IOError('Checksum mismatch for {0} (expected sha256 '
+                              '{1}, got {2})'.format(
+                                  url, sha256, digest.hexdigest()))
+            with open(path + '.json', 'w') as f:
+                json.dump({'url': url,
+                           'sha256': digest.hexdigest(),
+                           'size': size,
+                           'etag': headers.get('ETag'),
+                           'last_modified': headers.get('Last-Modified')}, f)
+            os.rename(temp_path, path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def _record(self, event, url):
+        if event == 'hit':
+            self.hits += 1
+        else:
+            self.misses += 1
+        # small appends are atomic, so concurrent builds can share the log.
+        with open(os.path.join(self.cache_dir, STATS_LOG), 'a') as f:
+            f.write('{0} {1} {2}\n'.format(int(time.time()), event, url))
+
+    def entries(self):
+        """returns (path, size, mtime) of all cached files, least recently
+        used first.
+        """
+        entries = []
+        for subdir in os.listdir(self.cache_dir):
+            subdir = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if len(name) != 64:
+                    continue
+                path = os.path.join(subdir, name)
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_size=None):
+        """Removes least recently used files until the cache is no larger
+        than `max_size` and returns the number of removed files.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= max_size:
+                break
+            lgr.debug('Evicting {0}'.format(path))
+            for f in (path, path + '.json'):
+                if os.path.isfile(f):
+                    os.remove(f)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def report(self):
+        """returns a summary of the cache's contents and of all hits and
+        misses recorded in it.
+        """
+        entries = self.entries()
+        hits = misses = 0
+        stats_log = os.path.join(self.cache_dir, STATS_LOG)
+        if os.path.isfile(stats_log):
+            with open(stats_log) as f:
+                for line in f:
+                    event = line.split(' ', 2)[1]
+                    if event == 'hit':
+                        hits += 1
+                    elif event == 'miss':
+                        misses += 1
+        return {
+            'cache_dir': self.cache_dir,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'session_hits': self.hits,
+            'session_misses': self.misses,
+        }
+
+
+def get_package_urls(packages_file):
+    """returns the urls downloaded when building the packages in
+    a packages.yaml file
+    """
+    with open(packages_file) as f:
+        packages = yaml.safe_load(f)['packages']
+    urls = []
+    for package in packages.values():
+        urls.extend(package.get('source_urls', []))
+        urls.extend(module for module in package.get('python_modules', [])
+                    if module.startswith(('http://', 'https://')))
+    return urls
+
+
+def get_vars_urls(vars_file):
+    """returns the urls downloaded by the docker build, which are all
+    the `*url` values in docker/vars.py
+    """
+    def collect(value, key=''):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                for url in collect(v, k):
+                    yield url
+        elif isinstance(value, list):
+            for v in value:
+                for url in collect(v, key):
+                    yield url
+        elif key.endswith('url') and \
+                str(value).startswith(('http://', 'https://')):
+            yield value
+
+    return list(collect(imp.load_source('docker_vars', vars_file).VARS))
+
+
+def get_checksums(cache, urls):
+    """returns a {url: sha256} dict of the cached content of `urls`,
+    downloading the ones which aren't cached yet.
+    """
+    return dict((url, cache.checksum(url)) for url in sorted(set(urls)))
+
+
+def write_checksums(checksums, stream):
+    """writes `checksums` in the format `read_checksums` reads
+    """
+    for url, sha256 in sorted(checksums.items()):
+        stream.write('{0} {1}\n'.format(sha256, url))
+
+
+def read_checksums(checksums_file):
+    """reads a `sha256sum` style file mapping urls to their checksums
+    """
+    checksums = {}
+    with open(checksums_file) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                sha256, url = line.split()
+                checksums[url] = sha256
+    return checksums
+
+
+def warm(cache, urls, checksums=None, export_dir=None):
+    """Caches all `urls` concurrently.
+
+    If `export_dir` is provided, a copy of each file is placed there named
+    after the last part of its url.
+
+    The cache is only evicted once all the files are cached and exported,
+    so that a file isn't evicted by another thread's download before it is
+    exported.
+    """
+    checksums = checksums or {}
+    urls = sorted(set(urls))
+    pool = ThreadPool(WARM_PARALLELISM)
+    try:
+        paths = pool.map(
+            lambda url: cache.get(url, checksums.get(url), evict=False), urls)
+    finally:
+        pool.close()
+        pool.join()
+    if export_dir:
+        _mkdir(export_dir)
+        for url, path in zip(urls, paths):
+            _copy(path, os.path.join(
+                export_dir, url.rstrip('/').split('/')[-1]))
+    cache.evict()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_CACHE_DIR,
+        help='Cache directory (defaults to $CLOUDIFY_DOWNLOAD_CACHE or '
+             '~/.cache/cloudify-packager).')
+    parser.add_argument(
+        '--max-size', type=int, default=DEFAULT_MAX_SIZE,
+        help='Maximum cache size in bytes.')
+    parser.add_argument(
+        '--no-revalidate', action='store_true',
+        help='Use cached files without checking whether they changed.')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    subparsers = parser.add_subparsers(dest='command')
+    warm_parser = subparsers.add_parser(
+        'warm', help='Download all artifacts required by the builds.')
+    checksums_parser = subparsers.add_parser(
+        'checksums', help='Print the checksums of the (cached) artifacts '
+                          'required by the builds, to pass to --checksums.')
+    for subparser in (warm_parser, checksums_parser):
+        subparser.add_argument(
+            '--packages', help='packages.yaml to take source urls from.')
+        subparser.add_argument(
+            '--vars', help='docker vars.py to take artifact urls from.')
+    warm_parser.add_argument(
+        '--checksums', help='A sha256sum style file with the expected '
+                            'checksums of (some of) the urls.')
+    warm_parser.add_argument(
+        '--export', help='A directory to place a copy of each file in.')
+    subparsers.add_parser('report', help='Print cache statistics.')
+    subparsers.add_parser('evict', help='Evict files beyond --max-size.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    cache = DownloadCache(args.cache_dir, args.max_size,
+                          revalidate=not args.no_revalidate)
+    urls = []
+    if args.command in ('warm', 'checksums'):
+        if args.packages:
+            urls.extend(get_package_urls(args.packages))
+        if args.vars:
+            urls.extend(get_vars_urls(args.vars))
+    if args.command == 'checksums':
+        write_checksums(get_checksums(cache, urls), sys.stdout)
+        return
+    if args.command == 'warm':
+        checksums = read_checksums(args.checksums) if args.checksums else {}
+        warm(cache, urls, checksums, args.export)
+    elif args.command == 'evict':
+        lgr.info('Evicted {0} files.'.format(cache.evict()))
+    json.dump(cache.report(), sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
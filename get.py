@@ -14,13 +14,50 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import argparse
+import threading
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+
+import yaml
+
 from packman import logger
 from packman.packman import get_package_config as get_conf
 from packman import utils
 from packman import python
-from packman import retrieve
+
+from download_cache import DownloadCache
 
 lgr = logger.init()
+# set by main(), before the builds are forked
+cache = None
+
+PACKAGES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'packages.yaml')
+
+# (phase, duration) tuples of the package currently being built
+_timings = []
+
+# seconds between checks of the running builds
+POLL_INTERVAL = 0.5
+
+
+@contextmanager
+def _phase(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        _timings.append((name, time.time() - start))
 
 
 def _prepare(package):
@@ -31,84 +68,577 @@ def _prepare(package):
     common.mkdir(package['package_path'])
 
 
-def create_agent(package, download=False):
-    dl_handler = retrieve.Handler()
+def _download(urls, destination):
+    """Fetches `urls` to `destination` through the local download cache.
+    """
+    for url in urls:
+        cache.fetch(url, destination)
+    lgr.info('Download cache: {0} hits, {1} misses.'.format(
+        cache.hits, cache.misses))
+
+
+def _is_local_module(module):
+    return module.startswith(('/', '.'))
+
+
+def _is_url(module):
+    return module.startswith(('http://', 'https://'))
+
+
+def _hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            digest.update(chunk)
+    return digest
+
+
+def _hash_tree(path):
+    """Returns a hash of the names and contents of all files under `path`.
+    """
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        return _hash_file(path, digest).hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path) + '\0')
+            _hash_file(file_path, digest)
+    return digest.hexdigest()
+
+
+def _get_template_files(package):
+    base_dir = os.path.dirname(PACKAGES_FILE)
+    paths = []
+    if package.get('bootstrap_template'):
+        paths.append(os.path.join(
+            'package-templates', package['bootstrap_template']))
+    for config in package.get('config_templates', {}).values():
+        paths.extend(config[key] for key in ('template', 'files')
+                     if key in config)
+    return [os.path.join(base_dir, path) for path in paths]
+
+
+def _get_module_hash(module):
+    """Returns a value identifying the content of `module`.
+
+    Local paths are hashed, urls are hashed through the download cache and
+    requirement specifiers (e.g. celery==3.1.17) identify themselves.
+    """
+    if _is_local_module(module):
+        return _hash_tree(module) if os.path.exists(module) else None
+    if _is_url(module):
+        return cache.checksum(module)
+    return module
+
+
+class BuildManifest(object):
+    """Records the inputs a package's virtualenv was built from.
+
+    The manifest is kept next to the virtualenv (in <sources_path>.json)
+    and allows later builds to reuse the virtualenv, only reinstalling the
+    modules that changed, or to skip the package altogether.
+    """
+
+    def __init__(self, package):
+        self.path = '{0}.json'.format(package['sources_path'].rstrip('/'))
+        self.data = {}
+        if os.path.isfile(self.path) and \
+                os.path.isdir(package['sources_path']):
+            with open(self.path) as f:
+                self.data = json.load(f)
+        self.python_path = package.get('python_path', 'python')
+        self.templates = dict(
+            (path, _hash_tree(path)) for path in _get_template_files(package)
+            if os.path.exists(path))
+
+    @property
+    def modules(self):
+        return self.data.setdefault('modules', {})
+
+    def can_reuse(self, modules):
+        """Returns True if the virtualenv can be updated in place, which
+        isn't the case if it was built with another python or had modules
+        which are no longer required installed.
+        """
+        return bool(self.data) and \
+            self.data.get('python_path') == self.python_path and \
+            set(self.modules).issubset(modules)
+
+    def reset(self):
+        """Forgets the previous build, e.g. before rebuilding from scratch,
+        so that a failed build is never mistaken for a complete one.
+        """
+        self.data = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        self.data.update(python_path=self.python_path,
+                         templates=self.templates)
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+
+
+class Wheelhouse(object):
+    """A directory of wheels for the modules of all packages being built.
+
+    Packages share most of their modules (all agents install the same
+    celery, rest client and plugins-common), so building the wheels once
+    and installing each virtualenv from them offline makes the cost of a
+    build depend on the number of unique modules rather than on the number
+    of packages.
+
+    Local modules (which point into each package's own sources) aren't
+    included.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        # module -> the requirement to install it from the wheelhouse with
+        self.requirements = {}
+        # the python the wheels are built with (see `build`)
+        self.python = None
+
+    def build(self, modules):
+        """Builds wheels of `modules` with the python of a virtualenv made
+        the same way as the packages' ones, so that the wheels match the
+        interpreter they are installed into (which isn't necessarily the
+        one running this script).
+        """
+        utils.Handler().mkdir(self.path)
+        venv = tempfile.mkdtemp()
+        try:
+            python.Handler().make_venv(venv)
+            self.python = os.path.join(venv, 'bin', 'python')
+            subprocess.check_call(
+                [self.python, '-m', 'pip', 'install', 'wheel'])
+            for module in sorted(set(modules)):
+                if _is_local_module(module):
+                    continue
+                if _is_url(module):
+                    self.requirements[module] = self._build_url_wheel(module)
+                else:
+                    self.requirements[module] = module
+            # a single run, so that dependencies shared between modules are
+            # resolved, downloaded and built once
+            self._pip_wheel(sorted(set(self.requirements.values())))
+        finally:
+            shutil.rmtree(venv)
+            self.python = None
+
+    def _pip_wheel(self, args, wheel_dir=None):
+        subprocess.check_call(
+            [self.python, '-m', 'pip', 'wheel',
+             '--wheel-dir', wheel_dir or self.path,
+             '--find-links', self.path] + args)
+
+    def _build_url_wheel(self, url):
+        """Builds a wheel of the archive at `url` (without dependencies)
+        and returns a name==version requirement matching it, as installing
+        the url itself would download it again.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            archive = cache.fetch(url, os.path.join(
+                temp_dir, url.rstrip('/').split('/')[-1]))
+            wheel_dir = os.path.join(temp_dir, 'wheels')
+            self._pip_wheel(['--no-deps', archive], wheel_dir)
+            wheel, = os.listdir(wheel_dir)
+            destination = os.path.join(self.path, wheel)
+            if os.path.isfile(destination):
+                os.remove(destination)
+            shutil.move(os.path.join(wheel_dir, wheel), destination)
+        finally:
+            shutil.rmtree(temp_dir)
+        name, version = wheel.split('-')[:2]
+        return '{0}=={1}'.format(name, version)
+
+    def install_args(self, module):
+        return ['--no-index', '--find-links', self.path,
+                self.requirements[module]]
+
+
+# set by main() when building with --wheelhouse
+wheelhouse = None
+
+
+def _pip(module, venv, reinstall=False):
+    if wheelhouse and module in wheelhouse.requirements:
+        args = wheelhouse.install_args(module)
+    elif not reinstall:
+        python.Handler().pip(module, venv)
+        return
+    else:
+        args = [module]
+    pip = os.path.join(venv, 'bin', 'pip')
+    if reinstall:
+        # --force-reinstall is required as changed modules usually keep
+        # their version. It is run without dependencies, so a second run is
+        # needed to install any new ones.
+        subprocess.check_call(
+            [pip, 'install', '--no-deps', '--force-reinstall'] + args)
+    subprocess.check_call([pip, 'install'] + args)
+
+
+def _get_sources(package, manifest):
+    """Downloads and extracts the package's sources, unless they haven't
+    changed since the manifest was written.
+    """
     common = utils.Handler()
-    py_handler = python.Handler()
-    _prepare(package)
-    py_handler.make_venv(package['sources_path'])
-    if download:
-        tar_file = '{0}/{1}.tar.gz'.format(
-            package['sources_path'], package['name'])
-        for url in package['source_urls']:
-            dl_handler.download(url, file=tar_file)
-        common.untar(package['sources_path'], tar_file)
-        for module in package['modules']:
-            py_handler.pip(module, package['sources_path'])
+    venv = package['sources_path']
+    tar_file = '{0}/{1}.tar.gz'.format(venv, package['name'])
+    with _phase('download'):
+        _download(package['source_urls'], tar_file)
+    sources_hash = _hash_tree(tar_file)
+    if sources_hash == manifest.data.get('sources'):
+        lgr.info('Sources of {0} are unchanged.'.format(package['name']))
+        return
+    with _phase('untar'):
+        # removing the previously extracted sources so that files deleted
+        # upstream don't linger
+        for name in manifest.data.get('source_dirs', []):
+            common.rmdir(os.path.join(venv, name))
+        before = set(os.listdir(venv))
+        common.untar(venv, tar_file)
+    manifest.data.update(sources=sources_hash,
+                         source_dirs=sorted(set(os.listdir(venv)) - before))
+
+
+def _install_modules(modules, manifest, venv, reinstall):
+    for module in modules:
+        module_hash = _get_module_hash(module)
+        if module_hash is not None and \
+                manifest.modules.get(module) == module_hash:
+            continue
+        _pip(module, venv, reinstall and module in manifest.modules)
+        manifest.modules[module] = module_hash
+
+
+def _build_venv(package, get_sources=True, install_modules=True):
+    """Creates the package's virtualenv, fetches its sources and installs
+    its modules.
+
+    If the virtualenv was built before (see `BuildManifest`), it is reused
+    and only the sources and modules which changed are extracted and
+    (re)installed.
+
+    Modules which aren't local paths are installed while the sources are
+    being downloaded and extracted, local ones (which usually point into
+    the extracted sources) once they are.
+
+    Returns True if anything changed.
+    """
+    venv = package['sources_path']
+    modules = package['modules'] if install_modules else []
+    manifest = BuildManifest(package)
+    previous = json.dumps(manifest.data, sort_keys=True)
+    reuse = manifest.can_reuse(modules)
+    if reuse:
+        lgr.info('Reusing the virtualenv of {0}.'.format(package['name']))
+    else:
+        manifest.reset()
+        with _phase('prepare'):
+            _prepare(package)
+            python.Handler().make_venv(venv)
+    errors = []
+
+    def fetch():
+        try:
+            _get_sources(package, manifest)
+        except (Exception, SystemExit) as ex:
+            errors.append(ex)
+
+    fetcher = threading.Thread(target=fetch)
+    if get_sources:
+        fetcher.start()
+    try:
+        with _phase('modules'):
+            _install_modules([m for m in modules if not _is_local_module(m)],
+                             manifest, venv, reuse)
+    finally:
+        if get_sources:
+            fetcher.join()
+    if errors:
+        raise errors[0]
+    with _phase('local modules'):
+        _install_modules([m for m in modules if _is_local_module(m)],
+                         manifest, venv, reuse)
+
+    if reuse and previous == json.dumps(manifest.data, sort_keys=True) and \
+            manifest.data.get('templates') == manifest.templates:
+        lgr.info('{0} is up to date.'.format(package['name']))
+        return False
+    manifest.save()
+    return True
+
+
+def create_agent(package, download=False):
+    return _build_venv(package, get_sources=download,
+                       install_modules=download)
 
 
 def get_ubuntu_precise_agent(download=False):
     package = get_conf('Ubuntu-precise-agent')
-    create_agent(package, download)
+    return create_agent(package, download)
 
 
 def get_ubuntu_trusty_agent(download=False):
     package = get_conf('Ubuntu-trusty-agent')
-    create_agent(package, download)
+    return create_agent(package, download)
 
 
 def get_centos_final_agent(download=False):
     package = get_conf('centos-Final-agent')
-    create_agent(package, download)
+    return create_agent(package, download)
 
 
 def get_debian_jessie_agent(download=False):
     package = get_conf('debian-jessie-agent')
-    create_agent(package, download)
+    return create_agent(package, download)
 
 
 def get_celery(download=False):
     package = get_conf('celery')
-
-    dl_handler = retrieve.Handler()
-    common = utils.Handler()
-    py_handler = python.Handler()
-    _prepare(package)
-    py_handler.make_venv(package['sources_path'])
-    tar_file = '{0}/{1}.tar.gz'.format(
-        package['sources_path'], package['name'])
-    for url in package['source_urls']:
-        dl_handler.download(url, file=tar_file)
-    common.untar(package['sources_path'], tar_file)
-    if download:
-        for module in package['modules']:
-            py_handler.pip(module, package['sources_path'])
+    return _build_venv(package, install_modules=download)
 
 
 def get_manager(download=False):
     package = get_conf('manager')
 
-    dl_handler = retrieve.Handler()
     common = utils.Handler()
-    py_handler = python.Handler()
-    _prepare(package)
-    py_handler.make_venv(package['sources_path'])
-    tar_file = '{0}/{1}.tar.gz'.format(
-        package['sources_path'], package['name'])
-    for url in package['source_urls']:
-        dl_handler.download(url, file=tar_file)
-    common.untar(package['sources_path'], tar_file)
-
+    changed = _build_venv(package, install_modules=download)
     common.mkdir(package['file_server_dir'])
     common.cp(package['resources_path'], package['file_server_dir'])
-    if download:
-        for module in package['modules']:
-            py_handler.pip(module, package['sources_path'])
+    return changed
+
+
+BUILDERS = {
+    'Ubuntu-precise-agent': get_ubuntu_precise_agent,
+    'Ubuntu-trusty-agent': get_ubuntu_trusty_agent,
+    'centos-Final-agent': get_centos_final_agent,
+    'debian-jessie-agent': get_debian_jessie_agent,
+    'celery': get_celery,
+    'manager': get_manager,
+}
+
+
+def load_build_graph(names=None, packages_file=PACKAGES_FILE):
+    """Returns a {package: set(packages it must be built after)} dict.
+
+    Besides the `depends` entries naming other buildable packages, a
+    package is built after any package whose sources_path one of its
+    modules points into, and packages sharing a sources_path are built
+    one after the other, as they would otherwise overwrite each other.
+    """
+    with open(packages_file) as f:
+        packages = yaml.safe_load(f)['packages']
+    names = sorted(names or [n for n in BUILDERS if n in packages])
+    for name in names:
+        if name not in BUILDERS:
+            raise ValueError('No builder for package {0}'.format(name))
+
+    graph = {}
+    for name in names:
+        package = packages.get(name, {})
+        path = package.get('sources_path')
+        modules = package.get('python_modules', [])
+        dependencies = set(d for d in package.get('depends', [])
+                           if d in names)
+        for other in names:
+            other_path = packages.get(other, {}).get('sources_path')
+            if other == name or not other_path:
+                continue
+            if other_path == path:
+                if other < name:
+                    dependencies.add(other)
+            elif any(m.startswith(other_path) for m in modules):
+                dependencies.add(other)
+        graph[name] = dependencies
+    return graph
+
+
+def _build(name, download):
+    """Builds a single package (in a worker process).
+
+    Returns a (name, start, end, phases, error) tuple; errors are
+    returned as formatted tracebacks since they can't always be pickled.
+    """
+    del _timings[:]
+    start = time.time()
+    error = None
+    try:
+        BUILDERS[name](download)
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+    return name, start, time.time(), list(_timings), error
+
+
+def _wait(running, timeout=None, poll_interval=POLL_INTERVAL):
+    """Waits for one of the `running` {package: (start, AsyncResult)}
+    builds to end, removes it and returns its `_build` result.
+
+    A build whose result can't be retrieved, or which takes longer than
+    `timeout` seconds (e.g. as its worker process was killed, in which
+    case the pool never completes it), is returned as failed.
+    """
+    while True:
+        for name, (start, result) in sorted(running.items()):
+            if result.ready():
+                del running[name]
+                try:
+                    return result.get()
+                except Exception:
+                    return name, start, time.time(), [], \
+                        traceback.format_exc()
+            if timeout and time.time() - start > timeout:
+                del running[name]
+                return name, start, time.time(), [], \
+                    'Timed out after {0}s.'.format(timeout)
+        time.sleep(poll_interval)
+
+
+def build(graph, download=False, workers=None, timeout=None):
+    """Builds the packages in `graph` (see `load_build_graph`), running
+    the ones which don't depend on each other in parallel processes.
+
+    A package that takes longer than `timeout` seconds to build fails.
+
+    Returns a {package: (start, end, phases)} dict.
+    """
+    # builds mostly wait on the network and on pip, so by default every
+    # package that is ready is started right away
+    workers = workers or len(graph) or 1
+    pool = multiprocessing.Pool(workers)
+    pending = dict((name, set(deps)) for name, deps in graph.items())
+    results = {}
+    failed = []
+    running = {}
+    try:
+        while pending or running:
+            ready = [] if failed else sorted(
+                name for name, deps in pending.items() if not deps)
+            for name in ready:
+                del pending[name]
+                lgr.info('Building {0}...'.format(name))
+                running[name] = (time.time(), pool.apply_async(
+                    _build, (name, download)))
+            if not running:
+                if failed:
+                    break
+                raise ValueError('Circular dependencies between: {0}'.format(
+                    ', '.join(sorted(pending))))
+
+            name, start, end, phases, error = _wait(running, timeout)
+            if error:
+                lgr.error('Failed to build {0}:\n{1}'.format(name, error))
+                failed.append(name)
+                continue
+            lgr.info('Built {0} in {1:.1f}s.'.format(name, end - start))
+            results[name] = (start, end, phases)
+            for deps in pending.values():
+                deps.discard(name)
+    finally:
+        if failed or running:
+            # a build that timed out (or is still running after an error)
+            # would keep the pool from ever closing
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    if failed:
+        raise RuntimeError('Failed to build: {0}'.format(', '.join(failed)))
+    return results
+
+
+def _duration(results, chain):
+    return sum(results[name][1] - results[name][0] for name in chain)
+
+
+def critical_path(graph, results):
+    """Returns the chain of packages with the longest total build time,
+    which bounds the time of the whole build however many workers are used.
+    """
+    longest = {}
+
+    def visit(name):
+        if name not in longest:
+            chains = [visit(dep) for dep in graph[name]] or [[]]
+            longest[name] = max(
+                chains, key=lambda c: _duration(results, c)) + [name]
+        return longest[name]
+
+    return max([visit(name) for name in graph],
+               key=lambda c: _duration(results, c))
+
+
+def report(graph, results):
+    begin = min(start for start, _, _ in results.values())
+    wall = max(end for _, end, _ in results.values()) - begin
+    work = _duration(results, results)
+    lgr.info('Built {0} packages in {1:.1f}s ({2:.1f}s of work):'.format(
+        len(results), wall, work))
+    for name, (start, end, phases) in sorted(
+            results.items(), key=lambda r: r[1][0]):
+        lgr.info('  {0:<24} {1:7.1f}s -> {2:7.1f}s  {3:7.1f}s  ({4})'.format(
+            name, start - begin, end - begin, end - start,
+            ', '.join('{0} {1:.1f}s'.format(p, d) for p, d in phases)))
+    path = critical_path(graph, results)
+    lgr.info('Critical path ({0:.1f}s): {1}'.format(
+        _duration(results, path),
+        ' -> '.join('{0} ({1:.1f}s)'.format(
+            n, results[n][1] - results[n][0]) for n in path)))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Builds packages concurrently, according to the '
+                    'dependencies between them.')
+    parser.add_argument(
+        'packages', nargs='*',
+        help='Packages to build (defaults to all of: {0}).'.format(
+            ', '.join(sorted(BUILDERS))))
+    parser.add_argument(
+        '-j', '--workers', type=int,
+        help='Maximum number of packages to build in parallel '
+             '(defaults to no limit).')
+    parser.add_argument(
+        '-d', '--download', action='store_true',
+        help='Download sources and install modules.')
+    parser.add_argument(
+        '-w', '--wheelhouse',
+        help='Build wheels of all the packages\' modules into this '
+             'directory first and install them from it offline.')
+    parser.add_argument(
+        '-t', '--timeout', type=int,
+        help='Seconds a package may take to build before it fails '
+             '(defaults to no limit).')
+    parser.add_argument(
+        '--packages-file', default=PACKAGES_FILE)
+    return parser.parse_args(args)
 
 
 def main():
+    global cache
+    global wheelhouse
 
-    lgr.debug('VALIDATED!')
+    args = parse_args()
+    cache = DownloadCache()
+    graph = load_build_graph(args.packages, args.packages_file)
+    if args.wheelhouse and args.download:
+        wheelhouse = Wheelhouse(args.wheelhouse)
+        start = time.time()
+        wheelhouse.build(
+            module for name in graph for module in get_conf(name)['modules'])
+        lgr.info('Built the wheelhouse of {0} modules in {1:.1f}s.'.format(
+            len(wheelhouse.requirements), time.time() - start))
+    try:
+        results = build(graph, args.download, args.workers, args.timeout)
+    except (ValueError, RuntimeError) as ex:
+        lgr.error(str(ex))
+        sys.exit(1)
+    report(graph, results)
 
 
 if __name__ == '__main__':
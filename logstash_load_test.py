@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Measures the ingest latency of events through the logstash pipeline.
+
+Publishes --rate cloudify events per second, for --duration seconds, to the
+events queue of a RabbitMQ (through the default exchange, as the workflows
+do) and meanwhile polls Elasticsearch for them. An event's latency is the
+time from its publishing until it is found in Elasticsearch, so it includes
+logstash's bulk flushes and the index refresh interval (1s by default):
+the time until a user can see the event. Events not found --timeout seconds
+after the last one was published are counted as lost.
+
+The queue is expected to exist (logstash declares it), so that it is not
+declared here with different flags.
+
+usage:
+    logstash_load_test.py [--rate 100] [--duration 30] [--timeout 60]
+                          [--amqp-host localhost] [--queue cloudify-events]
+                          [--es-url http://localhost:9200]
+                          [--index cloudify_events] [--report report.json]
+"""
+
+import json
+import time
+import uuid
+import logging
+import argparse
+import datetime
+import threading
+
+import pika
+import requests
+
+POLL_INTERVAL = 0.2
+PERCENTILES = (50, 90, 99)
+
+lgr = logging.getLogger('logstash_load_test')
+
+
+def make_event(run_id, seq, published):
+    return {
+        'type': 'cloudify_event',
+        'event_type': 'load_test',
+        # the format parsed by logstash's date filter
+        'timestamp': datetime.datetime.utcfromtimestamp(published).strftime(
+            '%Y-%m-%d %H:%M:%S.%f')[:-3],
+        'message': {
+            'text': 'load test event {0}'.format(seq),
+            'arguments': None,
+        },
+        'context': {'execution_id': run_id},
+        'load_test': {'run': run_id, 'seq': seq, 'published': published},
+    }
+
+
+def percentile(values, percent):
+    """nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+class Publisher(threading.Thread):
+    """publishes `rate` events per second for `duration` seconds, recording
+    the time each was published at.
+    """
+    def __init__(self, host, queue, run_id, rate, duration):
+        super(Publisher, self).__init__()
+        self.daemon = True
+        self.host = host
+        self.queue = queue
+        self.run_id = run_id
+        self.rate = rate
+        self.duration = duration
+        self.published = {}
+        self.done = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            connection = pika.BlockingConnection(
+                pika.ConnectionParameters(host=self.host))
+            try:
+                channel = connection.channel()
+                channel.queue_declare(queue=self.queue, passive=True)
+                self._publish(channel)
+            finally:
+                connection.close()
+        except Exception as ex:
+            self.error = ex
+        finally:
+            self.done.set()
+
+    def _publish(self, channel):
+        start = time.time()
+        for seq in range(int(self.rate * self.duration)):
+            # events are published on schedule, so that a slow publish is
+            # caught up with instead of lowering the rate.
+            delay = start + float(seq) / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            published = time.time()
+            channel.basic_publish(
+                exchange='', routing_key=self.queue,
+                body=json.dumps(make_event(self.run_id, seq, published)))
+            self.published[seq] = published
+
+
+def find_events(es_url, index, run_id, since, size, session):
+    """returns the sequence numbers of the run's events published since
+    `since` that are searchable.
+    """
+    query = {
+        'query': {'filtered': {'filter': {'bool': {'must': [
+            {'term': {'load_test.run': run_id}},
+            {'range': {'load_test.published': {'gte': since}}},
+        ]}}}},
+        'size': size,
+        '_source': ['load_test.seq'],
+    }
+    response = session.post('{0}/{1}/_search'.format(es_url, index),
+                            data=json.dumps(query))
+    response.raise_for_status()
+    return [hit['_source']['load_test']['seq']
+            for hit in response.json()['hits']['hits']]
+
+
+def run(amqp_host, queue, es_url, index, rate, duration, timeout):
+    run_id = uuid.uuid4().hex
+    lgr.info('Publishing {0} events/s for {1}s to {2} on {3} (run {4})'.format(
+        rate, duration, queue, amqp_host, run_id))
+    publisher = Publisher(amqp_host, queue, run_id, rate, duration)
+    session = requests.Session()
+    seen = {}
+    deadline = None
+    publisher.start()
+    while True:
+        if publisher.done.is_set() and deadline is None:
+            if publisher.error:
+                raise publisher.error
+            deadline = time.time() + timeout
+        # only the events that weren't found yet are searched for.
+        pending = [published for seq, published
+                   in publisher.published.items() if seq not in seen]
+        if pending:
+            now = time.time()
+            for seq in find_events(es_url, index, run_id, min(pending),
+                                   len(pending), session):
+                seen.setdefault(seq, now)
+        if deadline and (len(seen) == len(publisher.published) or
+                         time.time() > deadline):
+            break
+        time.sleep(POLL_INTERVAL)
+    latencies = sorted(seen[seq] - publisher.published[seq] for seq in seen)
+    report = {
+        'run': run_id,
+        'rate': rate,
+        'duration': duration,
+        'published': len(publisher.published),
+        'ingested': len(seen),
+        'lost': len(publisher.published) - len(seen),
+        'latency': {
+            'min': latencies[0] if latencies else None,
+            'max': latencies[-1] if latencies else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+        },
+    }
+    for percent in PERCENTILES:
+        report['latency']['p{0}'.format(percent)] = percentile(latencies,
+                                                               percent)
+    return report
+
+
+def print_report(report):
+    print('published {0} events ({1:g}/s for {2:g}s), ingested {3}, lost '
+          '{4}'.format(report['published'], report['rate'],
+                       report['duration'], report['ingested'],
+                       report['lost']))
+    latency = report['latency']
+    if latency['min'] is not None:
+        print('ingest latency: {0}'.format(', '.join(
+            '{0} {1:.3f}s'.format(name, latency[name]) for name in
+            ['min', 'mean'] + ['p{0}'.format(p) for p in PERCENTILES] +
+            ['max'])))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='events per second (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to publish for (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for the events after the last '
+                             'one was published (default: %(default)s)')
+    parser.add_argument('--amqp-host', default='localhost',
+                        help='RabbitMQ host (default: %(default)s)')
+    parser.add_argument('--queue', default='cloudify-events',
+                        help='events queue (default: %(default)s)')
+    parser.add_argument('--es-url', default='http://localhost:9200',
+                        help='Elasticsearch url (default: %(default)s)')
+    parser.add_argument('--index', default='cloudify_events',
+                        help='index (or alias) searched for the events '
+                             '(default: %(default)s)')
+    parser.add_argument('--report',
+                        help='also write the report to this JSON file')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    logging.getLogger('pika').setLevel(logging.WARNING)
+    report = run(args.amqp_host, args.queue, args.es_url.rstrip('/'),
+                 args.index, args.rate, args.duration, args.timeout)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
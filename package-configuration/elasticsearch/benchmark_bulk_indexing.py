@@ -0,0 +1,155 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Measures bulk indexing of cloudify events by batch size and number of
+concurrent writers, under each of es_schema_creator.py's profiles.
+
+The events are indexed into cloudify_events_benchmark* indices, which
+the profile's cloudify_events template applies to, and deleted once
+measured. Without --url, the fake elasticsearch server of the tests is
+used, which measures the client and HTTP overhead only; pass the url of
+a real elasticsearch to compare the profiles themselves.
+
+Run it from this directory:
+`python benchmark_bulk_indexing.py [--url URL] [--events N]`
+"""
+
+import os
+import imp
+import time
+import random
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+
+es_schema_creator = imp.load_source(
+    'es_schema_creator', os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), 'schema', 'es_schema_creator.py'))
+
+SCENARIOS = [
+    # (batch size, writers)
+    (1, 1),
+    (100, 1),
+    (500, 1),
+    (500, 4),
+    (2000, 4),
+]
+
+
+def generate_events(count):
+    rand = random.Random(0)
+    events = []
+    for i in range(count):
+        execution_id = 'execution-{0}'.format(rand.randint(0, count // 50))
+        events.append({
+            '_type': 'cloudify_event',
+            '_id': str(i),
+            '_source': {
+                'type': 'cloudify_event',
+                'event_type': rand.choice([
+                    'task_started', 'task_succeeded', 'workflow_started',
+                    'sending_task']),
+                'timestamp': '2015-10-01 12:00:{0:02d}.000'.format(i % 60),
+                'message_code': None,
+                'context': {
+                    'blueprint_id': 'blueprint',
+                    'deployment_id': 'deployment',
+                    'execution_id': execution_id,
+                    'workflow_id': 'install',
+                    'node_id': 'node_{0}'.format(rand.randint(0, 1000)),
+                    'node_name': 'node',
+                    'task_id': '{0:032x}'.format(rand.getrandbits(128)),
+                    'task_name': 'script_runner.tasks.run',
+                    'operation': 'cloudify.interfaces.lifecycle.create',
+                    'plugin': 'script',
+                },
+                'message': {'text': 'Task started {0}'.format(i),
+                            'arguments': None},
+            }})
+    return events
+
+
+def measure(es_url, index, events, batch_size, writers, session):
+    batches = [events[i:i + batch_size]
+               for i in range(0, len(events), batch_size)]
+    pool = ThreadPool(writers)
+    start = time.time()
+    try:
+        sizes = pool.map(lambda batch: es_schema_creator._bulk(
+            es_url, index, 'index', batch, session), batches)
+    finally:
+        pool.close()
+        pool.join()
+    return time.time() - start, sum(sizes), len(batches)
+
+
+def start_fake_elasticsearch():
+    from test_es_schema_creator import FakeElasticsearch
+    server = FakeElasticsearch()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', help='elasticsearch url (defaults to a '
+                                      'local fake elasticsearch)')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='number of events indexed by each scenario')
+    parser.add_argument('--profiles', nargs='+',
+                        choices=sorted(es_schema_creator.PROFILES),
+                        default=sorted(es_schema_creator.PROFILES))
+    args = parser.parse_args()
+
+    server = None
+    es_url = args.url
+    if not es_url:
+        server = start_fake_elasticsearch()
+        es_url = server.url
+    session = es_schema_creator.get_session(
+        max(writers for _, writers in SCENARIOS))
+    events = generate_events(args.events)
+    print 'indexing {0} events into {1}'.format(len(events), es_url)
+    row = '{0:<8} {1:>6} {2:>8} {3:>9} {4:>10} {5:>12} {6:>8}'
+    print row.format('profile', 'batch', 'writers', 'requests', 'time (s)',
+                     'events/s', 'MB/s')
+    try:
+        for profile in args.profiles:
+            es_schema_creator.apply_profile(es_url, profile, session)
+            for i, (batch_size, writers) in enumerate(SCENARIOS):
+                index = 'cloudify_events_benchmark_{0}_{1}'.format(profile, i)
+                # created with the profile's template applied
+                session.put('{0}/{1}'.format(es_url, index)).raise_for_status()
+                try:
+                    seconds, size, requests = measure(
+                        es_url, index, events, batch_size, writers, session)
+                finally:
+                    session.delete('{0}/{1}'.format(es_url, index))
+                print row.format(
+                    profile, batch_size, writers, requests,
+                    '{0:.2f}'.format(seconds),
+                    '{0:.0f}'.format(len(events) / seconds),
+                    '{0:.1f}'.format(size / seconds / 1024 / 1024))
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,713 @@
+# flake8: NOQA
+#########
+# Copyright (c) 2013 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+
+
+__author__ = 'ran'
+
+import re
+import copy
+import time
+import datetime
+import argparse
+import requests
+import json
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+
+STORAGE_INDEX_URL = "http://localhost:9200/cloudify_storage"
+# events are written through EVENTS_WRITE_ALIAS into daily indices, named
+# <EVENTS_ALIAS>-<date>[-<n>] (indices rolled by size on the same day are
+# numbered), and read through EVENTS_ALIAS
+EVENTS_ALIAS = 'cloudify_events'
+EVENTS_WRITE_ALIAS = 'cloudify_events_write'
+EVENTS_DATE_FORMAT = '%Y.%m.%d'
+# connections kept open to elasticsearch by a session
+POOL_SIZE = 10
+# reindexing scrolls through the source index, with each document type
+# copied by one of REINDEX_WORKERS threads in batches of BULK_SIZE
+REINDEX_WORKERS = 4
+BULK_SIZE = 500
+SCROLL_TIMEOUT = '5m'
+# index settings kept by a reindex
+COPIED_SETTINGS = ('analysis', 'number_of_shards', 'number_of_replicas')
+
+# index templates are applied to the indices elasticsearch creates, whether
+# by es_schema_creator.py, a reindex or logstash's first write of events.
+# the settings of each index differ by the size of the manager; events
+# are refreshed less often (searches see them later) to favor ingestion.
+PROFILES = {
+    'small': {
+        'cloudify_events': {'number_of_shards': 1,
+                            'number_of_replicas': 0,
+                            'refresh_interval': '5s'},
+        'cloudify_storage': {'number_of_shards': 1,
+                             'number_of_replicas': 0,
+                             'refresh_interval': '1s'},
+    },
+    'large': {
+        'cloudify_events': {'number_of_shards': 5,
+                            'number_of_replicas': 1,
+                            'refresh_interval': '30s'},
+        'cloudify_storage': {'number_of_shards': 3,
+                             'number_of_replicas': 1,
+                             'refresh_interval': '1s'},
+    },
+}
+DEFAULT_PROFILE = 'small'
+# settings which can be changed on existing indices
+DYNAMIC_SETTINGS = ('number_of_replicas', 'refresh_interval')
+
+ANALYSIS = {'analyzer': {'default': {'tokenizer': 'whitespace'}}}
+NOT_ANALYZED = {'type': 'string', 'index': 'not_analyzed'}
+
+# ids are matched exactly and have too many values to be worth analyzing,
+# and nothing searches the `_all` field.
+EVENTS_MAPPINGS = {'_default_': {
+    '_all': {'enabled': False},
+    'properties': {
+        'type': NOT_ANALYZED,
+        'event_type': NOT_ANALYZED,
+        'level': NOT_ANALYZED,
+        'logger': NOT_ANALYZED,
+        'message_code': NOT_ANALYZED,
+        'context': {'properties': dict((field, NOT_ANALYZED) for field in (
+            'blueprint_id', 'deployment_id', 'execution_id', 'workflow_id',
+            'node_id', 'node_name', 'task_id', 'task_name', 'task_target',
+            'operation', 'plugin'))},
+        'message': {'properties': {'text': {'type': 'string'}}},
+    }}}
+
+STORAGE_MAPPINGS = {'_default_': {
+    '_all': {'enabled': False},
+    'dynamic_templates': [
+        {'id': {'match': 'id', 'match_mapping_type': 'string',
+                'mapping': NOT_ANALYZED}},
+        {'ids': {'match': '*_id', 'match_mapping_type': 'string',
+                 'mapping': NOT_ANALYZED}},
+    ]}}
+
+DISABLED = {'enabled': False}
+
+# the mappings of all of the storage index's types. fields which are only
+# ever read back whole (e.g. plans and runtime properties) aren't indexed.
+STORAGE_SCHEMA = {'mappings': {
+    'blueprint': {'properties': {'plan': DISABLED}},
+    'deployment': {'properties': dict((field, DISABLED) for field in (
+        'workflows', 'inputs', 'policy_type', 'policy_triggers', 'groups',
+        'outputs'))},
+    'node': {
+        '_id': {'path': 'id'},
+        'properties': {
+            'types': {'type': 'string', 'index_name': 'type'},
+            'properties': DISABLED,
+            'operations': DISABLED,
+            'relationships': DISABLED}},
+    'node_instance': {
+        '_id': {'path': 'id'},
+        'properties': {'runtime_properties': DISABLED}},
+    'deployment_modification': {
+        '_id': {'path': 'id'},
+        'properties': dict((field, DISABLED) for field in (
+            'modified_nodes', 'node_instances', 'context'))},
+}}
+
+
+class SchemaConflictError(Exception):
+    """Raised when existing mappings can't be migrated by adding fields."""
+
+    def __init__(self, index_url, conflicts):
+        super(SchemaConflictError, self).__init__(
+            '{0} has conflicting mappings: {1}'.format(
+                index_url, ', '.join(conflicts)))
+        self.conflicts = conflicts
+
+
+def get_session(pool_size=POOL_SIZE):
+    """Returns a session which reuses up to `pool_size` connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_storage_mappings():
+    return copy.deepcopy(STORAGE_SCHEMA['mappings'])
+
+
+def _diff_mapping(current, desired, path):
+    additions = {}
+    conflicts = []
+    for key, value in desired.items():
+        if key != 'properties':
+            if current.get(key) != value:
+                conflicts.append('{0}{1}'.format(path, key))
+            continue
+        properties = current.get('properties', {})
+        added = {}
+        for name, field in value.items():
+            if name not in properties:
+                added[name] = field
+                continue
+            field_additions, field_conflicts = _diff_mapping(
+                properties[name], field, '{0}{1}.'.format(path, name))
+            if field_additions:
+                added[name] = field_additions
+            conflicts.extend(field_conflicts)
+        if added:
+            additions['properties'] = added
+    return additions, conflicts
+
+
+def diff_mappings(current, desired):
+    """Compares the `current` mappings of an index with the `desired` ones
+    (both dicts of type: mapping).
+
+    Returns the mappings to put in order to add what's missing from the
+    current mappings, and the paths of the settings whose current values
+    are different from the desired ones, which can't be changed in place.
+    """
+    additions = {}
+    conflicts = []
+    for doc_type, mapping in desired.items():
+        if doc_type not in current:
+            additions[doc_type] = mapping
+            continue
+        type_additions, type_conflicts = _diff_mapping(
+            current[doc_type], mapping, '{0}.'.format(doc_type))
+        if type_additions:
+            additions[doc_type] = type_additions
+        conflicts.extend(type_conflicts)
+    return additions, conflicts
+
+
+def get_mappings(index_url, session):
+    """Returns the mappings of the index at `index_url`, or None if there's
+    no such index.
+    """
+    response = session.get('{0}/_mapping'.format(index_url))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    indices = response.json()
+    if not indices:
+        return {}
+    return indices.values()[0].get('mappings', {})
+
+
+def migrate_schema(index_url, mappings, session):
+    """Brings the index at `index_url` up to date with `mappings` without
+    losing any of its documents.
+
+    A missing index is created along with its mappings in a single request.
+    Otherwise, only the fields and types missing from the index are added,
+    and SchemaConflictError is raised (before changing anything) if any of
+    the existing mappings differ.
+
+    Returns the mappings which were put.
+    """
+    current = get_mappings(index_url, session)
+    if current is None:
+        response = session.put(index_url, data=json.dumps(
+            {'mappings': mappings}))
+        response.raise_for_status()
+        return mappings
+    additions, conflicts = diff_mappings(current, mappings)
+    if conflicts:
+        raise SchemaConflictError(index_url, conflicts)
+    for doc_type, mapping in additions.items():
+        response = session.put('{0}/_mapping/{1}'.format(
+            index_url, doc_type), data=json.dumps({doc_type: mapping}))
+        response.raise_for_status()
+    return additions
+
+
+def get_templates(profile=DEFAULT_PROFILE):
+    """Returns the index templates of `profile` by name."""
+    templates = {}
+    for name, mappings in (('cloudify_events', EVENTS_MAPPINGS),
+                           ('cloudify_storage', STORAGE_MAPPINGS)):
+        settings = dict(PROFILES[profile][name], analysis=ANALYSIS)
+        templates[name] = {'template': '{0}*'.format(name),
+                           'order': 0,
+                           'settings': settings,
+                           'mappings': mappings}
+    return templates
+
+
+def apply_profile(es_url, profile, session):
+    """Puts the index templates of `profile` and updates the settings of
+    the existing indices which can be changed in place.
+    """
+    for name, template in get_templates(profile).items():
+        response = session.put('{0}/_template/{1}'.format(es_url, name),
+                               data=json.dumps(template))
+        response.raise_for_status()
+        settings = dict((key, value)
+                        for key, value in template['settings'].items()
+                        if key in DYNAMIC_SETTINGS)
+        response = session.put(
+            '{0}/{1}/_settings'.format(es_url, template['template']),
+            data=json.dumps({'index': settings}))
+        # there may not be any indices yet
+        if response.status_code != 404:
+            response.raise_for_status()
+
+
+def get_profile_settings(index_url, profile):
+    """Returns the settings `profile` gives the index at `index_url`."""
+    name = index_url.rstrip('/').rsplit('/', 1)[-1]
+    return dict(PROFILES[profile].get(name, {}))
+
+
+def get_index_mappings(index_url):
+    """Returns the mappings of the index (or alias) at `index_url`."""
+    if index_url.rstrip('/').rsplit('/', 1)[-1] == 'cloudify_storage':
+        return get_storage_mappings()
+    return {}
+
+
+def _override_mapping(current, desired):
+    for key, value in desired.items():
+        if key == 'properties':
+            properties = current.setdefault('properties', {})
+            for name, field in value.items():
+                if name in properties:
+                    _override_mapping(properties[name], field)
+                else:
+                    properties[name] = copy.deepcopy(field)
+        else:
+            current[key] = copy.deepcopy(value)
+    return current
+
+
+def override_mappings(current, desired):
+    """Returns the `current` mappings with the `desired` ones applied over
+    them (both dicts of type: mapping).
+    """
+    mappings = copy.deepcopy(current)
+    for doc_type, mapping in desired.items():
+        _override_mapping(mappings.setdefault(doc_type, {}), mapping)
+    return mappings
+
+
+def get_alias_indices(es_url, alias, session):
+    """Returns the indices that `alias` points to."""
+    response = session.get('{0}/_alias/{1}'.format(es_url, alias))
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return sorted(index for index, value in response.json().items()
+                  if alias in value.get('aliases', {}))
+
+
+def _get_copied_settings(es_url, index, session):
+    response = session.get('{0}/{1}/_settings'.format(es_url, index))
+    response.raise_for_status()
+    settings = response.json().values()[0]['settings'].get('index', {})
+    return dict((key, value) for key, value in settings.items()
+                if key in COPIED_SETTINGS)
+
+
+def _bulk(es_url, target, op_type, hits, session):
+    lines = []
+    for hit in hits:
+        lines.append(json.dumps({op_type: {
+            '_index': target, '_type': hit['_type'], '_id': hit['_id']}}))
+        lines.append(json.dumps(hit['_source']))
+    data = '\n'.join(lines) + '\n'
+    response = session.post('{0}/_bulk'.format(es_url), data=data)
+    response.raise_for_status()
+    result = response.json()
+    if result.get('errors'):
+        failed = [item[op_type] for item in result['items']
+                  if item[op_type].get('status', 200) >= 300]
+        raise RuntimeError('Failed indexing {0} documents into {1}: '
+                           '{2}'.format(len(failed), target,
+                                        failed[0].get('error')))
+    return len(data)
+
+
+def _copy_type(args):
+    es_url, source, target, doc_type, op_type, batch_size, session = args
+    start = time.time()
+    docs = size = 0
+    response = session.post(
+        '{0}/{1}/{2}/_search'.format(es_url, source, doc_type),
+        params={'search_type': 'scan', 'scroll': SCROLL_TIMEOUT,
+                'size': batch_size},
+        data=json.dumps({'query': {'match_all': {}}}))
+    response.raise_for_status()
+    scroll_id = response.json()['_scroll_id']
+    while True:
+        response = session.post('{0}/_search/scroll'.format(es_url),
+                                params={'scroll': SCROLL_TIMEOUT},
+                                data=scroll_id)
+        response.raise_for_status()
+        result = response.json()
+        scroll_id = result['_scroll_id']
+        hits = result['hits']['hits']
+        if not hits:
+            break
+        size += _bulk(es_url, target, op_type, hits, session)
+        docs += len(hits)
+    session.delete('{0}/_search/scroll'.format(es_url), data=scroll_id)
+    return doc_type, docs, size, time.time() - start
+
+
+def _count(es_url, index, doc_type, session):
+    url = '/'.join(part for part in (es_url, index, doc_type) if part)
+    response = session.get('{0}/_count'.format(url))
+    response.raise_for_status()
+    return response.json()['count']
+
+
+def copy_documents(es_url, source, target, doc_types, session,
+                   op_type='index', workers=REINDEX_WORKERS,
+                   batch_size=BULK_SIZE):
+    """Copies the documents of each of `doc_types` from the `source` index
+    to the `target` index. Each type is scrolled through and bulk indexed
+    by one of `workers` threads.
+
+    Returns a list of (type, documents, bytes, seconds) for each type.
+    """
+    if not doc_types:
+        return []
+    pool = ThreadPool(min(workers, len(doc_types)))
+    try:
+        return pool.map(_copy_type, [
+            (es_url, source, target, doc_type, op_type, batch_size, session)
+            for doc_type in doc_types])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _block_writes(es_url, index, blocked, session):
+    response = session.put('{0}/{1}/_settings'.format(es_url, index),
+                           data=json.dumps({'index': {'blocks.write':
+                                                      blocked}}))
+    response.raise_for_status()
+
+
+def reindex(index_url, mappings=None, session=None, workers=REINDEX_WORKERS,
+            batch_size=BULK_SIZE, keep_old=False, settings=None, target=None):
+    """Copies the index behind the alias at `index_url` into a new version
+    of it, created with `mappings` applied over its current mappings and
+    `settings` over its analysis, shard and replica settings, and points
+    the alias at the new version.
+
+    Versions are named <alias>_v<number>. The alias is swapped atomically,
+    so readers never see an empty index. Writes to the old version are
+    blocked (and fail) from the start of the copy until the alias is
+    swapped, as documents updated or deleted during a scan can't be told
+    apart from the copied ones. The old version is then deleted unless
+    `keep_old` is set, in which case it is kept read-only. If the copy
+    fails, writes to the old version are allowed again.
+
+    An index which isn't behind an alias yet (e.g. cloudify_storage) is
+    copied into <index>_v2 and, as elasticsearch can't swap an index for
+    an alias atomically, deleted right before the alias is created in its
+    place. Requests made in between fail, and a write would create a new
+    index by the alias' name, so its writers must be stopped first (the
+    bootstrap migrates cloudify_storage before the rest service starts).
+    `target` overrides the name of the new index.
+
+    Returns a report of the reindex (see `print_reindex_report`).
+    """
+    session = session or get_session(max(POOL_SIZE, workers))
+    es_url, alias = index_url.rstrip('/').rsplit('/', 1)
+    current = get_mappings(index_url, session)
+    if current is None:
+        raise ValueError('{0} does not exist'.format(index_url))
+    indices = get_alias_indices(es_url, alias, session)
+    if len(indices) > 1:
+        raise ValueError('{0} points to more than one index: {1}'.format(
+            alias, ', '.join(indices)))
+    source = indices[0] if indices else alias
+    if not target:
+        match = re.match(r'^{0}_v(\d+)$'.format(re.escape(alias)), source)
+        target = '{0}_v{1}'.format(
+            alias, int(match.group(1)) + 1 if match else 2)
+
+    start = time.time()
+    target_settings = _get_copied_settings(es_url, source, session)
+    target_settings.update(settings or {})
+    response = session.put('{0}/{1}'.format(es_url, target), data=json.dumps({
+        'settings': target_settings,
+        'mappings': override_mappings(current, mappings or {})}))
+    response.raise_for_status()
+    # _default_ isn't a type of documents
+    doc_types = [doc_type for doc_type in current
+                 if not doc_type.startswith('_')]
+    _block_writes(es_url, source, True, session)
+    try:
+        slices = copy_documents(es_url, source, target, doc_types, session,
+                                workers=workers, batch_size=batch_size)
+        if indices:
+            response = session.post('{0}/_aliases'.format(es_url),
+                                    data=json.dumps({'actions': [
+                                        {'remove': {'index': source,
+                                                    'alias': alias}},
+                                        {'add': {'index': target,
+                                                 'alias': alias}}]}))
+            response.raise_for_status()
+    except Exception:
+        _block_writes(es_url, source, False, session)
+        raise
+    if not indices or not keep_old:
+        session.delete('{0}/{1}'.format(es_url, source)).raise_for_status()
+    if not indices:
+        response = session.post('{0}/_aliases'.format(es_url), data=json.dumps(
+            {'actions': [{'add': {'index': target, 'alias': alias}}]}))
+        response.raise_for_status()
+    return {
+        'alias': alias,
+        'source': source,
+        'target': target,
+        'slices': slices,
+        'seconds': time.time() - start,
+    }
+
+
+def _is_index(es_url, name, session):
+    """Returns whether `name` is an index, rather than an alias."""
+    response = session.head('{0}/{1}'.format(es_url, name))
+    return response.status_code == 200 and \
+        not get_alias_indices(es_url, name, session)
+
+
+def get_events_indices(es_url, session):
+    """Returns the names of the open daily events indices by their date,
+    oldest first.
+    """
+    response = session.get('{0}/{1}-*/_settings'.format(es_url, EVENTS_ALIAS))
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    indices = []
+    pattern = r'^{0}-(\d{{4}}\.\d{{2}}\.\d{{2}})(?:-(\d+))?$'.format(
+        re.escape(EVENTS_ALIAS))
+    for name in response.json():
+        match = re.match(pattern, name)
+        if match:
+            indices.append((datetime.datetime.strptime(
+                match.group(1), EVENTS_DATE_FORMAT).date(),
+                int(match.group(2) or 0), name))
+    return [(date, name) for date, _, name in sorted(indices)]
+
+
+def _next_events_index(es_url, session, today):
+    """Returns the name of the next events index of `today`."""
+    name = '{0}-{1}'.format(EVENTS_ALIAS, today.strftime(EVENTS_DATE_FORMAT))
+    indices = [index for date, index in get_events_indices(es_url, session)
+               if date == today]
+    return '{0}-{1}'.format(name, len(indices)) if indices else name
+
+
+def roll_events(es_url, session, max_docs=None, today=None):
+    """Points the events write alias at today's events index, creating it
+    (and adding it to the read alias) if the current one is from another
+    day or, with `max_docs`, holds that many events.
+
+    An index by the name of either alias (an events index from before the
+    daily indices, or one elasticsearch created for events written before
+    the aliases existed) is reindexed into today's index, with the alias
+    taking its name.
+
+    Returns the name of the index events are written to.
+    """
+    today = today or datetime.date.today()
+    moved = []
+    for alias in (EVENTS_ALIAS, EVENTS_WRITE_ALIAS):
+        if _is_index(es_url, alias, session):
+            target = _next_events_index(es_url, session, today)
+            print_reindex_report(reindex('{0}/{1}'.format(es_url, alias),
+                                         session=session, target=target))
+            moved.append(target)
+    if moved:
+        readable = get_alias_indices(es_url, EVENTS_ALIAS, session)
+        actions = [{'add': {'index': index, 'alias': EVENTS_ALIAS}}
+                   for index in moved if index not in readable]
+        if not get_alias_indices(es_url, EVENTS_WRITE_ALIAS, session):
+            actions.append({'add': {'index': moved[-1],
+                                    'alias': EVENTS_WRITE_ALIAS}})
+        if actions:
+            response = session.post('{0}/_aliases'.format(es_url),
+                                    data=json.dumps({'actions': actions}))
+            response.raise_for_status()
+    current = get_alias_indices(es_url, EVENTS_WRITE_ALIAS, session)
+    if current and current[-1] in [
+            index for date, index in get_events_indices(es_url, session)
+            if date == today] and not (
+            max_docs and _count(es_url, current[-1], None, session) >=
+            max_docs):
+        return current[-1]
+    name = _next_events_index(es_url, session, today)
+    response = session.put('{0}/{1}'.format(es_url, name))
+    response.raise_for_status()
+    actions = [{'remove': {'index': index, 'alias': EVENTS_WRITE_ALIAS}}
+               for index in current]
+    actions.extend([{'add': {'index': name, 'alias': EVENTS_ALIAS}},
+                    {'add': {'index': name, 'alias': EVENTS_WRITE_ALIAS}}])
+    response = session.post('{0}/_aliases'.format(es_url),
+                            data=json.dumps({'actions': actions}))
+    response.raise_for_status()
+    print 'Writing events to {0}'.format(name)
+    return name
+
+
+def expire_events(es_url, session, max_age, close=False, today=None):
+    """Deletes (or, if `close` is set, closes) the daily events indices
+    older than `max_age` days, except for the one events are written to.
+    Closed indices are removed from the read alias first, so searches
+    don't fail on them.
+
+    Returns the names of the expired indices.
+    """
+    today = today or datetime.date.today()
+    oldest = today - datetime.timedelta(days=max_age)
+    current = get_alias_indices(es_url, EVENTS_WRITE_ALIAS, session)
+    expired = [name for date, name in get_events_indices(es_url, session)
+               if date < oldest and name not in current]
+    for name in expired:
+        if close:
+            response = session.post('{0}/_aliases'.format(es_url),
+                                    data=json.dumps({'actions': [{'remove': {
+                                        'index': name,
+                                        'alias': EVENTS_ALIAS}}]}))
+            response.raise_for_status()
+            response = session.post('{0}/{1}/_close'.format(es_url, name))
+        else:
+            response = session.delete('{0}/{1}'.format(es_url, name))
+        response.raise_for_status()
+        print '{0} {1}'.format('Closed' if close else 'Deleted', name)
+    return expired
+
+
+def print_reindex_report(report):
+    docs = sum(docs for _, docs, _, _ in report['slices'])
+    size = sum(size for _, _, size, _ in report['slices'])
+    seconds = report['seconds'] or 1e-6
+    print 'Reindexed {0} into {1} ({2} is now an alias of {1}):'.format(
+        report['source'], report['target'], report['alias'])
+    for doc_type, type_docs, type_size, type_seconds in report['slices']:
+        print '  {0:<24} {1:>9} docs {2:>9.1f}s {3:>10.0f} docs/s'.format(
+            doc_type, type_docs, type_seconds,
+            type_docs / (type_seconds or 1e-6))
+    print '  {0:<24} {1:>9} docs {2:>9.1f}s {3:>10.0f} docs/s ' \
+          '{4:.1f}MB/s'.format('total', docs, seconds, docs / seconds,
+                               size / seconds / 1024 / 1024)
+
+
+def create_schema(storage_index_url, recreate=False, session=None,
+                  reindex_conflicts=False, workers=REINDEX_WORKERS,
+                  profile=DEFAULT_PROFILE):
+    session = session or get_session(max(POOL_SIZE, workers))
+    apply_profile(storage_index_url.rstrip('/').rsplit('/', 1)[0], profile,
+                  session)
+    if recreate:
+        response = session.delete(storage_index_url)
+        if response.status_code != 404:
+            response.raise_for_status()
+    mappings = get_index_mappings(storage_index_url)
+    try:
+        changes = migrate_schema(storage_index_url, mappings, session)
+    except SchemaConflictError as ex:
+        if not reindex_conflicts:
+            raise
+        print '{0}, reindexing.'.format(ex)
+        print_reindex_report(reindex(
+            storage_index_url, mappings, session, workers=workers,
+            settings=get_profile_settings(storage_index_url, profile)))
+        return mappings
+    if changes:
+        print 'Updated elasticsearch storage schema: {0}'.format(
+            ', '.join(sorted(changes)))
+    else:
+        print 'Elasticsearch storage schema is up to date.'
+    return changes
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Creates or migrates the storage index\'s mappings. '
+                    'Existing documents are kept unless --recreate is '
+                    'given.')
+    parser.add_argument('--url', default=STORAGE_INDEX_URL,
+                        help='the storage index\'s url')
+    parser.add_argument('--recreate', action='store_true',
+                        help='delete the index and create it from scratch')
+    parser.add_argument('--reindex', action='store_true',
+                        help='when the mappings can\'t be migrated in place, '
+                             'copy the index into a new version behind an '
+                             'alias instead of failing (writes to the index '
+                             'fail while it is copied)')
+    parser.add_argument('--force-reindex', action='store_true',
+                        help='copy the index into a new version behind an '
+                             'alias even if it can be migrated in place')
+    parser.add_argument('-j', '--workers', type=int, default=REINDEX_WORKERS,
+                        help='number of document types copied concurrently '
+                             'when reindexing')
+    parser.add_argument('--roll-events', action='store_true',
+                        help='write events into a new daily index if the '
+                             'current one is from another day (run it '
+                             'periodically)')
+    parser.add_argument('--max-events', type=int,
+                        help='with --roll-events, also roll the events index '
+                             'once it holds this many events')
+    parser.add_argument('--expire-events', type=int, metavar='DAYS',
+                        help='delete the events indices older than DAYS')
+    parser.add_argument('--close-expired', action='store_true',
+                        help='close expired events indices instead of '
+                             'deleting them')
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        help='index settings by the size of the manager '
+                             '(default: {0}). Shard counts only apply to '
+                             'new indices (e.g. by --force-reindex). '
+                             '--roll-events only applies the profile when '
+                             'it is given'.format(DEFAULT_PROFILE))
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.roll_events or args.expire_events is not None:
+        session = get_session()
+        es_url = args.url.rstrip('/').rsplit('/', 1)[0]
+        # the events indices are created by the templates put by the
+        # storage schema's creation, which are only put again (e.g. after
+        # elasticsearch's data was wiped) if a profile is given
+        if args.roll_events:
+            if args.profile:
+                apply_profile(es_url, args.profile, session)
+            roll_events(es_url, session, args.max_events)
+        if args.expire_events is not None:
+            expire_events(es_url, session, args.expire_events,
+                          args.close_expired)
+    elif args.force_reindex:
+        session = get_session(max(POOL_SIZE, args.workers))
+        profile = args.profile or DEFAULT_PROFILE
+        apply_profile(args.url.rstrip('/').rsplit('/', 1)[0], profile,
+                      session)
+        print_reindex_report(reindex(
+            args.url, get_index_mappings(args.url), session,
+            workers=args.workers,
+            settings=get_profile_settings(args.url, profile)))
+    else:
+        create_schema(args.url, args.recreate, reindex_conflicts=args.reindex,
+                      workers=args.workers,
+                      profile=args.profile or DEFAULT_PROFILE)
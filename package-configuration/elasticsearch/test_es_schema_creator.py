@@ -0,0 +1,722 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+import os
+import re
+import imp
+import copy
+import json
+import datetime
+import fnmatch
+import itertools
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import testtools
+
+# es_schema_creator.py is kept apart from its tests, as its directory is
+# packaged as a whole
+SCHEMA_CREATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'schema', 'es_schema_creator.py')
+es_schema_creator = imp.load_source('es_schema_creator', SCHEMA_CREATOR_PATH)
+
+
+def merge_mapping(current, new, path=''):
+    """Merges `new` into `current` like elasticsearch does, returning the
+    paths of the conflicting settings.
+    """
+    conflicts = []
+    for key, value in new.items():
+        if key == 'properties':
+            properties = current.setdefault('properties', {})
+            for name, field in value.items():
+                if name in properties:
+                    conflicts.extend(merge_mapping(
+                        properties[name], field, path + name + '.'))
+                else:
+                    properties[name] = field
+        elif key not in current:
+            current[key] = value
+        elif current[key] != value:
+            conflicts.append(path + key)
+    return conflicts
+
+
+BLOCKED_ERROR = 'ClusterBlockException[blocked by: [FORBIDDEN/8/index ' \
+    'write (api)];]'
+
+
+class FakeElasticsearchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the part of elasticsearch's API used by es_schema_creator.py,
+    keeping the indices in `server.indices` and the aliases in
+    `server.aliases`.
+    """
+    routes = [
+        ('POST', r'^/_bulk$', 'bulk'),
+        ('POST', r'^/_search/scroll$', 'scroll'),
+        ('DELETE', r'^/_search/scroll$', 'clear_scroll'),
+        ('POST', r'^/_aliases$', 'update_aliases'),
+        ('GET', r'^/_alias/(?P<alias>[^/]+)$', 'get_alias'),
+        ('PUT', r'^/_template/(?P<name>[^/]+)$', 'put_template'),
+        ('PUT', r'^/(?P<index>[^/_][^/]*)/_settings$', 'update_settings'),
+        ('GET', r'^/(?P<index>[^/_][^/]*)/_mapping$', 'get_mapping'),
+        ('PUT', r'^/(?P<index>[^/_][^/]*)/_mapping/(?P<type>[^/]+)$',
+         'put_mapping'),
+        ('GET', r'^/(?P<index>[^/_][^/]*)/_settings$', 'get_settings'),
+        ('GET', r'^/(?P<index>[^/_][^/]*)/_count$', 'count'),
+        ('POST', r'^/(?P<index>[^/_][^/]*)/_close$', 'close_index'),
+        ('POST', r'^/(?P<index>[^/_][^/]*)/(?P<type>[^/_][^/]*)/_search$',
+         'scan'),
+        ('GET', r'^/(?P<index>[^/_][^/]*)/(?P<type>[^/_][^/]*)/_count$',
+         'count'),
+        ('PUT', r'^/(?P<index>[^/_][^/]*)/(?P<type>[^/_][^/]*)/(?P<id>[^/]+)$',
+         'index_document'),
+        ('HEAD', r'^/(?P<index>[^/_][^/]*)$', 'head_index'),
+        ('PUT', r'^/(?P<index>[^/_][^/]*)$', 'create_index'),
+        ('POST', r'^/(?P<index>[^/_][^/]*)$', 'create_index'),
+        ('DELETE', r'^/(?P<index>[^/_][^/]*)$', 'delete_index'),
+    ]
+
+    def handle_request(self):
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+        path, _, query = self.path.partition('?')
+        self.server.requests.append((self.command, path))
+        for method, pattern, name in self.routes:
+            match = re.match(pattern, path)
+            if method == self.command and match:
+                params = dict(urlparse.parse_qsl(query))
+                with self.server.lock:
+                    status, response = getattr(self, name)(
+                        body, params, **match.groupdict())
+                break
+        else:
+            status, response = 400, {'error': 'No handler found'}
+        content = json.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+    def missing(self, index):
+        return 404, {'error': 'IndexMissingException[[{0}] missing]'.format(
+            index), 'status': 404}
+
+    def resolve(self, name):
+        """Returns the index called, or aliased by, `name`."""
+        if name in self.server.indices:
+            return name
+        indices = self.server.aliases.get(name, [])
+        if len(indices) == 1:
+            return indices[0]
+
+    def get_mapping(self, body, params, index):
+        name = self.resolve(index)
+        if name is None:
+            return self.missing(index)
+        return 200, {name: {
+            'mappings': self.server.indices[name]['mappings']}}
+
+    def put_mapping(self, body, params, index, type):
+        name = self.resolve(index)
+        if name is None:
+            return self.missing(index)
+        mappings = self.server.indices[name]['mappings']
+        mapping = json.loads(body)[type]
+        merged = json.loads(json.dumps(mappings.get(type, {})))
+        conflicts = merge_mapping(merged, mapping)
+        if conflicts:
+            return 400, {'error': 'MergeMappingException[{0}]'.format(
+                conflicts), 'status': 400}
+        mappings[type] = merged
+        return 200, {'acknowledged': True}
+
+    def get_settings(self, body, params, index):
+        if '*' in index:
+            names = [name for name, value in self.server.indices.items()
+                     if fnmatch.fnmatch(name, index) and
+                     not value.get('closed')]
+        else:
+            names = [name for name in [self.resolve(index)] if name]
+            if not names:
+                return self.missing(index)
+        return 200, dict((name, {'settings': {
+            'index': self.server.indices[name].get('settings', {})}})
+            for name in names)
+
+    def close_index(self, body, params, index):
+        if index not in self.server.indices:
+            return self.missing(index)
+        self.server.indices[index]['closed'] = True
+        return 200, {'acknowledged': True}
+
+    def head_index(self, body, params, index):
+        return (200 if self.resolve(index) else 404), {}
+
+    def create_index(self, body, params, index):
+        if index in self.server.indices or index in self.server.aliases:
+            return 400, {'error': 'IndexAlreadyExistsException', 'status': 400}
+        settings = {}
+        mappings = {}
+        templates = sorted(self.server.templates.values(),
+                           key=lambda template: template.get('order', 0))
+        body = json.loads(body or '{}')
+        for source in [template for template in templates
+                       if fnmatch.fnmatch(index, template['template'])] + \
+                [body]:
+            settings.update(copy.deepcopy(source.get('settings', {})))
+            for doc_type, mapping in source.get('mappings', {}).items():
+                merge_mapping(mappings.setdefault(doc_type, {}),
+                              copy.deepcopy(mapping))
+        self.server.indices[index] = {
+            'mappings': mappings, 'settings': settings, 'docs': {}}
+        return 200, {'acknowledged': True}
+
+    def put_template(self, body, params, name):
+        self.server.templates[name] = json.loads(body)
+        return 200, {'acknowledged': True}
+
+    def update_settings(self, body, params, index):
+        names = [name for name in self.server.indices
+                 if fnmatch.fnmatch(name, index)] or \
+            [name for name in [self.resolve(index)] if name]
+        if not names:
+            return self.missing(index)
+        for name in names:
+            self.server.indices[name].setdefault('settings', {}).update(
+                json.loads(body)['index'])
+        return 200, {'acknowledged': True}
+
+    def delete_index(self, body, params, index):
+        if self.server.indices.pop(index, None) is None:
+            return self.missing(index)
+        for indices in self.server.aliases.values():
+            if index in indices:
+                indices.remove(index)
+        return 200, {'acknowledged': True}
+
+    def write_blocked(self, name):
+        return self.server.indices[name].get('settings', {}).get(
+            'blocks.write')
+
+    def index_document(self, body, params, index, type, id):
+        name = self.resolve(index)
+        if name is None:
+            if index in self.server.aliases:
+                return 400, {'error': 'ElasticsearchIllegalArgumentException'}
+            self.create_index(None, params, index)
+            name = index
+        if self.write_blocked(name):
+            return 403, {'error': BLOCKED_ERROR, 'status': 403}
+        self.server.indices[name]['docs']['{0}/{1}'.format(type, id)] = \
+            json.loads(body)
+        self.server.indices[name]['mappings'].setdefault(type, {})
+        return 201, {'_index': name, '_type': type, '_id': id}
+
+    def get_alias(self, body, params, alias):
+        indices = self.server.aliases.get(alias)
+        if not indices:
+            return 404, {'error': 'alias [{0}] missing'.format(alias),
+                         'status': 404}
+        return 200, dict((index, {'aliases': {alias: {}}})
+                         for index in indices)
+
+    def update_aliases(self, body, params):
+        # all the actions are applied at once
+        aliases = json.loads(json.dumps(self.server.aliases))
+        for action in json.loads(body)['actions']:
+            (name, spec), = action.items()
+            if spec['index'] not in self.server.indices:
+                return self.missing(spec['index'])
+            if spec['alias'] in self.server.indices:
+                return 400, {'error': 'InvalidAliasNameException'}
+            indices = aliases.setdefault(spec['alias'], [])
+            if name == 'add':
+                indices.append(spec['index'])
+            else:
+                indices.remove(spec['index'])
+        self.server.aliases = aliases
+        return 200, {'acknowledged': True}
+
+    def scan(self, body, params, index, type):
+        name = self.resolve(index)
+        if name is None:
+            return self.missing(index)
+        prefix = type + '/'
+        hits = [{'_index': name, '_type': type, '_id': key[len(prefix):],
+                 '_source': source}
+                for key, source in sorted(
+                    self.server.indices[name]['docs'].items())
+                if key.startswith(prefix)]
+        scroll_id = str(next(self.server.scroll_ids))
+        self.server.scrolls[scroll_id] = (hits, int(params['size']))
+        return 200, {'_scroll_id': scroll_id,
+                     'hits': {'total': len(hits), 'hits': []}}
+
+    def count(self, body, params, index, type=None):
+        name = self.resolve(index)
+        if name is None:
+            return self.missing(index)
+        return 200, {'count': len([
+            key for key in self.server.indices[name]['docs']
+            if type is None or key.startswith(type + '/')])}
+
+    def scroll(self, body, params):
+        hits, size = self.server.scrolls[body]
+        self.server.scrolls[body] = (hits[size:], size)
+        return 200, {'_scroll_id': body, 'hits': {'hits': hits[:size]}}
+
+    def clear_scroll(self, body, params):
+        self.server.scrolls.pop(body, None)
+        return 200, {}
+
+    def bulk(self, body, params):
+        lines = body.splitlines()
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            (op_type, meta), = json.loads(action).items()
+            name = self.resolve(meta['_index'])
+            key = '{0}/{1}'.format(meta['_type'], meta['_id'])
+            docs = self.server.indices[name]['docs']
+            item = {'_index': name, '_type': meta['_type'],
+                    '_id': meta['_id'], 'status': 201}
+            if self.write_blocked(name):
+                item.update(status=403, error=BLOCKED_ERROR)
+            elif op_type == 'create' and key in docs:
+                item.update(status=409, error='DocumentAlreadyExistsException')
+            else:
+                docs[key] = json.loads(source)
+                self.server.indices[name]['mappings'].setdefault(
+                    meta['_type'], {})
+            items.append({op_type: item})
+        self.server.bulk_requests += 1
+        return 200, {'took': 1, 'items': items,
+                     'errors': any(item.values()[0]['status'] >= 300
+                                   for item in items)}
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeElasticsearch(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), FakeElasticsearchHandler)
+        self.indices = {}
+        self.aliases = {}
+        self.templates = {}
+        self.scrolls = {}
+        self.scroll_ids = itertools.count()
+        self.bulk_requests = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+class FakeElasticsearchTestCase(testtools.TestCase):
+    """Runs a fake elasticsearch server (at `self.server.url`) for each
+    test
+    """
+
+    def setUp(self):
+        super(FakeElasticsearchTestCase, self).setUp()
+        self.server = FakeElasticsearch()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.session = es_schema_creator.get_session()
+
+
+class SchemaMigrationTests(FakeElasticsearchTestCase):
+    """Tests es_schema_creator.py against a fake elasticsearch server"""
+
+    def setUp(self):
+        super(SchemaMigrationTests, self).setUp()
+        self.index_url = '{0}/cloudify_storage'.format(self.server.url)
+
+    def create_schema(self, recreate=False):
+        return es_schema_creator.create_schema(
+            self.index_url, recreate=recreate, session=self.session)
+
+    def index_requests(self):
+        """Returns the requests made to the storage index itself"""
+        return [request for request in self.server.requests
+                if request[1].startswith('/cloudify_storage/') or
+                request[1] == '/cloudify_storage']
+
+    def test_creates_index_with_mappings_in_one_request(self):
+        self.create_schema()
+        self.assertEqual([('GET', '/cloudify_storage/_mapping'),
+                          ('PUT', '/cloudify_storage')],
+                         self.index_requests())
+        mappings = self.server.indices['cloudify_storage']['mappings']
+        self.assertEqual(es_schema_creator.get_storage_mappings(),
+                         dict((doc_type, mapping)
+                              for doc_type, mapping in mappings.items()
+                              if doc_type != '_default_'))
+
+    def test_up_to_date_schema_is_not_changed(self):
+        self.create_schema()
+        self.server.requests[:] = []
+        self.assertEqual({}, self.create_schema())
+        self.assertEqual([('GET', '/cloudify_storage/_mapping')],
+                         self.index_requests())
+
+    def test_adds_missing_fields_and_types_only(self):
+        self.server.indices['cloudify_storage'] = {
+            'mappings': {'blueprint': {'properties': {
+                'plan': {'type': 'object', 'enabled': False},
+                'id': {'type': 'string'}}}},
+            'docs': {'blueprint/1': {'id': '1'}}}
+        self.create_schema()
+        requests = self.index_requests()
+        self.assertEqual(('GET', '/cloudify_storage/_mapping'), requests[0])
+        self.assertEqual(
+            ['deployment', 'deployment_modification', 'node',
+             'node_instance'],
+            sorted(path.rsplit('/', 1)[1] for method, path in requests[1:]
+                   if method == 'PUT'))
+        self.assertEqual(5, len(requests))
+        index = self.server.indices['cloudify_storage']
+        self.assertEqual({'blueprint/1': {'id': '1'}}, index['docs'])
+        self.assertIn('id', index['mappings']['blueprint']['properties'])
+        self.assertEqual(
+            es_schema_creator.STORAGE_SCHEMA['mappings']['deployment'],
+            index['mappings']['deployment'])
+
+    def test_adds_missing_nested_fields(self):
+        current = {'deployment': {'properties': {'plan': {
+            'properties': {'name': {'type': 'string'}}}}}}
+        desired = {'deployment': {'properties': {'plan': {
+            'properties': {'name': {'type': 'string'},
+                           'nodes': {'enabled': False}}}}}}
+        self.assertEqual(
+            ({'deployment': {'properties': {'plan': {
+                'properties': {'nodes': {'enabled': False}}}}}}, []),
+            es_schema_creator.diff_mappings(current, desired))
+
+    def test_conflicting_mappings_are_not_changed(self):
+        mappings = {'blueprint': {'properties': {
+            'plan': {'type': 'object', 'enabled': True}}}}
+        self.server.indices['cloudify_storage'] = {
+            'mappings': mappings, 'docs': {}}
+        ex = self.assertRaises(es_schema_creator.SchemaConflictError,
+                               self.create_schema)
+        self.assertEqual(['blueprint.plan.enabled'], ex.conflicts)
+        self.assertEqual([('GET', '/cloudify_storage/_mapping')],
+                         self.index_requests())
+
+    def test_recreate_deletes_the_index(self):
+        self.server.indices['cloudify_storage'] = {
+            'mappings': {}, 'docs': {'blueprint/1': {}}}
+        self.create_schema(recreate=True)
+        self.assertEqual(('DELETE', '/cloudify_storage'),
+                         self.index_requests()[0])
+        self.assertEqual(
+            {}, self.server.indices['cloudify_storage']['docs'])
+
+
+class ReindexTests(FakeElasticsearchTestCase):
+    """Tests es_schema_creator.py's reindexing against a fake elasticsearch
+    server
+    """
+
+    def setUp(self):
+        super(ReindexTests, self).setUp()
+        self.docs = dict(('blueprint/{0}'.format(i), {'id': str(i)})
+                         for i in range(25))
+        self.docs.update(('deployment/{0}'.format(i), {'id': str(i)})
+                         for i in range(10))
+        self.server.indices['cloudify_storage'] = {
+            'mappings': {
+                'blueprint': {'properties': {
+                    'plan': {'type': 'object', 'enabled': True}}},
+                'deployment': {}},
+            'settings': {'analysis': {'analyzer': {
+                'default': {'tokenizer': 'whitespace'}}},
+                'uuid': 'abc'},
+            'docs': dict(self.docs)}
+
+    def reindex(self, name='cloudify_storage', **kwargs):
+        return es_schema_creator.reindex(
+            '{0}/{1}'.format(self.server.url, name),
+            es_schema_creator.get_storage_mappings(), self.session,
+            batch_size=10, **kwargs)
+
+    def test_index_is_replaced_by_an_alias(self):
+        report = self.reindex()
+        self.assertEqual('cloudify_storage_v2', report['target'])
+        self.assertEqual(['cloudify_storage_v2'], self.server.indices.keys())
+        self.assertEqual({'cloudify_storage': ['cloudify_storage_v2']},
+                         self.server.aliases)
+        index = self.server.indices['cloudify_storage_v2']
+        self.assertEqual(self.docs, index['docs'])
+        self.assertEqual(
+            {'analysis': {'analyzer': {
+                'default': {'tokenizer': 'whitespace'}}}},
+            index['settings'])
+        self.assertEqual(
+            {'type': 'object', 'enabled': False},
+            index['mappings']['blueprint']['properties']['plan'])
+        self.assertEqual(
+            [('blueprint', 25), ('deployment', 10)],
+            sorted((doc_type, docs)
+                   for doc_type, docs, _, _ in report['slices']))
+        # 3 batches of blueprints and one of deployments
+        self.assertEqual(4, self.server.bulk_requests)
+
+    def test_alias_is_swapped_to_next_version(self):
+        self.reindex()
+        self.reindex(keep_old=True)
+        self.assertEqual({'cloudify_storage': ['cloudify_storage_v3']},
+                         self.server.aliases)
+        self.assertEqual(self.docs,
+                         self.server.indices['cloudify_storage_v3']['docs'])
+        self.assertIn('cloudify_storage_v2', self.server.indices)
+        requests = self.server.requests
+        swap = requests.index(('POST', '/_aliases'))
+        self.assertNotIn(('DELETE', '/cloudify_storage_v2'),
+                         requests[:swap])
+
+    def test_writes_are_blocked_while_copying(self):
+        self.reindex()
+        copy_documents = es_schema_creator.copy_documents
+        responses = []
+
+        def write_while_copying(es_url, source, target, *args, **kwargs):
+            responses.append(self.session.put(
+                '{0}/cloudify_storage/blueprint/new'.format(es_url),
+                data=json.dumps({'id': 'new'})))
+            return copy_documents(es_url, source, target, *args, **kwargs)
+        self.patch(es_schema_creator, 'copy_documents', write_while_copying)
+        self.reindex()
+        self.assertEqual([403], [r.status_code for r in responses])
+        self.assertEqual(self.docs,
+                         self.server.indices['cloudify_storage_v3']['docs'])
+        # the new version is writable
+        self.session.put(
+            '{0}/cloudify_storage/blueprint/new'.format(self.server.url),
+            data=json.dumps({'id': 'new'})).raise_for_status()
+
+    def test_old_version_is_kept_read_only(self):
+        self.reindex()
+        self.reindex(keep_old=True)
+        self.assertTrue(self.server.indices['cloudify_storage_v2'][
+            'settings']['blocks.write'])
+
+    def test_failed_copy_allows_writes_again(self):
+        def fail(*args, **kwargs):
+            raise RuntimeError('copy failed')
+        self.patch(es_schema_creator, 'copy_documents', fail)
+        self.assertRaises(RuntimeError, self.reindex)
+        self.assertFalse(self.server.indices['cloudify_storage'][
+            'settings']['blocks.write'])
+        self.assertEqual({}, self.server.aliases)
+
+    def test_create_schema_reindexes_conflicts(self):
+        es_schema_creator.create_schema(
+            '{0}/cloudify_storage'.format(self.server.url),
+            session=self.session, reindex_conflicts=True)
+        self.assertEqual({'cloudify_storage': ['cloudify_storage_v2']},
+                         self.server.aliases)
+        # the migration works through the alias from now on
+        self.assertEqual({}, es_schema_creator.create_schema(
+            '{0}/cloudify_storage'.format(self.server.url),
+            session=self.session))
+
+
+class ProfileTests(FakeElasticsearchTestCase):
+    """Tests es_schema_creator.py's index templates against a fake
+    elasticsearch server
+    """
+
+    def create_schema(self, profile):
+        es_schema_creator.create_schema(
+            '{0}/cloudify_storage'.format(self.server.url),
+            session=self.session, profile=profile)
+
+    def test_templates_apply_to_new_indices(self):
+        self.create_schema('large')
+        # logstash creates the events index by writing to it
+        self.session.put('{0}/cloudify_events/cloudify_event/1'.format(
+            self.server.url), data=json.dumps({'type': 'cloudify_event'}))
+        events = self.server.indices['cloudify_events']
+        self.assertEqual(5, events['settings']['number_of_shards'])
+        self.assertEqual('30s', events['settings']['refresh_interval'])
+        default = events['mappings']['_default_']
+        self.assertEqual({'enabled': False}, default['_all'])
+        self.assertEqual(
+            {'type': 'string', 'index': 'not_analyzed'},
+            default['properties']['context']['properties']['execution_id'])
+        storage = self.server.indices['cloudify_storage']
+        self.assertEqual(3, storage['settings']['number_of_shards'])
+        self.assertIn('blueprint', storage['mappings'])
+
+    def test_profile_updates_existing_indices(self):
+        self.create_schema('small')
+        self.server.indices['cloudify_events'] = {
+            'mappings': {}, 'settings': {'number_of_shards': 1}, 'docs': {}}
+        self.create_schema('large')
+        self.assertEqual(
+            {'number_of_shards': 1, 'number_of_replicas': 1,
+             'refresh_interval': '30s'},
+            self.server.indices['cloudify_events']['settings'])
+        self.assertEqual(5, self.server.templates['cloudify_events'][
+            'settings']['number_of_shards'])
+
+    def test_profile_defaults_to_none(self):
+        # rolling the events indices keeps the profile that was applied,
+        # unless one is given
+        self.assertIsNone(
+            es_schema_creator.parse_args(['--roll-events']).profile)
+        self.assertEqual('large', es_schema_creator.parse_args(
+            ['--roll-events', '--profile', 'large']).profile)
+
+
+class RollingEventsTests(FakeElasticsearchTestCase):
+    """Tests es_schema_creator.py's daily events indices against a fake
+    elasticsearch server
+    """
+
+    def setUp(self):
+        super(RollingEventsTests, self).setUp()
+        self.today = datetime.date(2015, 10, 1)
+
+    def roll(self, days=0, **kwargs):
+        return es_schema_creator.roll_events(
+            self.server.url, self.session,
+            today=self.today + datetime.timedelta(days=days), **kwargs)
+
+    def write_event(self, id):
+        self.session.put('{0}/cloudify_events_write/cloudify_event/{1}'.format(
+            self.server.url, id), data='{}').raise_for_status()
+
+    def test_events_are_written_to_daily_indices(self):
+        self.assertEqual('cloudify_events-2015.10.01', self.roll())
+        self.write_event(1)
+        self.assertEqual('cloudify_events-2015.10.01', self.roll())
+        self.assertEqual('cloudify_events-2015.10.02', self.roll(days=1))
+        self.write_event(2)
+        self.assertEqual(
+            {'cloudify_events': ['cloudify_events-2015.10.01',
+                                 'cloudify_events-2015.10.02'],
+             'cloudify_events_write': ['cloudify_events-2015.10.02']},
+            self.server.aliases)
+        self.assertEqual(
+            ['cloudify_event/2'],
+            self.server.indices['cloudify_events-2015.10.02']['docs'].keys())
+
+    def test_events_index_is_rolled_by_size(self):
+        self.roll(max_docs=2)
+        self.write_event(1)
+        self.assertEqual('cloudify_events-2015.10.01', self.roll(max_docs=2))
+        self.write_event(2)
+        self.assertEqual('cloudify_events-2015.10.01-1',
+                         self.roll(max_docs=2))
+        self.assertEqual(
+            ['cloudify_events-2015.10.01', 'cloudify_events-2015.10.01-1'],
+            [name for _, name in es_schema_creator.get_events_indices(
+                self.server.url, self.session)])
+
+    def test_events_index_is_moved_to_a_daily_index(self):
+        self.server.indices['cloudify_events'] = {
+            'mappings': {'cloudify_event': {}}, 'settings': {},
+            'docs': {'cloudify_event/1': {}}}
+        self.assertEqual('cloudify_events-2015.10.01', self.roll())
+        self.assertEqual(['cloudify_events-2015.10.01'],
+                         self.server.indices.keys())
+        self.assertEqual(
+            {'cloudify_events': ['cloudify_events-2015.10.01'],
+             'cloudify_events_write': ['cloudify_events-2015.10.01']},
+            self.server.aliases)
+        self.assertEqual(
+            {'cloudify_event/1': {}},
+            self.server.indices['cloudify_events-2015.10.01']['docs'])
+
+    def test_events_write_index_is_moved_to_a_daily_index(self):
+        # elasticsearch creates an index for events written before the
+        # aliases exist
+        self.write_event(1)
+        self.assertEqual(['cloudify_events_write'],
+                         self.server.indices.keys())
+        self.assertEqual('cloudify_events-2015.10.01', self.roll())
+        self.assertEqual(['cloudify_events-2015.10.01'],
+                         self.server.indices.keys())
+        self.assertEqual(
+            {'cloudify_events': ['cloudify_events-2015.10.01'],
+             'cloudify_events_write': ['cloudify_events-2015.10.01']},
+            self.server.aliases)
+        self.write_event(2)
+        self.assertEqual(
+            ['cloudify_event/1', 'cloudify_event/2'],
+            sorted(self.server.indices['cloudify_events-2015.10.01']['docs']))
+        self.assertEqual('cloudify_events-2015.10.02', self.roll(days=1))
+
+    def test_events_and_events_write_indices_are_moved(self):
+        self.server.indices['cloudify_events'] = {
+            'mappings': {'cloudify_event': {}}, 'settings': {},
+            'docs': {'cloudify_event/1': {}}}
+        self.write_event(2)
+        self.assertEqual('cloudify_events-2015.10.01-1', self.roll())
+        self.assertEqual(
+            {'cloudify_events': ['cloudify_events-2015.10.01',
+                                 'cloudify_events-2015.10.01-1'],
+             'cloudify_events_write': ['cloudify_events-2015.10.01-1']},
+            self.server.aliases)
+        self.assertEqual(
+            {'cloudify_event/2': {}},
+            self.server.indices['cloudify_events-2015.10.01-1']['docs'])
+
+    def test_expired_events_indices_are_deleted(self):
+        for days in range(4):
+            self.roll(days=days)
+        self.server.indices['cloudify_events-2015.09.01-foo'] = {
+            'mappings': {}, 'docs': {}}
+        self.assertEqual(
+            ['cloudify_events-2015.10.01', 'cloudify_events-2015.10.02'],
+            es_schema_creator.expire_events(
+                self.server.url, self.session, 2,
+                today=self.today + datetime.timedelta(days=4)))
+        self.assertEqual(
+            ['cloudify_events-2015.09.01-foo', 'cloudify_events-2015.10.03',
+             'cloudify_events-2015.10.04'], sorted(self.server.indices))
+
+    def test_expired_events_indices_are_closed(self):
+        self.roll()
+        self.roll(days=1)
+        es_schema_creator.expire_events(
+            self.server.url, self.session, 0, close=True,
+            today=self.today + datetime.timedelta(days=1))
+        self.assertTrue(
+            self.server.indices['cloudify_events-2015.10.01']['closed'])
+        self.assertEqual(['cloudify_events-2015.10.02'],
+                         self.server.aliases['cloudify_events'])
+        # the index events are written to never expires
+        self.assertEqual([], es_schema_creator.expire_events(
+            self.server.url, self.session, 0, close=True,
+            today=self.today + datetime.timedelta(days=5)))
@@ -0,0 +1,111 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Compares get-cloudify.py's `run` with the thread polling implementation
+it replaced.
+
+Run it from this directory: `python benchmark_run.py [--repeat N]`
+"""
+
+import argparse
+import logging
+import subprocess
+import time
+from threading import Thread
+
+
+get_cloudify = __import__('get-cloudify')
+
+PROCESS_POLLING_INTERVAL = 0.1
+
+SCENARIOS = [
+    ('single short command', 'echo Hi!'),
+    ('short stderr burst', 'python -c "import sys; '
+                           'sys.stderr.write(\'x\\n\' * 1000)"'),
+    ('noisy command (100k lines)', 'python -c "for i in range(100000): '
+                                   'print(\'Collecting module-%d\' % i)"'),
+    ('slow trickle (10 lines)', 'python -c "import time, sys\n'
+                                'for i in range(10):\n'
+                                '    print(i); sys.stdout.flush(); '
+                                'time.sleep(0.05)"'),
+]
+
+
+class LegacyPipeReader(Thread):
+    def __init__(self, fd, proc, logger, log_level):
+        Thread.__init__(self)
+        self.fd = fd
+        self.proc = proc
+        self.logger = logger
+        self.log_level = log_level
+        self.aggr = ''
+
+    def run(self):
+        while self.proc.poll() is None:
+            output = self.fd.readline()
+            if len(output) > 0:
+                self.aggr += output
+                self.logger.log(self.log_level, output)
+            else:
+                time.sleep(PROCESS_POLLING_INTERVAL)
+
+
+def legacy_run(cmd, suppress_errors=False):
+    lgr = get_cloudify.lgr
+    pipe = subprocess.PIPE
+    proc = subprocess.Popen(cmd, shell=True, stdout=pipe, stderr=pipe)
+    stderr_log_level = logging.NOTSET if suppress_errors else logging.ERROR
+    stdout_thread = LegacyPipeReader(proc.stdout, proc, lgr, logging.DEBUG)
+    stderr_thread = LegacyPipeReader(proc.stderr, proc, lgr, stderr_log_level)
+    stdout_thread.start()
+    stderr_thread.start()
+    while proc.poll() is None:
+        time.sleep(PROCESS_POLLING_INTERVAL)
+    stdout_thread.join()
+    stderr_thread.join()
+    proc.aggr_stdout = stdout_thread.aggr
+    proc.aggr_stderr = stderr_thread.aggr
+    return proc
+
+
+def measure(runner, cmd, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        proc = runner(cmd, suppress_errors=True)
+        timings.append(time.time() - start)
+    return min(timings), len(proc.aggr_stdout) + len(proc.aggr_stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs per scenario (best is kept).')
+    args = parser.parse_args()
+
+    get_cloudify.lgr.setLevel(logging.INFO)
+    row = '{0:<30} {1:>12} {2:>12} {3:>14} {4:>14}'
+    print(row.format('scenario', 'legacy (s)', 'run (s)',
+                     'legacy output', 'run output'))
+    for name, cmd in SCENARIOS:
+        legacy_time, legacy_size = measure(legacy_run, cmd, args.repeat)
+        new_time, new_size = measure(get_cloudify.run, cmd, args.repeat)
+        print(row.format(name, '{0:.3f}'.format(legacy_time),
+                         '{0:.3f}'.format(new_time), legacy_size, new_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -47,13 +47,28 @@ import subprocess
 import argparse
 import platform
 import os
+import re
+import json
+import errno
 import urllib
+import urllib2
+import urlparse
 import struct
 import tempfile
 import logging
 import shutil
-import time
+import select
 import tarfile
+import time
+import hashlib
+import Queue
+import csv
+import base64
+import zipfile
+import ConfigParser
+from StringIO import StringIO
+from collections import deque
+from contextlib import contextmanager
 from threading import Thread
 
 
@@ -75,14 +90,28 @@ The script allows you to install requirement txt files when installing from
 --source.
 If --withrequirements is provided with a value (a URL or path to
 a requirements file) it will use it. If it's provided without a value, it
-will try to download the archive provided in --source, extract it, and look for
-dev-requirements.txt and requirements.txt files within it.
+will stream the archive provided in --source, and look for dev-requirements.txt
+and requirements.txt files within it as it's being downloaded. The downloaded
+archive is then used to install Cloudify instead of downloading it again.
+
+Additional plugins can be installed along with Cloudify by passing them to
+--plugins. Cloudify, its requirement files and the plugins are all installed
+by a single pip invocation so that dependencies are only resolved once.
+
+Passing --cachedir keeps downloaded files (get-pip.py, the --source
+archive, etc..) in a local cache directory, which is shared with the
+packager's download_cache.py, so that they aren't downloaded again by later
+installations.
 
 Passing the --wheelspath allows for an offline installation of Cloudify
 from predownloaded Cloudify dependency wheels. Note that if wheels are found
 within the default wheels directory or within --wheelspath, they will (unless
 the --forceonline flag is set) be used instead of performing an online
-installation.
+installation. If the wheels directory was built by the packager's
+wheelhouse.py, the wheels to install are taken from its index rather than
+having pip search the directory for them. If it has a lock manifest
+(wheelhouse.py --lock), --unpackwheels installs the wheels listed in it by
+unpacking them into the virtualenv, without running pip at all.
 
 The script will attempt to install all necessary requirements including
 python-dev and gcc (for Fabric on Linux), pycrypto (for Fabric on Windows),
@@ -120,6 +149,38 @@ IS_DARWIN = (PLATFORM == 'darwin')
 IS_LINUX = (PLATFORM == 'linux2')
 
 PROCESS_POLLING_INTERVAL = 0.1
+# only the last MAX_RETAINED_OUTPUT bytes of each of a command's output
+# streams are kept in memory (and returned in aggr_stdout/aggr_stderr).
+MAX_RETAINED_OUTPUT = 1024 * 1024
+PIPE_READ_SIZE = 64 * 1024
+
+# written by the packager's wheelhouse.py
+WHEELHOUSE_INDEX = 'index.json'
+WHEELHOUSE_LOCK = 'lock.json'
+MAX_PARALLEL_UNPACKS = 4
+
+# prints the installation paths and compatibility tags of a python
+INSTALL_SCHEME_SCRIPT = (
+    'import json, sys, sysconfig; '
+    'print(json.dumps(dict(sysconfig.get_paths(), '
+    'version="%d%d" % sys.version_info[:2], '
+    'platform=sysconfig.get_platform(), '
+    'maxunicode=sys.maxunicode, python=sys.executable)))')
+
+CONSOLE_SCRIPT_TEMPLATE = '''#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+
+from {module} import {name}
+
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw?|\\.exe)?$', '', sys.argv[0])
+    sys.exit({func}())
+'''
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_PARALLEL_DOWNLOADS = 4
 
 # defined below
 lgr = None
@@ -142,6 +203,10 @@ def init_logger(logger_name):
 
 def run(cmd, suppress_errors=False):
     """Executes a command
+
+    The command's stdout and stderr are logged line by line as they arrive
+    and their tails are set on the returned process as `aggr_stdout` and
+    `aggr_stderr`.
     """
     lgr.debug('Executing: {0}...'.format(cmd))
     pipe = subprocess.PIPE
@@ -150,22 +215,60 @@ def run(cmd, suppress_errors=False):
 
     stderr_log_level = logging.NOTSET if suppress_errors else logging.ERROR
 
-    stdout_thread = PipeReader(proc.stdout, proc, lgr, logging.DEBUG)
-    stderr_thread = PipeReader(proc.stderr, proc, lgr, stderr_log_level)
+    stdout = OutputBuffer(lgr, logging.DEBUG)
+    stderr = OutputBuffer(lgr, stderr_log_level)
+    streams = {proc.stdout: stdout, proc.stderr: stderr}
 
-    stdout_thread.start()
-    stderr_thread.start()
+    # select doesn't support pipes on Windows.
+    if IS_WIN:
+        _read_streams_threaded(streams)
+    else:
+        _read_streams_select(proc, streams)
+    proc.wait()
+    proc.stdout.close()
+    proc.stderr.close()
 
-    while proc.poll() is None:
-        time.sleep(PROCESS_POLLING_INTERVAL)
+    proc.aggr_stdout = stdout.getvalue()
+    proc.aggr_stderr = stderr.getvalue()
 
-    stdout_thread.join()
-    stderr_thread.join()
+    return proc
 
-    proc.aggr_stdout = stdout_thread.aggr
-    proc.aggr_stderr = stderr_thread.aggr
 
-    return proc
+def _read_streams_select(proc, streams):
+    """Reads a process' pipes until they're closed.
+
+    `streams` maps each pipe to the OutputBuffer it should be fed into.
+    select returns as soon as there's output or a pipe is closed, so the
+    polling interval only comes into play when the process has exited while
+    a child it spawned still holds its pipes open, in which case we stop
+    reading once the pipes go quiet.
+    """
+    fds = dict((pipe.fileno(), output) for pipe, output in streams.items())
+    while fds:
+        readable = select.select(
+            list(fds), [], [], PROCESS_POLLING_INTERVAL)[0]
+        if not readable and proc.poll() is not None:
+            break
+        for fd in readable:
+            data = os.read(fd, PIPE_READ_SIZE)
+            if data:
+                fds[fd].feed(data)
+            else:
+                del fds[fd]
+    for output in streams.values():
+        output.flush()
+
+
+def _read_streams_threaded(streams):
+    """Reads a process' pipes using a blocking reader thread per pipe.
+    """
+    readers = [PipeReader(pipe, output) for pipe, output in streams.items()]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    for output in streams.values():
+        output.flush()
 
 
 def drop_root_privileges():
@@ -197,7 +300,8 @@ def make_virtualenv(virtualenv_dir, python_path):
 
 
 def install_module(module, version=False, pre=False, virtualenv_path=False,
-                   wheelspath=False, requirement_files=None, upgrade=False):
+                   wheelspath=False, requirement_files=None, upgrade=False,
+                   extra_modules=None):
     """This will install a Python module.
 
     Can specify a specific version.
@@ -206,8 +310,10 @@ def install_module(module, version=False, pre=False, virtualenv_path=False,
     Can specify a list of paths or urls to requirement txt files.
     Can specify a local wheelspath to use for offline installation.
     Can request an upgrade.
+    Can specify additional modules to install in the same pip invocation.
     """
-    lgr.info('Installing {0}...'.format(module))
+    extra_modules = extra_modules or []
+    lgr.info('Installing {0}...'.format(', '.join([module] + extra_modules)))
     pip_cmd = ['pip', 'install']
     if virtualenv_path:
         pip_cmd[0] = os.path.join(
@@ -218,6 +324,7 @@ def install_module(module, version=False, pre=False, virtualenv_path=False,
     pip_cmd.append(module)
     if version:
         pip_cmd.append(version)
+    pip_cmd.extend(extra_modules)
     if wheelspath:
         pip_cmd.extend(
             ['--use-wheel', '--no-index', '--find-links', wheelspath])
@@ -237,20 +344,522 @@ def install_module(module, version=False, pre=False, virtualenv_path=False,
 def untar_requirement_files(archive, destination):
     """This will extract requirement files from an archive.
     """
-    with tarfile.open(name=archive) as tar:
-        req_files = [req_file for req_file in tar.getmembers()
-                     if os.path.basename(req_file.name)
-                     in REQUIREMENT_FILE_NAMES]
-        tar.extractall(path=destination, members=req_files)
+    with tarfile.open(name=archive, mode='r|*') as tar:
+        _extract_requirement_files(tar, destination)
+
+
+def _to_url(location):
+    """returns a URL for `location`, which may also be a local path (e.g. a
+    --source archive on disk), which urllib2 doesn't open by itself.
+    """
+    if os.path.exists(location) or not urlparse.urlparse(location).scheme:
+        return 'file:' + urllib.pathname2url(os.path.abspath(location))
+    return location
+
+
+def stream_requirement_files(url, destination, archive=None):
+    """This will extract requirement files from an archive while it's being
+    downloaded.
+
+    The response is read through tarfile in stream mode, so the archive is
+    neither written to disk nor scanned in full before extracting. If
+    `archive` is provided, the whole archive is saved there as well so that
+    it can be installed from without downloading it again.
+
+    Returns the headers of the response.
+    """
+    lgr.info('Extracting requirement files from {0}...'.format(url))
+    response = urllib2.urlopen(_to_url(url))
+    try:
+        if archive:
+            with open(archive, 'wb') as f:
+                reader = TeeReader(response, f)
+                with tarfile.open(fileobj=reader, mode='r|*') as tar:
+                    _extract_requirement_files(tar, destination)
+                reader.drain()
+        else:
+            with tarfile.open(fileobj=response, mode='r|*') as tar:
+                _extract_requirement_files(tar, destination)
+    finally:
+        response.close()
+    return response.info()
+
+
+def _extract_requirement_files(tar, destination):
+    """Extracts requirement files from an open tar stream.
+
+    Only files at the root of the archive or in its top level directory
+    (GitHub archives always have one) are extracted, and reading stops as
+    soon as all requirement files were found.
+    """
+    missing = set(REQUIREMENT_FILE_NAMES)
+    for member in tar:
+        path = [part for part in member.name.split('/')
+                if part not in ('', '.')]
+        if member.isfile() and len(path) <= 2 and path[-1] in missing:
+            tar.extract(member, path=destination)
+            missing.remove(path[-1])
+            if not missing:
+                return
+
+
+def _get_cache_path(cache_dir, url, sha256=None):
+    """returns the path of `url` in a download cache
+
+    This must match the layout used by the packager's download_cache.py.
+    """
+    key = hashlib.sha256('{0}\n{1}'.format(
+        url, (sha256 or '').lower())).hexdigest()
+    return os.path.join(cache_dir, key[:2], key)
 
 
-def download_file(url, destination):
+def _is_cached_copy_current(cached, url):
+    """Checks whether a file cached without a checksum is still current,
+    using a conditional request (like the packager's download_cache.py).
+
+    Entries without metadata (e.g. written by older versions) are stale.
+    """
+    try:
+        with open(cached + '.json') as f:
+            metadata = json.load(f)
+    except (IOError, ValueError):
+        return False
+    if not (metadata.get('etag') or metadata.get('last_modified')):
+        return False
+    request = urllib2.Request(url)
+    if metadata.get('etag'):
+        request.add_header('If-None-Match', metadata['etag'])
+    if metadata.get('last_modified'):
+        request.add_header('If-Modified-Since', metadata['last_modified'])
+    try:
+        urllib2.urlopen(request).close()
+    except urllib2.HTTPError as ex:
+        if ex.code == 304:
+            return True
+        raise
+    except urllib2.URLError as ex:
+        lgr.warning('Could not revalidate {0}, using the cached copy '
+                    '({1}).'.format(url, str(ex)))
+        return True
+    return False
+
+
+def copy_from_cache(cache_dir, url, destination, sha256=None):
+    """Copies a cached file to `destination` and returns True if `url`
+    is in the download cache.
+
+    Files cached without a checksum (e.g. GitHub branch archives) are only
+    used if they didn't change upstream.
+    """
+    cached = _get_cache_path(cache_dir, url, sha256)
+    if not os.path.isfile(cached):
+        return False
+    if not sha256 and not _is_cached_copy_current(cached, url):
+        lgr.info('{0} changed since it was cached'.format(url))
+        return False
+    lgr.info('Using cached {0}'.format(url))
+    # cache eviction is least recently used first.
+    os.utime(cached, None)
+    shutil.copyfile(cached, destination)
+    return True
+
+
+def copy_to_cache(cache_dir, url, path, sha256=None, headers=None):
+    """Adds the file at `path`, downloaded from `url`, to the download
+    cache.
+
+    `headers` are the headers of the response `path` was downloaded from.
+    Their ETag/Last-Modified are kept in the same metadata file the
+    packager's download_cache.py writes, for revalidating the cached copy.
+    Files which have neither a checksum nor such headers aren't cached, as
+    they couldn't be revalidated.
+    """
+    headers = headers or {}
+    metadata = {
+        'url': url,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+    }
+    if not (sha256 or metadata['etag'] or metadata['last_modified']):
+        lgr.debug('Not caching {0} (it cannot be revalidated)'.format(url))
+        return
+    cached = _get_cache_path(cache_dir, url, sha256)
+    if not os.path.isdir(os.path.dirname(cached)):
+        try:
+            os.makedirs(os.path.dirname(cached))
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+    digest = hashlib.sha256()
+    with open(path, 'rb') as src:
+        with open(cached + '.part', 'wb') as dst:
+            for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), ''):
+                digest.update(chunk)
+                dst.write(chunk)
+    metadata.update(sha256=digest.hexdigest(),
+                    size=os.path.getsize(cached + '.part'))
+    # the metadata is written first, so that a cached file always has it.
+    with open(cached + '.json', 'w') as f:
+        json.dump(metadata, f)
+    os.rename(cached + '.part', cached)
+
+
+def get_indexed_wheels(wheels_path, projects):
+    """Returns the paths of the wheels required to install `projects`,
+    according to the index of a wheelhouse built by wheelhouse.py.
+
+    Returns None if there's no index, or if it doesn't have all `projects`.
+    """
+    index_path = os.path.join(wheels_path, WHEELHOUSE_INDEX)
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    by_project = dict((w['project'], name)
+                      for name, w in index['wheels'].items())
+    wheels = set()
+    pending = [_normalize_project(p) for p in projects]
+    if not all(p in by_project for p in pending):
+        return None
+    while pending:
+        wheel = by_project.get(pending.pop())
+        if wheel is None or wheel in wheels:
+            continue
+        wheels.add(wheel)
+        pending.extend(index['wheels'][wheel]['requires'])
+    return [os.path.join(wheels_path, name) for name in sorted(wheels)]
+
+
+def get_install_scheme(virtualenv_path):
+    """Returns the installation paths and compatibility details of a
+    virtualenv's python.
+    """
+    python = os.path.join(_get_env_bin_path(virtualenv_path), 'python')
+    return json.loads(subprocess.check_output(
+        [python, '-c', INSTALL_SCHEME_SCRIPT]))
+
+
+def _normalize_project(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _is_compatible_wheel(wheel, scheme):
+    pythons, abis, platforms = \
+        [tag.split('.') for tag in wheel[:-len('.whl')].split('-')[-3:]]
+    version = scheme['version']
+    abi = 'cp{0}{1}'.format(
+        version, 'mu' if scheme['maxunicode'] > 0xffff else 'm')
+    platform_tag = re.sub(r'[-.]', '_', scheme['platform'])
+    return \
+        any(p in ('py' + version[0], 'py' + version, 'cp' + version)
+            for p in pythons) and \
+        any(a in ('none', abi) for a in abis) and \
+        any(p in ('any', platform_tag) for p in platforms)
+
+
+def _get_installed_projects(site_packages):
+    """returns a {project: version} dict of the distributions installed
+    in `site_packages`.
+    """
+    installed = {}
+    for name in os.listdir(site_packages):
+        if name.endswith(('.dist-info', '.egg-info')):
+            parts = name.rsplit('.', 1)[0].split('-')
+            if len(parts) > 1:
+                installed[_normalize_project(parts[0])] = parts[1]
+    return installed
+
+
+def get_locked_wheels(wheels_path, projects, scheme):
+    """Returns the lock manifest entries of the wheels required to install
+    `projects` (in installation order), leaving out ones already installed.
+
+    Raises ValueError if the wheelhouse has no lock manifest, or if it
+    doesn't match the projects or the python they're to be installed with.
+    """
+    lock_path = os.path.join(wheels_path, WHEELHOUSE_LOCK)
+    if not os.path.isfile(lock_path):
+        raise ValueError('no lock manifest in {0}'.format(wheels_path))
+    with open(lock_path) as f:
+        lock = json.load(f)
+    entries = dict((e['project'], e) for e in lock['wheels'])
+    required = set()
+    pending = [_normalize_project(p) for p in projects]
+    for project in pending:
+        if project not in entries:
+            raise ValueError('{0} is not in the lock manifest'.format(
+                project))
+    while pending:
+        project = pending.pop()
+        if project in entries and project not in required:
+            required.add(project)
+            pending.extend(entries[project]['requires'])
+
+    installed = _get_installed_projects(scheme['purelib'])
+    wheels = []
+    for entry in lock['wheels']:
+        if entry['project'] not in required:
+            continue
+        if entry['project'] in installed:
+            if installed[entry['project']] != entry['version']:
+                raise ValueError('{0} {1} is already installed'.format(
+                    entry['project'], installed[entry['project']]))
+            continue
+        if not _is_compatible_wheel(entry['file'], scheme):
+            raise ValueError('{0} is not compatible with {1}'.format(
+                entry['file'], scheme['python']))
+        wheels.append(entry)
+    return wheels
+
+
+def _record_hash(data):
+    return 'sha256=' + base64.urlsafe_b64encode(
+        hashlib.sha256(data).digest()).rstrip('=')
+
+
+def _get_console_scripts(entry_points):
+    parser = ConfigParser.RawConfigParser()
+    parser.readfp(StringIO(entry_points))
+    scripts = []
+    for section in ('console_scripts', 'gui_scripts'):
+        if parser.has_section(section):
+            scripts.extend(parser.items(section))
+    return scripts
+
+
+def unpack_wheel(wheel_path, sha256, scheme, created):
+    """Installs a wheel by extracting it into the paths of `scheme` (see
+    `get_install_scheme`), generating its console scripts and writing a
+    RECORD of the installed files as the files are written.
+
+    Every path created is appended to `created`, so that a failed
+    installation can be rolled back.
+    """
+    digest = hashlib.sha256()
+    with open(wheel_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), ''):
+            digest.update(chunk)
+    if digest.hexdigest() != sha256:
+        raise ValueError('checksum mismatch for {0}'.format(wheel_path))
+
+    def write(path, data, executable=False):
+        if os.path.exists(path):
+            raise ValueError('{0} already exists'.format(path))
+        directory = os.path.dirname(path)
+        missing = []
+        while not os.path.isdir(directory):
+            missing.insert(0, directory)
+            directory = os.path.dirname(directory)
+        for directory in missing:
+            try:
+                os.mkdir(directory)
+            except OSError as ex:
+                # created by a wheel being unpacked concurrently, which
+                # also takes care of removing it
+                if ex.errno != errno.EEXIST:
+                    raise
+                continue
+            created.append(directory)
+        with open(path, 'wb') as f:
+            created.append(path)
+            f.write(data)
+        if executable:
+            os.chmod(path, 0755)
+        record.append((os.path.relpath(path, root), _record_hash(data),
+                       str(len(data))))
+
+    with zipfile.ZipFile(wheel_path) as wheel:
+        names = wheel.namelist()
+        dist_info = [n.split('/')[0] for n in names
+                     if n.split('/')[0].endswith('.dist-info')][0]
+        data_dir = dist_info[:-len('.dist-info')] + '.data'
+        purelib = 'root-is-purelib: true' in \
+            wheel.read(dist_info + '/WHEEL').lower()
+        root = scheme['purelib' if purelib else 'platlib']
+        record = []
+        for name in names:
+            if name.endswith('/') or name.startswith(dist_info + '/RECORD'):
+                continue
+            data = wheel.read(name)
+            if not name.startswith(data_dir + '/'):
+                write(os.path.join(root, name), data)
+                continue
+            _, key, path = name.split('/', 2)
+            is_script = key == 'scripts'
+            if is_script and data.startswith('#!python'):
+                data = '#!' + scheme['python'] + data[len('#!python'):]
+            write(os.path.join(
+                scheme[{'headers': 'include'}.get(key, key)], path), data,
+                executable=is_script)
+        if dist_info + '/entry_points.txt' in names:
+            for script, target in _get_console_scripts(
+                    wheel.read(dist_info + '/entry_points.txt')):
+                module, func = target.split('[')[0].strip().split(':')
+                write(os.path.join(scheme['scripts'], script),
+                      CONSOLE_SCRIPT_TEMPLATE.format(
+                          python=scheme['python'], module=module,
+                          name=func.split('.')[0], func=func),
+                      executable=True)
+        write(os.path.join(root, dist_info, 'INSTALLER'), 'get-cloudify\n')
+        record_path = os.path.join(root, dist_info, 'RECORD')
+        record.append((os.path.relpath(record_path, root), '', ''))
+        output = StringIO()
+        csv.writer(output, lineterminator='\n').writerows(record)
+        with open(record_path, 'wb') as f:
+            created.append(record_path)
+            f.write(output.getvalue())
+
+
+def unpack_wheels(wheels_path, wheels, scheme,
+                  max_workers=MAX_PARALLEL_UNPACKS):
+    """Unpacks the wheels of the lock manifest entries `wheels`
+    concurrently.
+
+    If any of them fails, everything unpacked is removed and the error is
+    raised.
+    """
+    created = []
+    try:
+        run_concurrently(unpack_wheel, [
+            (os.path.join(wheels_path, w['file']), w['sha256'], scheme,
+             created) for w in wheels], max_workers)
+    except Exception:
+        for path in reversed(created):
+            try:
+                if os.path.isdir(path):
+                    os.rmdir(path)
+                else:
+                    os.remove(path)
+            except OSError as ex:
+                lgr.warning('Could not remove {0} ({1})'.format(
+                    path, str(ex)))
+        raise
+
+
+def _get_archive_name(url):
+    """returns a name for a local copy of the archive at `url` by which pip
+    will identify it as an archive.
+    """
+    name = os.path.basename(urlparse.urlparse(url).path)
+    if not name.endswith(('.tar.gz', '.tgz', '.tar.bz2', '.tar')):
+        name = 'cli_source.tar.gz'
+    return name
+
+
+def download_file(url, destination, sha256=None, cache_dir=None):
+    """Downloads `url` to `destination` using a single request.
+
+    Redirects are followed. The file is written to `<destination>.part`
+    and only moved to `destination` when complete, so an interrupted
+    download is resumed with a Range request when retried.
+    If `sha256` is provided, the downloaded file is verified against it.
+    If `cache_dir` is provided, the file is taken from (or added to) the
+    download cache in it.
+
+    Returns the headers of the response, if a request was made.
+    """
+    if cache_dir:
+        if not copy_from_cache(cache_dir, url, destination, sha256):
+            headers = download_file(url, destination, sha256)
+            copy_to_cache(cache_dir, url, destination, sha256, headers)
+        return
+
     lgr.info('Downloading {0} to {1}'.format(url, destination))
-    final_url = urllib.urlopen(url).geturl()
-    if final_url != url:
-        lgr.debug('Redirected to {0}'.format(final_url))
-    f = urllib.URLopener()
-    f.retrieve(final_url, destination)
+    partial = destination + '.part'
+    offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+    request = urllib2.Request(_to_url(url))
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as ex:
+        # the server will refuse a range beyond the end of the file,
+        # in which case the partial download is already complete.
+        if not (offset and ex.code == 416):
+            raise
+        response = None
+
+    digest = hashlib.sha256()
+    if response is None or response.getcode() == 206:
+        lgr.debug('Resuming download of {0} at byte {1}'.format(url, offset))
+        mode = 'ab'
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), ''):
+                digest.update(chunk)
+    else:
+        mode = 'wb'
+    if response is not None:
+        if response.geturl() != url:
+            lgr.debug('Redirected to {0}'.format(response.geturl()))
+        try:
+            with open(partial, mode) as f:
+                for chunk in iter(
+                        lambda: response.read(DOWNLOAD_CHUNK_SIZE), ''):
+                    digest.update(chunk)
+                    f.write(chunk)
+        finally:
+            response.close()
+
+    if sha256 and digest.hexdigest() != sha256.lower():
+        os.remove(partial)
+        raise IOError('Checksum mismatch for {0} (expected sha256 {1}, '
+                      'got {2})'.format(url, sha256, digest.hexdigest()))
+    if os.path.isfile(destination):
+        os.remove(destination)
+    os.rename(partial, destination)
+    return response.info() if response is not None else None
+
+
+def download_files(downloads, max_workers=MAX_PARALLEL_DOWNLOADS):
+    """Downloads several files concurrently.
+
+    `downloads` is a list of argument tuples for `download_file`
+    (e.g. (url, destination) or (url, destination, sha256, cache_dir)).
+    Once all downloads are done, the first error encountered (if any)
+    is raised.
+    """
+    def download(*args):
+        try:
+            download_file(*args)
+        except Exception as ex:
+            lgr.error('Failed downloading {0} ({1})'.format(args[0], str(ex)))
+            raise
+
+    run_concurrently(download, downloads, max_workers)
+
+
+def run_concurrently(func, calls, max_workers):
+    """Calls `func` with each of the argument tuples in `calls`, using up
+    to `max_workers` threads, and returns the results in order.
+
+    Once all calls are done, the first error encountered (if any) is raised.
+    """
+    pending = Queue.Queue()
+    for i, args in enumerate(calls):
+        pending.put((i, args))
+    results = [None] * len(calls)
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                i, args = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(*args)
+            except Exception as ex:
+                errors.append(ex)
+
+    workers = [Thread(target=worker)
+               for _ in range(min(max_workers, len(calls)))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
 
 
 def get_os_props():
@@ -273,23 +882,107 @@ def _get_env_bin_path(env_path):
         return os.path.join(env_path, 'scripts' if IS_WIN else 'bin')
 
 
+def _get_pycrypto_url():
+    """returns the PyCrypto installer matching the Python's architecture
+    """
+    # check 32/64bit to choose the correct PyCrypto installation
+    is_pyx32 = True if struct.calcsize("P") == 4 else False
+    return PYCR32_URL if is_pyx32 else PYCR64_URL
+
+
+class OutputBuffer(object):
+    """Logs a process' output stream line by line and retains its tail.
+
+    Output is kept as a queue of chunks which is trimmed from the left once
+    more than `max_size` bytes were fed, so memory is bounded and no chunk
+    is ever copied more than once before `getvalue` is called.
+    """
+    def __init__(self, logger, log_level, max_size=None):
+        self.logger = logger
+        self.log_level = log_level
+        self.max_size = max_size or MAX_RETAINED_OUTPUT
+        self._chunks = deque()
+        self._size = 0
+        self._partial_line = ''
+
+    def feed(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size - len(self._chunks[0]) >= self.max_size:
+            self._size -= len(self._chunks.popleft())
+
+        if '\n' in data:
+            lines = (self._partial_line + data).split('\n')
+            self._partial_line = lines.pop()
+            for line in lines:
+                self.logger.log(self.log_level, line)
+        else:
+            self._partial_line += data
+        if len(self._partial_line) > self.max_size:
+            self.flush()
+
+    def flush(self):
+        if self._partial_line:
+            self.logger.log(self.log_level, self._partial_line)
+            self._partial_line = ''
+
+    def getvalue(self):
+        return ''.join(self._chunks)[-self.max_size:]
+
+
+class TeeReader(object):
+    """A file-like object which writes all data read from `fileobj`
+    to `copy`.
+    """
+    def __init__(self, fileobj, copy):
+        self.fileobj = fileobj
+        self.copy = copy
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.copy.write(data)
+        return data
+
+    def drain(self):
+        """Reads (and copies) whatever is left in `fileobj`.
+        """
+        for _ in iter(lambda: self.read(DOWNLOAD_CHUNK_SIZE), ''):
+            pass
+
+
 class PipeReader(Thread):
-    def __init__(self, fd, proc, logger, log_level):
+    def __init__(self, fd, output):
         Thread.__init__(self)
         self.fd = fd
-        self.proc = proc
-        self.logger = logger
-        self.log_level = log_level
-        self.aggr = ''
+        self.output = output
 
     def run(self):
-        while self.proc.poll() is None:
-            output = self.fd.readline()
-            if len(output) > 0:
-                self.aggr += output
-                self.logger.log(self.log_level, output)
-            else:
-                time.sleep(PROCESS_POLLING_INTERVAL)
+        for line in iter(self.fd.readline, ''):
+            self.output.feed(line)
+
+
+class PhaseTimer(object):
+    """Measures how long each phase of the installation takes.
+    """
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def report(self, logger):
+        if not self.phases:
+            return
+        logger.info('Installation phases:')
+        for name, duration in self.phases:
+            logger.info('  {0:<30} {1:>8.2f}s'.format(name, duration))
+        logger.info('  {0:<30} {1:>8.2f}s'.format(
+            'total', sum(duration for _, duration in self.phases)))
 
 
 class CloudifyInstaller():
@@ -299,6 +992,7 @@ class CloudifyInstaller():
                  pythonpath='python', installpip=False,
                  installvirtualenv=False, installpythondev=False,
                  installpycrypto=False, os_distro=None, os_release=None,
+                 plugins=None, cachedir=None, unpackwheels=False,
                  **kwargs):
         self.force = force
         self.upgrade = upgrade
@@ -314,6 +1008,14 @@ class CloudifyInstaller():
         self.installvirtualenv = installvirtualenv
         self.installpythondev = installpythondev
         self.installpycrypto = installpycrypto
+        self.plugins = plugins or []
+        self.cache_dir = cachedir
+        self.unpack_wheels = unpackwheels
+        self.timer = PhaseTimer()
+        # maps urls to local copies fetched in advance by `prefetch`
+        self.prefetched = {}
+        # downloads made during the installation go here
+        self.download_dir = None
 
         # TODO: we should test all mutually exclusive arguments.
         if not IS_WIN and self.installpycrypto:
@@ -338,18 +1040,66 @@ class CloudifyInstaller():
         lgr.debug('Identified Distribution: {0}'.format(self.distro))
         lgr.debug('Identified Release: {0}'.format(self.release))
 
+        self.download_dir = tempfile.mkdtemp()
+        if not IS_WIN and os.getuid() == 0 and 'SUDO_UID' in os.environ:
+            # the directory is written to and removed after root privileges
+            # might have been dropped, so it must be owned by the sudoer.
+            os.chown(self.download_dir, int(os.environ['SUDO_UID']),
+                     int(os.environ.get('SUDO_GID', -1)))
+        try:
+            with self.timer.phase('downloads'):
+                self.prefetch(self.download_dir)
+            self._install()
+        finally:
+            shutil.rmtree(self.download_dir)
+
+    def prefetch(self, destination_dir):
+        """Downloads all files required by the installation concurrently.
+
+        This includes get-pip.py and the PyCrypto installer. The --source
+        archive isn't prefetched, since its requirement files are extracted
+        while it's being downloaded.
+        """
+        urls = []
+        if (self.force or self.installpip) and not self.find_pip():
+            urls.append(PIP_URL)
+        if IS_WIN and (self.force or self.installpycrypto):
+            urls.append(_get_pycrypto_url())
+        # each file keeps its name (easy_install only installs the PyCrypto
+        # installer if it's named *.exe), in a directory of its own.
+        downloads = [(url, os.path.join(destination_dir, str(i),
+                                        os.path.basename(url)),
+                      None, self.cache_dir)
+                     for i, url in enumerate(urls)]
+        for download in downloads:
+            os.mkdir(os.path.dirname(download[1]))
+        try:
+            download_files(downloads)
+        except Exception as ex:
+            # each of the steps will try downloading its file again
+            # and handle the failure on its own.
+            lgr.warning('Prefetching files failed ({0}).'.format(str(ex)))
+        self.prefetched = dict((download[0], download[1])
+                               for download in downloads
+                               if os.path.isfile(download[1]))
+
+    def _install(self):
         module = self.source or 'cloudify'
+        phase = self.timer.phase
 
         if self.force or self.installpip:
-            self.install_pip()
+            with phase('pip'):
+                self.install_pip()
 
         if self.virtualenv:
             if self.force or self.installvirtualenv:
-                self.install_virtualenv()
+                with phase('virtualenv'):
+                    self.install_virtualenv()
             env_bin_path = _get_env_bin_path(self.virtualenv)
 
         if IS_LINUX and (self.force or self.installpythondev):
-            self.install_pythondev(self.distro)
+            with phase('python-dev'):
+                self.install_pythondev(self.distro)
         if (IS_VIRTUALENV or self.virtualenv) and not IS_WIN:
             # drop root permissions so that installation is done using the
             # current user.
@@ -357,44 +1107,77 @@ class CloudifyInstaller():
         if self.virtualenv:
             if not os.path.isfile(os.path.join(
                     env_bin_path, ('activate.bat' if IS_WIN else 'activate'))):
-                make_virtualenv(self.virtualenv, self.python_path)
+                with phase('create virtualenv'):
+                    make_virtualenv(self.virtualenv, self.python_path)
 
         if IS_WIN and (self.force or self.installpycrypto):
-            self.install_pycrypto(self.virtualenv)
+            with phase('pycrypto'):
+                self.install_pycrypto(self.virtualenv)
 
         # if withrequirements is not provided, this will be False.
         # if it's provided without a value, it will be a list.
         if isinstance(self.withrequirements, list):
-            self.withrequirements = self.withrequirements \
-                or self._get_default_requirement_files(self.source)
+            with phase('requirement files'):
+                if not self.withrequirements:
+                    archive = None
+                    if os.path.isfile(self.source):
+                        # a local archive is extracted and installed from
+                        # where it is.
+                        archive = self.source
+                    elif not os.path.isdir(self.source):
+                        # keep the source archive so that pip installs it
+                        # from disk rather than downloading it again.
+                        archive = os.path.join(
+                            self.download_dir, _get_archive_name(self.source))
+                        module = archive
+                    self.withrequirements = \
+                        self._get_default_requirement_files(
+                            self.source, archive, self.cache_dir)
 
         if self.force_online or not os.path.isdir(self.wheels_path):
-            install_module(module=module,
-                           version=self.version,
-                           pre=self.pre,
-                           virtualenv_path=self.virtualenv,
-                           requirement_files=self.withrequirements,
-                           upgrade=self.upgrade)
+            with phase('install'):
+                install_module(module=module,
+                               version=self.version,
+                               pre=self.pre,
+                               virtualenv_path=self.virtualenv,
+                               requirement_files=self.withrequirements,
+                               upgrade=self.upgrade,
+                               extra_modules=self.plugins)
+        elif self.unpack_wheels and self.install_locked_wheels(module):
+            pass
         elif os.path.isdir(self.wheels_path):
             lgr.info('Wheels directory found: "{0}". '
                      'Attemping offline installation...'.format(
                          self.wheels_path))
+            wheels = get_indexed_wheels(
+                self.wheels_path, [module] + (self.plugins or []))
+            if wheels:
+                lgr.info('Installing {0} wheels listed in the wheelhouse '
+                         'index...'.format(len(wheels)))
+                offline_module, extra_modules = wheels[0], wheels[1:]
+            else:
+                offline_module, extra_modules = module, self.plugins
             try:
-                install_module(module=module,
-                               pre=True,
-                               virtualenv_path=self.virtualenv,
-                               wheelspath=self.wheels_path,
-                               requirement_files=self.withrequirements,
-                               upgrade=self.upgrade)
+                with phase('offline install'):
+                    install_module(module=offline_module,
+                                   pre=True,
+                                   virtualenv_path=self.virtualenv,
+                                   wheelspath=self.wheels_path,
+                                   requirement_files=self.withrequirements,
+                                   upgrade=self.upgrade,
+                                   extra_modules=extra_modules)
             except Exception as ex:
                 lgr.warning('Offline installation failed ({0}).'.format(
                     str(ex)))
-                install_module(module=module,
-                               version=self.version,
-                               pre=self.pre,
-                               virtualenv_path=self.virtualenv,
-                               requirement_files=self.withrequirements,
-                               upgrade=self.upgrade)
+                with phase('install'):
+                    install_module(module=module,
+                                   version=self.version,
+                                   pre=self.pre,
+                                   virtualenv_path=self.virtualenv,
+                                   requirement_files=self.withrequirements,
+                                   upgrade=self.upgrade,
+                                   extra_modules=self.plugins)
+        self.timer.report(lgr)
         if self.virtualenv:
             activate_path = os.path.join(env_bin_path, 'activate')
             activate_command = \
@@ -403,6 +1186,33 @@ class CloudifyInstaller():
             lgr.info('You can now run: "{0}" to activate '
                      'the Virtualenv.'.format(activate_command))
 
+    def install_locked_wheels(self, module):
+        """Installs the wheels listed in the wheelhouse's lock manifest by
+        unpacking them directly into the virtualenv, without pip.
+
+        Returns False if that isn't possible (e.g. the lock manifest doesn't
+        match the wheels or the virtualenv), in which case nothing is left
+        installed and pip should be used instead.
+        """
+        if not self.virtualenv or IS_WIN or self.withrequirements:
+            lgr.warning('Unpacking wheels is only supported when installing '
+                        'into a virtualenv, without requirement files, '
+                        'on Linux or OSX.')
+            return False
+        try:
+            with self.timer.phase('unpack wheels'):
+                scheme = get_install_scheme(self.virtualenv)
+                wheels = get_locked_wheels(
+                    self.wheels_path, [module] + self.plugins, scheme)
+                lgr.info('Unpacking {0} wheels into {1}...'.format(
+                    len(wheels), self.virtualenv))
+                unpack_wheels(self.wheels_path, wheels, scheme)
+        except Exception as ex:
+            lgr.warning('Could not unpack wheels ({0}), installing them '
+                        'using pip.'.format(str(ex)))
+            return False
+        return True
+
     @staticmethod
     def find_virtualenv():
         try:
@@ -431,12 +1241,15 @@ class CloudifyInstaller():
         if not self.find_pip():
             try:
                 tempdir = tempfile.mkdtemp()
-                get_pip_path = os.path.join(tempdir, 'get-pip.py')
-                try:
-                    download_file(PIP_URL, get_pip_path)
-                except StandardError as e:
-                    sys.exit('Failed downloading pip from {0}. ({1})'.format(
-                             PIP_URL, e.message))
+                get_pip_path = self.prefetched.get(PIP_URL)
+                if not get_pip_path:
+                    get_pip_path = os.path.join(tempdir, 'get-pip.py')
+                    try:
+                        download_file(PIP_URL, get_pip_path,
+                                      cache_dir=self.cache_dir)
+                    except StandardError as e:
+                        sys.exit('Failed downloading pip from {0}. '
+                                 '({1})'.format(PIP_URL, e.message))
                 result = run('{0} {1}'.format(
                     self.python_path, get_pip_path))
                 if not result.returncode == 0:
@@ -447,28 +1260,35 @@ class CloudifyInstaller():
             lgr.info('pip is already installed in the path.')
 
     @staticmethod
-    def _get_default_requirement_files(source):
+    def _get_default_requirement_files(source, archive=None, cache_dir=None):
+        """returns the requirement files found in the --source
+
+        If `archive` is an existing file, it's used as the source archive.
+        Otherwise the source archive is streamed from its URL and saved
+        to `archive` (if provided). If `cache_dir` is provided as well, the
+        archive is taken from (or added to) the download cache in it.
+        """
         if os.path.isdir(source):
             return [os.path.join(source, f) for f in REQUIREMENT_FILE_NAMES
                     if os.path.isfile(os.path.join(source, f))]
         else:
             tempdir = tempfile.mkdtemp()
-            archive = os.path.join(tempdir, 'cli_source')
             # TODO: need to handle deletion of the temp source dir
             try:
-                download_file(source, archive)
+                if archive and cache_dir and not os.path.isfile(archive):
+                    copy_from_cache(cache_dir, source, archive)
+                if archive and os.path.isfile(archive):
+                    untar_requirement_files(archive, tempdir)
+                else:
+                    headers = stream_requirement_files(
+                        source, tempdir, archive)
+                    if archive and cache_dir:
+                        copy_to_cache(cache_dir, source, archive,
+                                      headers=headers)
             except Exception as ex:
-                lgr.error('Could not download {0} ({1})'.format(
-                    source, str(ex)))
+                lgr.error('Could not extract requirement files from '
+                          '{0} ({1})'.format(source, str(ex)))
                 sys.exit(1)
-            try:
-                untar_requirement_files(archive, tempdir)
-            except Exception as ex:
-                lgr.error('Could not extract {0} ({1})'.format(
-                    archive, str(ex)))
-                sys.exit(1)
-            finally:
-                os.remove(archive)
             # GitHub always adds a single parent directory to the tree.
             # TODO: look in parent dir, then one level underneath.
             # the GitHub style tar assumption isn't a very good one.
@@ -506,14 +1326,12 @@ class CloudifyInstaller():
         It will attempt to install the 32 or 64 bit version according to the
         Python version installed.
         """
-        # check 32/64bit to choose the correct PyCrypto installation
-        is_pyx32 = True if struct.calcsize("P") == 4 else False
-
+        url = _get_pycrypto_url()
         lgr.info('Installing PyCrypto {0}bit...'.format(
-            '32' if is_pyx32 else '64'))
+            '32' if url == PYCR32_URL else '64'))
         # easy install is used instead of pip as pip doesn't handle windows
         # executables.
-        cmd = 'easy_install {0}'.format(PYCR32_URL if is_pyx32 else PYCR64_URL)
+        cmd = 'easy_install {0}'.format(self.prefetched.get(url, url))
         if virtualenv_path:
             cmd = os.path.join(_get_env_bin_path(virtualenv_path), cmd)
         run(cmd)
@@ -580,6 +1398,9 @@ def parse_args(args=None):
         '-r', '--withrequirements', nargs='*',
         help='Install default or provided requirements file.',
         action=VerifySource)
+    parser.add_argument(
+        '-p', '--plugins', nargs='+',
+        help='Additional plugins to install along with Cloudify.')
     parser.add_argument(
         '-u', '--upgrade', action='store_true',
         help='Upgrades Cloudify if already installed.')
@@ -599,6 +1420,14 @@ def parse_args(args=None):
             '--pythonpath', type=str, default='python',
             help='Python path to use (defaults to "python") '
                  'when creating a virtualenv.')
+    parser.add_argument(
+        '--unpackwheels', action='store_true',
+        help='Install the wheels listed in the lock manifest of the wheels '
+             'directory by unpacking them into the virtualenv rather than '
+             'with pip (falls back to pip if they don\'t match).')
+    parser.add_argument(
+        '--cachedir', type=str,
+        help='Path to a directory to cache downloaded files in.')
     parser.add_argument(
         '--installpip', action='store_true',
         help='Attempt to install pip.')
@@ -21,6 +21,16 @@ import mock
 import shutil
 import os
 import tarfile
+import time
+import hashlib
+import json
+import csv
+import zipfile
+import subprocess
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
 
 
 get_cloudify = __import__("get-cloudify")
@@ -33,17 +43,11 @@ class CliBuilderUnitTests(testtools.TestCase):
         super(CliBuilderUnitTests, self).setUp()
         self.get_cloudify = get_cloudify
         self.get_cloudify.IS_VIRTUALENV = False
-
-    def _create_dummy_requirements_tar(self, url, destination):
-        tempdir = os.path.dirname(destination)
-        fpath = self._generate_requirements_file(tempdir)
-        try:
-            tar = tarfile.open(name=destination, mode='w:gz')
-            tar.add(name=tempdir, arcname='maindir')
-            tar.close()
-        finally:
-            os.remove(fpath)
-        return destination
+        # some tests replace these, make sure they don't leak.
+        self.addCleanup(setattr, get_cloudify, 'download_file',
+                        get_cloudify.download_file)
+        self.addCleanup(setattr, get_cloudify.sys, 'stdout',
+                        get_cloudify.sys.stdout)
 
     def _generate_requirements_file(self, path):
         fpath = os.path.join(path, 'dev-requirements.txt')
@@ -78,6 +82,78 @@ class CliBuilderUnitTests(testtools.TestCase):
         self.assertIsNot(proc.returncode, 0, 'command \'{}\' execution was '
                                              'expected to fail'.format(cmd))
 
+    def test_run_aggregates_output(self):
+        proc = self.get_cloudify.run('echo out && echo err 1>&2')
+        self.assertEqual('out\n', proc.aggr_stdout)
+        self.assertEqual('err\n', proc.aggr_stderr)
+
+    def test_run_retains_output_tail(self):
+        proc = self.get_cloudify.run(
+            'python -c "for i in range(20000): print(i)"')
+        self.assertEqual(0, proc.returncode)
+        self.assertEqual(
+            ''.join('{0}\n'.format(i) for i in range(20000)),
+            proc.aggr_stdout)
+
+    def test_run_caps_retained_output(self):
+        max_size = 1024
+        with mock.patch.object(
+                self.get_cloudify, 'MAX_RETAINED_OUTPUT', max_size):
+            proc = self.get_cloudify.run(
+                'python -c "for i in range(20000): print(i)"')
+        self.assertEqual(max_size, len(proc.aggr_stdout))
+        self.assertTrue(proc.aggr_stdout.endswith('19998\n19999\n'))
+
+    def test_run_returns_when_process_exits(self):
+        # the backgrounded sleep inherits the pipes and keeps them open
+        # after the shell itself exits.
+        start = time.time()
+        proc = self.get_cloudify.run('(sleep 5 &) && echo done')
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual(0, proc.returncode)
+        self.assertEqual('done\n', proc.aggr_stdout)
+
+    def test_output_buffer_logs_lines(self):
+        logger = mock.MagicMock()
+        output = self.get_cloudify.OutputBuffer(logger, 10, max_size=4)
+        output.feed('first\nsec')
+        output.feed('ond\nthird')
+        output.flush()
+        self.assertEqual(
+            [mock.call(10, 'first'), mock.call(10, 'second'),
+             mock.call(10, 'third')],
+            logger.log.call_args_list)
+        self.assertEqual('hird', output.getvalue())
+
+    def test_install_module_with_extra_modules(self):
+        with mock.patch.object(self.get_cloudify, 'run') as run:
+            run.return_value.returncode = 0
+            self.get_cloudify.install_module(
+                'cloudify', requirement_files=['reqs.txt'],
+                wheelspath='wheelhouse',
+                extra_modules=['cloudify-aws-plugin',
+                               'cloudify-fabric-plugin'])
+        run.assert_called_once_with(
+            'pip install -r reqs.txt cloudify cloudify-aws-plugin '
+            'cloudify-fabric-plugin --use-wheel --no-index '
+            '--find-links wheelhouse')
+
+    def test_phase_timer(self):
+        timer = self.get_cloudify.PhaseTimer()
+        with timer.phase('first'):
+            pass
+        try:
+            with timer.phase('second'):
+                raise ValueError('Boom!')
+        except ValueError:
+            pass
+        self.assertEqual(['first', 'second'],
+                         [name for name, _ in timer.phases])
+        logger = mock.MagicMock()
+        timer.report(logger)
+        # a header, a line per phase and the total.
+        self.assertEqual(4, logger.info.call_count)
+
     def test_install_pip_failed_download(self):
         installer = self.get_cloudify.CloudifyInstaller()
 
@@ -162,19 +238,6 @@ class CliBuilderUnitTests(testtools.TestCase):
         finally:
             shutil.rmtree(tmp_venv)
 
-    def test_get_requirements_from_source_url(self):
-        def get(url, destination):
-            return self._create_dummy_requirements_tar(url, destination)
-
-        self.get_cloudify.download_file = get
-        try:
-            installer = self.get_cloudify.CloudifyInstaller()
-            req_list = installer._get_default_requirement_files('null')
-            self.assertEquals(len(req_list), 1)
-            self.assertIn('dev-requirements.txt', req_list[0])
-        finally:
-            self.get_cloudify.download_file = get_cloudify.download_file
-
     def test_get_requirements_from_source_path(self):
         tempdir = tempfile.mkdtemp()
         self._generate_requirements_file(tempdir)
@@ -186,6 +249,535 @@ class CliBuilderUnitTests(testtools.TestCase):
         finally:
             shutil.rmtree(tempdir)
 
+    def test_get_indexed_wheels(self):
+        wheels_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, wheels_path)
+        self.assertIsNone(
+            self.get_cloudify.get_indexed_wheels(wheels_path, ['cloudify']))
+
+        def wheel(project, requires=()):
+            return {'project': project, 'requires': list(requires)}
+
+        index = {'wheels': {
+            'cloudify-3.3-py27-none-any.whl': wheel(
+                'cloudify', ['cloudify-rest-client', 'argparse']),
+            'cloudify_rest_client-3.3-py27-none-any.whl': wheel(
+                'cloudify-rest-client', ['requests']),
+            'requests-2.7.0-py2.py3-none-any.whl': wheel('requests'),
+            'cloudify_aws_plugin-1.3-py27-none-any.whl': wheel(
+                'cloudify-aws-plugin', ['boto']),
+            'boto-2.38.0-py2.py3-none-any.whl': wheel('boto'),
+            'virtualenv-12.0.7-py2.py3-none-any.whl': wheel('virtualenv'),
+        }}
+        with open(os.path.join(wheels_path, 'index.json'), 'w') as f:
+            json.dump(index, f)
+
+        wheels = self.get_cloudify.get_indexed_wheels(
+            wheels_path, ['cloudify'])
+        self.assertEqual([os.path.join(wheels_path, w) for w in [
+            'cloudify-3.3-py27-none-any.whl',
+            'cloudify_rest_client-3.3-py27-none-any.whl',
+            'requests-2.7.0-py2.py3-none-any.whl']], wheels)
+        wheels = self.get_cloudify.get_indexed_wheels(
+            wheels_path, ['cloudify', 'cloudify_aws_plugin'])
+        self.assertEqual(5, len(wheels))
+        self.assertIsNone(self.get_cloudify.get_indexed_wheels(
+            wheels_path, ['cloudify', 'cloudify-vsphere-plugin']))
+
+
+class FileServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves `server.files`, supporting Range requests and redirecting
+    /redirect/<path> to /<path>. Files with an ETag in `server.etags` can
+    be requested conditionally.
+    """
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        self.server.requests.append((self.path, range_header))
+        if self.path.startswith('/redirect/'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect'):])
+            self.end_headers()
+            return
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = self.server.etags.get(self.path)
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class FileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), FileServerHandler)
+        self.files = files
+        self.etags = {}
+        self.requests = []
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+class DownloadTests(testtools.TestCase):
+    """Tests get_cloudify.py's downloader against a local HTTP server"""
+
+    def setUp(self):
+        super(DownloadTests, self).setUp()
+        self.get_cloudify = get_cloudify
+        self.content = os.urandom(256 * 1024)
+        self.server = FileServer({
+            '/archive.tar.gz': self.content,
+            '/get-pip.py': 'print("pip")\n',
+            '/pycrypto.exe': os.urandom(1024),
+        })
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.destination = os.path.join(self.tempdir, 'archive.tar.gz')
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_file(self):
+        self.get_cloudify.download_file(
+            self.server.url + '/archive.tar.gz', self.destination)
+        self.assertEqual(self.content, self._read(self.destination))
+        self.assertFalse(os.path.exists(self.destination + '.part'))
+
+    def test_download_file_follows_redirect_in_one_request(self):
+        self.get_cloudify.download_file(
+            self.server.url + '/redirect/archive.tar.gz', self.destination)
+        self.assertEqual(self.content, self._read(self.destination))
+        self.assertEqual(
+            [('/redirect/archive.tar.gz', None), ('/archive.tar.gz', None)],
+            self.server.requests)
+
+    def test_download_file_resumes(self):
+        with open(self.destination + '.part', 'wb') as f:
+            f.write(self.content[:1000])
+        self.get_cloudify.download_file(
+            self.server.url + '/archive.tar.gz', self.destination,
+            sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.content, self._read(self.destination))
+        self.assertEqual([('/archive.tar.gz', 'bytes=1000-')],
+                         self.server.requests)
+
+    def test_download_file_with_complete_partial_download(self):
+        with open(self.destination + '.part', 'wb') as f:
+            f.write(self.content)
+        self.get_cloudify.download_file(
+            self.server.url + '/archive.tar.gz', self.destination)
+        self.assertEqual(self.content, self._read(self.destination))
+
+    def test_download_file_checksum_mismatch(self):
+        ex = self.assertRaises(
+            IOError, self.get_cloudify.download_file,
+            self.server.url + '/archive.tar.gz', self.destination,
+            sha256=hashlib.sha256('something else').hexdigest())
+        self.assertIn('Checksum mismatch', str(ex))
+        self.assertEqual([], os.listdir(self.tempdir))
+
+    def test_download_file_with_cache(self):
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        url = self.server.url + '/archive.tar.gz'
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        for _ in range(2):
+            self.get_cloudify.download_file(
+                url, self.destination, sha256, cache_dir)
+            self.assertEqual(self.content, self._read(self.destination))
+        self.assertEqual(1, len(self.server.requests))
+        cached = self.get_cloudify._get_cache_path(cache_dir, url, sha256)
+        self.assertEqual(self.content, self._read(cached))
+        # the same metadata as the packager's download_cache.py writes
+        with open(cached + '.json') as f:
+            metadata = json.load(f)
+        self.assertEqual({'url': url, 'sha256': sha256,
+                          'size': len(self.content), 'etag': None,
+                          'last_modified': None}, metadata)
+
+    def test_download_file_with_cache_revalidates(self):
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        url = self.server.url + '/archive.tar.gz'
+        self.server.etags['/archive.tar.gz'] = '"v1"'
+        for _ in range(2):
+            self.get_cloudify.download_file(
+                url, self.destination, cache_dir=cache_dir)
+            self.assertEqual(self.content, self._read(self.destination))
+        self.assertEqual(2, len(self.server.requests))
+
+        # the file changed upstream
+        self.server.files['/archive.tar.gz'] = 'new content'
+        self.server.etags['/archive.tar.gz'] = '"v2"'
+        self.get_cloudify.download_file(
+            url, self.destination, cache_dir=cache_dir)
+        self.assertEqual('new content', self._read(self.destination))
+        self.assertEqual('new content', self._read(
+            self.get_cloudify._get_cache_path(cache_dir, url)))
+
+    def test_download_file_with_cache_without_validators(self):
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        url = self.server.url + '/archive.tar.gz'
+        for _ in range(2):
+            self.get_cloudify.download_file(
+                url, self.destination, cache_dir=cache_dir)
+            self.assertEqual(self.content, self._read(self.destination))
+        self.assertEqual(2, len(self.server.requests))
+        self.assertFalse(os.path.isfile(
+            self.get_cloudify._get_cache_path(cache_dir, url)))
+
+    def test_download_files(self):
+        downloads = [
+            (self.server.url + path, os.path.join(self.tempdir, path[1:]))
+            for path in self.server.files]
+        self.get_cloudify.download_files(downloads)
+        for path, content in self.server.files.items():
+            self.assertEqual(
+                content, self._read(os.path.join(self.tempdir, path[1:])))
+
+    def test_download_files_failure(self):
+        downloads = [
+            (self.server.url + '/missing', os.path.join(self.tempdir, 'm')),
+            (self.server.url + '/archive.tar.gz', self.destination)]
+        self.assertRaises(urllib2.HTTPError,
+                          self.get_cloudify.download_files, downloads)
+        self.assertEqual(self.content, self._read(self.destination))
+
+    @staticmethod
+    def _create_source_archive(requirement_files, trailing_size=0):
+        """returns a GitHub style source archive
+        """
+        members = [('maindir/plugins/plugin/requirements.txt', 'nested\n')]
+        members.extend(('maindir/{0}'.format(name), 'sh==1.11\n')
+                       for name in requirement_files)
+        members.append(('maindir/blob', os.urandom(trailing_size)))
+        archive = StringIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, content in members:
+                member = tarfile.TarInfo(name)
+                member.size = len(content)
+                tar.addfile(member, StringIO(content))
+        return archive.getvalue()
+
+    def test_get_requirements_from_source_url(self):
+        self.server.files['/source.tar.gz'] = \
+            self._create_source_archive(['dev-requirements.txt'])
+        installer = self.get_cloudify.CloudifyInstaller()
+        req_list = installer._get_default_requirement_files(
+            self.server.url + '/source.tar.gz')
+        self.assertEquals(len(req_list), 1)
+        self.assertIn('dev-requirements.txt', req_list[0])
+
+    def test_get_requirements_from_source_url_keeps_archive(self):
+        source = self._create_source_archive(
+            self.get_cloudify.REQUIREMENT_FILE_NAMES, 1024 * 1024)
+        self.server.files['/source.tar.gz'] = source
+        installer = self.get_cloudify.CloudifyInstaller()
+        req_list = installer._get_default_requirement_files(
+            self.server.url + '/source.tar.gz', self.destination)
+        self.assertEqual(
+            ['maindir/dev-requirements.txt', 'maindir/requirements.txt'],
+            [os.path.join(*path.split(os.sep)[-2:]) for path in req_list])
+        self.assertEqual(source, self._read(self.destination))
+
+        # the cached archive is used from now on
+        self.server.files.clear()
+        req_list = installer._get_default_requirement_files(
+            self.server.url + '/source.tar.gz', self.destination)
+        self.assertEqual(2, len(req_list))
+
+    def test_get_requirements_from_source_url_with_cache(self):
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        url = self.server.url + '/source.tar.gz'
+        self.server.files['/source.tar.gz'] = self._create_source_archive(
+            ['dev-requirements.txt'])
+        self.server.etags['/source.tar.gz'] = '"master-1"'
+        installer = self.get_cloudify.CloudifyInstaller()
+        installer._get_default_requirement_files(
+            url, self.destination, cache_dir)
+        os.remove(self.destination)
+
+        # the branch moved on, so the cached archive is not used
+        self.server.files['/source.tar.gz'] = self._create_source_archive(
+            self.get_cloudify.REQUIREMENT_FILE_NAMES)
+        self.server.etags['/source.tar.gz'] = '"master-2"'
+        req_list = installer._get_default_requirement_files(
+            url, self.destination, cache_dir)
+        self.assertEqual(2, len(req_list))
+        os.remove(self.destination)
+
+        req_list = installer._get_default_requirement_files(
+            url, self.destination, cache_dir)
+        self.assertEqual(2, len(req_list))
+        self.assertEqual(self.server.files['/source.tar.gz'],
+                         self._read(self.destination))
+        # a download, a revalidation and a download, a revalidation
+        self.assertEqual(4, len(self.server.requests))
+
+    def _write_local_source_archive(self):
+        path = os.path.join(self.tempdir, 'local source.tar.gz')
+        with open(path, 'wb') as f:
+            f.write(self._create_source_archive(['dev-requirements.txt']))
+        return path
+
+    def test_get_requirements_from_local_source_archive(self):
+        source = self._write_local_source_archive()
+        installer = self.get_cloudify.CloudifyInstaller()
+        for archive in (None, source):
+            req_list = installer._get_default_requirement_files(
+                source, archive)
+            self.assertEquals(len(req_list), 1)
+            self.assertIn('dev-requirements.txt', req_list[0])
+
+    def test_download_file_from_local_path(self):
+        source = self._write_local_source_archive()
+        self.get_cloudify.download_file(source, self.destination)
+        self.assertEqual(self._read(source), self._read(self.destination))
+
+    def test_install_from_local_source_archive(self):
+        source = self._write_local_source_archive()
+        installer = self.get_cloudify.CloudifyInstaller(
+            source=source, withrequirements=[],
+            wheelspath=os.path.join(self.tempdir, 'wheelhouse'),
+            cachedir=os.path.join(self.tempdir, 'cache'))
+        installer.download_dir = self.tempdir
+        with mock.patch.object(self.get_cloudify,
+                               'install_module') as install_module:
+            installer._install()
+        kwargs = install_module.call_args[1]
+        self.assertEqual(source, kwargs['module'])
+        self.assertEqual(['dev-requirements.txt'],
+                         [os.path.basename(path)
+                          for path in kwargs['requirement_files']])
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'cache')))
+
+    def test_stream_requirement_files_stops_when_found(self):
+        source = self._create_source_archive(
+            self.get_cloudify.REQUIREMENT_FILE_NAMES, 1024 * 1024)
+        # the archive is truncated right after the requirement files, so
+        # reading it any further would fail.
+        self.server.files['/source.tar.gz'] = source[:len(source) / 2]
+        self.get_cloudify.stream_requirement_files(
+            self.server.url + '/source.tar.gz', self.tempdir)
+        for name in self.get_cloudify.REQUIREMENT_FILE_NAMES:
+            self.assertEqual('sh==1.11\n', self._read(
+                os.path.join(self.tempdir, 'maindir', name)))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tempdir, 'maindir', 'plugins')))
+
+    def test_get_archive_name(self):
+        self.assertEqual('3.2.tar.gz', self.get_cloudify._get_archive_name(
+            'https://github.com/cloudify-cosmo/cloudify-cli/archive/'
+            '3.2.tar.gz'))
+        self.assertEqual(
+            'cli_source.tar.gz',
+            self.get_cloudify._get_archive_name('http://host/download?id=1'))
+
+    def test_prefetch(self):
+        installer = self.get_cloudify.CloudifyInstaller(
+            installpip=True)
+        installer.find_pip = mock.MagicMock(return_value=False)
+        with mock.patch.object(self.get_cloudify, 'PIP_URL',
+                               self.server.url + '/get-pip.py'):
+            installer.prefetch(self.tempdir)
+        self.assertEqual([self.server.url + '/get-pip.py'],
+                         list(installer.prefetched))
+        self.assertEqual('print("pip")\n', self._read(
+            installer.prefetched[self.server.url + '/get-pip.py']))
+
+    def test_prefetch_keeps_file_names(self):
+        installer = self.get_cloudify.CloudifyInstaller(
+            installpip=True, installpycrypto=True)
+        installer.find_pip = mock.MagicMock(return_value=False)
+        pycrypto_url = self.server.url + '/pycrypto.exe'
+        with mock.patch.multiple(
+                self.get_cloudify, IS_WIN=True,
+                PIP_URL=self.server.url + '/get-pip.py',
+                _get_pycrypto_url=mock.MagicMock(return_value=pycrypto_url)):
+            installer.prefetch(self.tempdir)
+        self.assertEqual('pycrypto.exe', os.path.basename(
+            installer.prefetched[pycrypto_url]))
+        self.assertEqual(self.server.files['/pycrypto.exe'], self._read(
+            installer.prefetched[pycrypto_url]))
+        self.assertEqual('get-pip.py', os.path.basename(
+            installer.prefetched[self.server.url + '/get-pip.py']))
+
+
+class WheelUnpackTests(testtools.TestCase):
+    """Tests installing wheels from a lock manifest without pip"""
+
+    def setUp(self):
+        super(WheelUnpackTests, self).setUp()
+        self.get_cloudify = get_cloudify
+        # other tests change the platform
+        patcher = mock.patch.object(get_cloudify, 'IS_WIN', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wheels_path = tempfile.mkdtemp()
+        self.prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.wheels_path)
+        self.addCleanup(shutil.rmtree, self.prefix)
+        self.scheme = {
+            'purelib': os.path.join(self.prefix, 'site-packages'),
+            'platlib': os.path.join(self.prefix, 'site-packages'),
+            'scripts': os.path.join(self.prefix, 'bin'),
+            'data': self.prefix,
+            'include': os.path.join(self.prefix, 'include'),
+            'python': get_cloudify.sys.executable,
+            'version': '27',
+            'platform': 'linux-x86_64',
+            'maxunicode': 0x10ffff,
+        }
+        os.mkdir(self.scheme['purelib'])
+
+    def _make_wheel(self, project, version, files, requires=(),
+                    entry_points=None, tags='py2-none-any'):
+        dist_info = '{0}-{1}.dist-info'.format(project, version)
+        name = '{0}-{1}-{2}.whl'.format(project, version, tags)
+        path = os.path.join(self.wheels_path, name)
+        with zipfile.ZipFile(path, 'w') as wheel:
+            for file_name, content in files.items():
+                wheel.writestr(file_name, content)
+            wheel.writestr(dist_info + '/METADATA',
+                           'Name: {0}\nVersion: {1}\n'.format(
+                               project, version))
+            wheel.writestr(dist_info + '/WHEEL', 'Root-Is-Purelib: true\n')
+            wheel.writestr(dist_info + '/RECORD', '')
+            if entry_points:
+                wheel.writestr(dist_info + '/entry_points.txt', entry_points)
+        with open(path, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        return {'file': name, 'project': project, 'version': version,
+                'requires': list(requires), 'sha256': sha256}
+
+    def _write_lock(self, *wheels):
+        with open(os.path.join(self.wheels_path, 'lock.json'), 'w') as f:
+            json.dump({'wheels': wheels}, f)
+
+    def test_unpack_wheels(self):
+        wheel = self._make_wheel(
+            'demo', '1.0',
+            {'demo/__init__.py': 'def main():\n    print("demo!")\n',
+             'demo-1.0.data/scripts/demo-tool': '#!python\nprint(1)\n'},
+            entry_points='[console_scripts]\ndemo = demo:main\n')
+        self.get_cloudify.unpack_wheels(
+            self.wheels_path, [wheel], self.scheme)
+
+        site_packages = self.scheme['purelib']
+        self.assertTrue(os.path.isfile(
+            os.path.join(site_packages, 'demo', '__init__.py')))
+        with open(os.path.join(self.prefix, 'bin', 'demo-tool')) as f:
+            self.assertEqual('#!{0}\n'.format(self.scheme['python']),
+                             f.readline())
+        env = dict(os.environ, PYTHONPATH=site_packages)
+        output = subprocess.check_output(
+            [os.path.join(self.prefix, 'bin', 'demo')], env=env)
+        self.assertEqual('demo!\n', output)
+
+        with open(os.path.join(
+                site_packages, 'demo-1.0.dist-info', 'RECORD')) as f:
+            record = dict((row[0], row[1:]) for row in csv.reader(f))
+        self.assertIn('demo/__init__.py', record)
+        self.assertIn(os.path.join('..', 'bin', 'demo'), record)
+        self.assertEqual(['', ''], record['demo-1.0.dist-info/RECORD'])
+        self.assertTrue(record['demo/__init__.py'][0].startswith('sha256='))
+
+    def test_unpack_wheels_rolls_back_on_failure(self):
+        good = self._make_wheel('good', '1.0', {'good/__init__.py': ''})
+        bad = self._make_wheel('bad', '1.0', {'bad/__init__.py': ''})
+        bad['sha256'] = 'not-the-checksum'
+        self.assertRaises(
+            ValueError, self.get_cloudify.unpack_wheels,
+            self.wheels_path, [good, bad], self.scheme)
+        self.assertEqual([], os.listdir(self.scheme['purelib']))
+
+    def test_unpack_wheel_into_directory_created_concurrently(self):
+        wheel = self._make_wheel('demo', '1.0', {'ns/demo/__init__.py': ''})
+        namespace = os.path.join(self.scheme['purelib'], 'ns')
+        mkdir = os.mkdir
+
+        def racing_mkdir(path, *args):
+            if path == namespace:
+                # another wheel being unpacked creates it first
+                mkdir(path)
+            mkdir(path, *args)
+
+        created = []
+        with mock.patch('os.mkdir', side_effect=racing_mkdir):
+            self.get_cloudify.unpack_wheel(
+                os.path.join(self.wheels_path, wheel['file']),
+                wheel['sha256'], self.scheme, created)
+        self.assertTrue(os.path.isfile(
+            os.path.join(namespace, 'demo', '__init__.py')))
+        self.assertNotIn(namespace, created)
+        self.assertIn(os.path.join(namespace, 'demo'), created)
+
+    def test_get_locked_wheels(self):
+        lib = self._make_wheel('lib', '2.0', {'lib.py': ''})
+        app = self._make_wheel('app', '1.0', {'app.py': ''}, ['lib'])
+        other = self._make_wheel('other', '1.0', {'other.py': ''})
+        self._write_lock(lib, app, other)
+        wheels = self.get_cloudify.get_locked_wheels(
+            self.wheels_path, ['app'], self.scheme)
+        self.assertEqual([lib, app], wheels)
+
+        # already installed projects are skipped, other versions of them
+        # can't be handled without pip.
+        os.mkdir(os.path.join(self.scheme['purelib'], 'lib-2.0.dist-info'))
+        self.assertEqual([app], self.get_cloudify.get_locked_wheels(
+            self.wheels_path, ['app'], self.scheme))
+        os.rename(os.path.join(self.scheme['purelib'], 'lib-2.0.dist-info'),
+                  os.path.join(self.scheme['purelib'], 'lib-1.0.dist-info'))
+        self.assertRaises(ValueError, self.get_cloudify.get_locked_wheels,
+                          self.wheels_path, ['app'], self.scheme)
+        self.assertRaises(ValueError, self.get_cloudify.get_locked_wheels,
+                          self.wheels_path, ['missing'], self.scheme)
+
+    def test_get_locked_wheels_incompatible(self):
+        self._write_lock(self._make_wheel(
+            'native', '1.0', {'native.so': ''},
+            tags='cp27-cp27mu-win_amd64'))
+        self.assertRaises(ValueError, self.get_cloudify.get_locked_wheels,
+                          self.wheels_path, ['native'], self.scheme)
+
+    def test_install_locked_wheels_falls_back(self):
+        installer = self.get_cloudify.CloudifyInstaller(
+            virtualenv=self.prefix, unpackwheels=True,
+            wheelspath=self.wheels_path)
+        with mock.patch.object(self.get_cloudify, 'get_install_scheme',
+                               return_value=self.scheme):
+            # there's no lock manifest
+            self.assertFalse(installer.install_locked_wheels('cloudify'))
+            self._write_lock(self._make_wheel(
+                'cloudify', '3.3', {'cloudify_cli/__init__.py': ''}))
+            self.assertTrue(installer.install_locked_wheels('cloudify'))
+
 
 class TestArgParser(testtools.TestCase):
     """Unit tests for functions in get_cloudify.py"""
@@ -227,6 +819,13 @@ class TestArgParser(testtools.TestCase):
         self.assertIsNone(args.version)
         self.assertIsNone(args.virtualenv)
         self.assertEqual(args.wheelspath, 'wheelhouse')
+        self.assertIsNone(args.plugins)
+
+    def test_plugins_arg(self):
+        args = self.get_cloudify.parse_args(
+            ['--plugins', 'cloudify-aws-plugin', 'cloudify-fabric-plugin'])
+        self.assertEqual(
+            ['cloudify-aws-plugin', 'cloudify-fabric-plugin'], args.plugins)
 
     def test_args_chosen(self):
         self.get_cloudify.IS_LINUX = True
@@ -0,0 +1,133 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""gunicorn config of the rest-service.
+
+Unless set explicitly, the number of workers is derived from the CPUs and
+the memory available to the container: its cgroup CPU quota and memory
+limit when it has them (`nproc` counts all of the host's CPUs), capped by
+how many workers of worker_memory_mb fit in the available memory and by
+max_workers. The app is preloaded so that the workers share its memory
+copy-on-write.
+
+Every setting can be overridden by a GUNICORN_<SETTING> environment
+variable, which the Dockerfile sets from the manager's "gunicorn" section
+of vars.py and the manager package's upstart job (manager.conf) from its
+gunicorn_* params. The docker build copies this file into rest_service/
+(see render_templates.py).
+
+usage:
+    gunicorn -c gunicorn.conf.py server:app
+"""
+
+import os
+import math
+import multiprocessing
+
+# sync workers handle one request at a time, gthread and gevent workers
+# handle many each.
+WORKERS_PER_CPU = {'sync': 2, 'gthread': 1, 'gevent': 1}
+CGROUP_DIR = '/sys/fs/cgroup'
+MEMINFO = '/proc/meminfo'
+
+
+def _setting(name, default):
+    return os.environ.get('GUNICORN_{0}'.format(name.upper()), default)
+
+
+def _read(*path):
+    try:
+        with open(os.path.join(*path)) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def cpu_limit():
+    """the CPUs the cgroup CPU quota allows (rounded up), if there is one,
+    the online CPUs otherwise.
+    """
+    cpus = multiprocessing.cpu_count()
+    cpu_max = _read(CGROUP_DIR, 'cpu.max')
+    if cpu_max:
+        quota, period = cpu_max.split()
+    else:
+        quota = _read(CGROUP_DIR, 'cpu', 'cpu.cfs_quota_us')
+        period = _read(CGROUP_DIR, 'cpu', 'cpu.cfs_period_us')
+    if quota and period and quota not in ('max', '-1'):
+        cpus = min(cpus, int(math.ceil(float(quota) / int(period))))
+    return max(cpus, 1)
+
+
+def memory_available():
+    """the bytes of memory available, within the cgroup memory limit if
+    there is one. None if it can't be told.
+    """
+    meminfo = {}
+    for line in (_read(MEMINFO) or '').splitlines():
+        name, value = line.split(':', 1)
+        meminfo[name] = int(value.split()[0]) * 1024
+    available = meminfo.get('MemAvailable')
+    if available is None and 'MemFree' in meminfo:
+        available = meminfo['MemFree'] + meminfo.get('Cached', 0)
+    limit = _read(CGROUP_DIR, 'memory.max') or \
+        _read(CGROUP_DIR, 'memory', 'memory.limit_in_bytes')
+    usage = _read(CGROUP_DIR, 'memory.current') or \
+        _read(CGROUP_DIR, 'memory', 'memory.usage_in_bytes')
+    if limit and limit != 'max' and usage:
+        headroom = max(int(limit) - int(usage), 0)
+        if available is None or headroom < available:
+            available = headroom
+    return available
+
+
+def default_workers(worker_class, cpus, memory, worker_memory, max_workers):
+    workers = cpus * WORKERS_PER_CPU.get(worker_class, 2) + 1
+    if memory is not None and worker_memory:
+        workers = min(workers, memory // worker_memory)
+    if max_workers:
+        workers = min(workers, max_workers)
+    return max(int(workers), 1)
+
+
+bind = _setting('bind', '0.0.0.0:8100')
+worker_class = _setting('worker_class', 'sync')
+# used by the gthread workers
+threads = int(_setting('threads', 4))
+# used by the gevent workers
+worker_connections = int(_setting('worker_connections', 100))
+worker_memory_mb = int(_setting('worker_memory_mb', 150))
+max_workers = int(_setting('max_workers', 16))
+workers = int(_setting('workers', 0)) or default_workers(
+    worker_class, cpu_limit(), memory_available(),
+    worker_memory_mb * 1024 * 1024, max_workers)
+preload_app = _setting('preload_app', 'true').lower() == 'true'
+timeout = int(_setting('timeout', 300))
+errorlog = _setting('errorlog', '/var/log/cloudify/gunicorn.log')
+accesslog = _setting('accesslog', '/var/log/cloudify/gunicorn-access.log')
+
+if worker_class == 'gevent' and preload_app:
+    # the preloaded app must be imported after patching, not only the
+    # workers.
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def on_starting(server):
+    server.log.info('Starting {0} {1} workers ({2} CPUs, {3} MB of memory '
+                    'available, preload_app={4})'.format(
+                        workers, worker_class, cpu_limit(),
+                        (memory_available() or 0) // (1024 * 1024),
+                        preload_app))
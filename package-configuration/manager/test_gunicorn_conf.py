@@ -0,0 +1,152 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import imp
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+# gunicorn.conf.py is kept apart from its tests, as its directory is
+# packaged as a whole
+CONF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'gunicorn', 'gunicorn.conf.py')
+MB = 1024 * 1024
+
+
+def _load_conf():
+    return imp.load_source('gunicorn_conf', CONF_PATH)
+
+
+gunicorn_conf = _load_conf()
+
+
+class GunicornConfTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cgroup_dir = os.path.join(self.temp_dir, 'cgroup')
+        os.mkdir(self.cgroup_dir)
+        self.meminfo = os.path.join(self.temp_dir, 'meminfo')
+        for patcher in (
+                mock.patch.object(gunicorn_conf, 'CGROUP_DIR',
+                                  self.cgroup_dir),
+                mock.patch.object(gunicorn_conf, 'MEMINFO', self.meminfo),
+                mock.patch('multiprocessing.cpu_count', return_value=8)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _write(self, path, content):
+        path = os.path.join(self.cgroup_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content + '\n')
+
+    def _write_meminfo(self, **fields):
+        with open(self.meminfo, 'w') as f:
+            for name, kb in sorted(fields.items()):
+                f.write('{0}: {1} kB\n'.format(name, kb))
+
+    def test_cpu_limit_without_cgroup(self):
+        self.assertEqual(8, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_cgroup_v2(self):
+        self._write('cpu.max', '150000 100000')
+        self.assertEqual(2, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_cgroup_v2_without_quota(self):
+        self._write('cpu.max', 'max 100000')
+        self.assertEqual(8, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_cgroup_v1(self):
+        self._write('cpu/cpu.cfs_quota_us', '300000')
+        self._write('cpu/cpu.cfs_period_us', '100000')
+        self.assertEqual(3, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_cgroup_v1_without_quota(self):
+        self._write('cpu/cpu.cfs_quota_us', '-1')
+        self._write('cpu/cpu.cfs_period_us', '100000')
+        self.assertEqual(8, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_is_at_most_the_cpus(self):
+        self._write('cpu.max', '1600000 100000')
+        self.assertEqual(8, gunicorn_conf.cpu_limit())
+
+    def test_cpu_limit_is_at_least_one(self):
+        self._write('cpu.max', '10000 100000')
+        self.assertEqual(1, gunicorn_conf.cpu_limit())
+
+    def test_memory_available_without_meminfo(self):
+        self.assertIsNone(gunicorn_conf.memory_available())
+
+    def test_memory_available_from_meminfo(self):
+        self._write_meminfo(MemTotal=4096 * 1024, MemAvailable=2048 * 1024)
+        self.assertEqual(2048 * MB, gunicorn_conf.memory_available())
+
+    def test_memory_available_without_memavailable(self):
+        self._write_meminfo(MemFree=512 * 1024, Cached=256 * 1024)
+        self.assertEqual(768 * MB, gunicorn_conf.memory_available())
+
+    def test_memory_available_cgroup_v2(self):
+        self._write_meminfo(MemAvailable=2048 * 1024)
+        self._write('memory.max', str(1024 * MB))
+        self._write('memory.current', str(256 * MB))
+        self.assertEqual(768 * MB, gunicorn_conf.memory_available())
+
+    def test_memory_available_cgroup_v2_without_limit(self):
+        self._write_meminfo(MemAvailable=2048 * 1024)
+        self._write('memory.max', 'max')
+        self._write('memory.current', str(256 * MB))
+        self.assertEqual(2048 * MB, gunicorn_conf.memory_available())
+
+    def test_memory_available_cgroup_v1(self):
+        self._write_meminfo(MemAvailable=2048 * 1024)
+        self._write('memory/memory.limit_in_bytes', str(512 * MB))
+        self._write('memory/memory.usage_in_bytes', str(600 * MB))
+        self.assertEqual(0, gunicorn_conf.memory_available())
+
+    def test_default_workers_by_cpus(self):
+        self.assertEqual(5, gunicorn_conf.default_workers(
+            'sync', 2, None, 150 * MB, 16))
+        self.assertEqual(3, gunicorn_conf.default_workers(
+            'gthread', 2, None, 150 * MB, 16))
+
+    def test_default_workers_by_memory(self):
+        self.assertEqual(3, gunicorn_conf.default_workers(
+            'sync', 4, 500 * MB, 150 * MB, 16))
+
+    def test_default_workers_by_max_workers(self):
+        self.assertEqual(16, gunicorn_conf.default_workers(
+            'sync', 32, None, 150 * MB, 16))
+        self.assertEqual(65, gunicorn_conf.default_workers(
+            'sync', 32, None, 150 * MB, 0))
+
+    def test_default_workers_is_at_least_one(self):
+        self.assertEqual(1, gunicorn_conf.default_workers(
+            'sync', 4, 0, 150 * MB, 16))
+
+    def test_settings_from_environment(self):
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKERS': '3',
+                                          'GUNICORN_WORKER_CLASS': 'gthread',
+                                          'GUNICORN_PRELOAD_APP': 'False',
+                                          'GUNICORN_BIND': '0.0.0.0:8101'}):
+            conf = _load_conf()
+        self.assertEqual(3, conf.workers)
+        self.assertEqual('gthread', conf.worker_class)
+        self.assertFalse(conf.preload_app)
+        self.assertEqual('0.0.0.0:8101', conf.bind)
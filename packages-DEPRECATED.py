@@ -394,6 +394,18 @@ PACKAGES = {
                 "rest_internal_port": "8101",
                 "gunicorn_log_path": "{0}/gunicorn.log".format(CLOUDIFY_LOGS_PATH),
                 "gunicorn_access_log_path": "{0}/gunicorn-access.log".format(CLOUDIFY_LOGS_PATH),
+                "gunicorn_config_path": "{0}/manager/config/conf/gunicorn.conf.py".format(VIRTUALENVS_PATH),
+                # sync, gthread or gevent (gevent has to be added to the modules)
+                "gunicorn_worker_class": "sync",
+                # 0 derives the workers from the CPU quota and available memory
+                "gunicorn_workers": "0",
+                "gunicorn_max_workers": "16",
+                # the estimated memory of a worker, workers are capped by how many fit
+                "gunicorn_worker_memory_mb": "150",
+                "gunicorn_threads": "4",
+                "gunicorn_worker_connections": "100",
+                "gunicorn_preload_app": "true",
+                "gunicorn_timeout": "300",
                 "rest_service_log_path": "{0}/cloudify-rest-service.log".format(CLOUDIFY_LOGS_PATH),
             },
             "__template_file_conf": {
@@ -405,6 +417,12 @@ PACKAGES = {
             "__params_conf": {
                 "file_server_dir": "{0}/manager/resources".format(VIRTUALENVS_PATH),
             },
+            # gunicorn.conf.py, which reads its settings from the GUNICORN_*
+            # env vars manager.conf sets
+            "__config_dir_gunicorn": {
+                "files": "{0}/manager/gunicorn".format(CONFIGS_PATH),
+                "config_dir": "config/conf",
+            },
             "__template_dir_init": {
                 "templates": "{0}/manager/init".format(CONFIGS_PATH),
                 "config_dir": "config/init",
@@ -488,7 +506,18 @@ PACKAGES = {
                 "events_queue": "cloudify-events",
                 "logs_queue": "cloudify-logs",
                 "test_tcp_port": "9999",
-                "events_index": "cloudify_events",
+                "events_index": "cloudify_events_write",
+                # must match the way the publishers (cloudify-plugins-common)
+                # declare the queues, or RabbitMQ rejects the declaration
+                # that comes second.
+                "queue_auto_delete": "true",
+                "consumers_per_queue": "2",
+                # the unacked events a consumer may hold
+                "prefetch_count": "100",
+                # the events indexed per bulk request and the seconds to wait
+                # for a bulk to fill
+                "flush_size": "500",
+                "idle_flush_time": "1",
             }
         }
     },
@@ -499,7 +528,9 @@ PACKAGES = {
             "https://download.elasticsearch.org/elasticsearch/elasticsearch/elasticsearch-1.3.2.tar.gz"
         ],
         "depends": [
-            'openjdk-7-jdk'
+            'openjdk-7-jdk',
+            # installs requests for es_schema_creator.py
+            'python-pip'
         ],
         "package_path": "{0}/elasticsearch/".format(COMPONENT_PACKAGES_PATH),
         "sources_path": "{0}/elasticsearch".format(PACKAGES_PATH),
@@ -525,7 +556,21 @@ PACKAGES = {
                 "dst_dir": "/etc/init",
             },
             "__params_conf": {
-            }
+                # the index settings (see es_schema_creator.py's PROFILES),
+                # applied by the bootstrap and the events retention cron job
+                "profile": "small",
+            },
+            "__template_file_cron": {
+                "template": "{0}/elasticsearch/cron/cloudify-events-retention.template".format(CONFIGS_PATH),
+                "output_file": "cloudify-events-retention",
+                "config_dir": "config/cron",
+                "dst_dir": "/etc/cron.d",
+            },
+            "__config_dir": {
+                "files": "{0}/elasticsearch/schema".format(CONFIGS_PATH),
+                "config_dir": "config/schema",
+                "dst_dir": "/opt/elasticsearch",
+            },
         }
     },
     "kibana3": {
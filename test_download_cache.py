@@ -0,0 +1,224 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import download_cache
+
+
+class FileServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves `server.files`, with the ETag of each file being the sha256
+    of its content.
+    """
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.get('If-None-Match')))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = '"{0}"'.format(hashlib.sha256(content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), FileServerHandler)
+        self.files = files
+        self.requests = []
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+class DownloadCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FileServer({
+            '/a.tar.gz': 'a' * 1000,
+            '/b.tar.gz': 'b' * 1000,
+            '/c.tar.gz': 'c' * 1000,
+        })
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache = download_cache.DownloadCache(
+            os.path.join(self.temp_dir, 'cache'))
+
+    def _url(self, name):
+        return '{0}/{1}'.format(self.server.url, name)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_miss_and_hit(self):
+        path = self.cache.get(self._url('a.tar.gz'))
+        self.assertEqual('a' * 1000, self._read(path))
+        with open(path + '.json') as f:
+            metadata = json.load(f)
+        self.assertEqual(hashlib.sha256('a' * 1000).hexdigest(),
+                         metadata['sha256'])
+        self.assertEqual(path, self.cache.get(self._url('a.tar.gz')))
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_unchanged_entry_is_revalidated(self):
+        self.cache.get(self._url('a.tar.gz'))
+        etag = '"{0}"'.format(hashlib.sha256('a' * 1000).hexdigest())
+        self.cache.get(self._url('a.tar.gz'))
+        self.assertEqual([('/a.tar.gz', None), ('/a.tar.gz', etag)],
+                         self.server.requests)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_changed_entry_is_downloaded_again(self):
+        self.cache.get(self._url('a.tar.gz'))
+        self.server.files['/a.tar.gz'] = 'changed'
+        path = self.cache.get(self._url('a.tar.gz'))
+        self.assertEqual('changed', self._read(path))
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual((0, 2), (self.cache.hits, self.cache.misses))
+        self.assertEqual(hashlib.sha256('changed').hexdigest(),
+                         self.cache.checksum(self._url('a.tar.gz')))
+
+    def test_entry_without_metadata_is_downloaded_again(self):
+        path = self.cache.get(self._url('a.tar.gz'))
+        os.remove(path + '.json')
+        self.cache.get(self._url('a.tar.gz'))
+        self.assertEqual([('/a.tar.gz', None), ('/a.tar.gz', None)],
+                         self.server.requests)
+        self.assertTrue(os.path.isfile(path + '.json'))
+
+    def test_no_revalidate(self):
+        cache = download_cache.DownloadCache(self.cache.cache_dir,
+                                             revalidate=False)
+        cache.get(self._url('a.tar.gz'))
+        self.server.files['/a.tar.gz'] = 'changed'
+        self.assertEqual('a' * 1000,
+                         self._read(cache.get(self._url('a.tar.gz'))))
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_pinned_entry_is_not_revalidated(self):
+        sha256 = hashlib.sha256('a' * 1000).hexdigest()
+        self.cache.get(self._url('a.tar.gz'), sha256)
+        self.assertEqual(sha256, self.cache.checksum(self._url('a.tar.gz'),
+                                                     sha256.upper()))
+        self.assertEqual(
+            sha256, self.cache.checksum(self._url('a.tar.gz'), sha256))
+        destination = os.path.join(self.temp_dir, 'a.tar.gz')
+        self.cache.fetch(self._url('a.tar.gz'), destination, sha256)
+        self.assertEqual('a' * 1000, self._read(destination))
+        self.assertEqual([('/a.tar.gz', None)], self.server.requests)
+
+    def test_checksum_mismatch(self):
+        url = self._url('a.tar.gz')
+        self.assertRaises(IOError, self.cache.get, url,
+                          hashlib.sha256('b').hexdigest())
+        self.assertEqual([], self.cache.entries())
+
+    def test_evicts_least_recently_used(self):
+        a = self.cache.get(self._url('a.tar.gz'))
+        b = self.cache.get(self._url('b.tar.gz'))
+        os.utime(a, (1000, 1000))
+        os.utime(b, (2000, 2000))
+        # a hit makes `a` the most recently used entry
+        self.cache.get(self._url('a.tar.gz'))
+        self.assertEqual(1, self.cache.evict(max_size=1500))
+        self.assertEqual([a], [path for path, _, _ in self.cache.entries()])
+        self.assertFalse(os.path.exists(b + '.json'))
+
+    def test_evicts_beyond_max_size(self):
+        self.cache.max_size = 2500
+        for name in ('a.tar.gz', 'b.tar.gz', 'c.tar.gz'):
+            self.cache.get(self._url(name))
+            self.assertLessEqual(self.cache.report()['size'], 2500)
+        self.assertEqual(2, len(self.cache.entries()))
+
+    def test_warm_and_export(self):
+        urls = [self._url('a.tar.gz'), self._url('b.tar.gz'),
+                self._url('a.tar.gz')]
+        sha256 = hashlib.sha256('b' * 1000).hexdigest()
+        export_dir = os.path.join(self.temp_dir, 'export')
+        download_cache.warm(self.cache, urls,
+                            {self._url('b.tar.gz'): sha256}, export_dir)
+        self.assertEqual(['a.tar.gz', 'b.tar.gz'],
+                         sorted(os.listdir(export_dir)))
+        self.assertEqual('b' * 1000, self._read(
+            os.path.join(export_dir, 'b.tar.gz')))
+        self.assertEqual(2, len(self.cache.entries()))
+        report = self.cache.report()
+        self.assertEqual(2, report['misses'])
+        # the files are exported without getting them again
+        self.assertEqual(0, report['hits'])
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_warm_evicts_once_exported(self):
+        self.cache.max_size = 1500
+        urls = [self._url(name) for name in ('a.tar.gz', 'b.tar.gz',
+                                             'c.tar.gz')]
+        export_dir = os.path.join(self.temp_dir, 'export')
+        download_cache.warm(self.cache, urls, export_dir=export_dir)
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(name * 1000, self._read(
+                os.path.join(export_dir, name + '.tar.gz')))
+        self.assertEqual(3, len(self.server.requests))
+        self.assertLessEqual(self.cache.report()['size'], 1500)
+
+    def test_read_checksums(self):
+        checksums_file = os.path.join(self.temp_dir, 'SHA256SUMS')
+        with open(checksums_file, 'w') as f:
+            f.write('# comment\n\nabc http://a/a.tar.gz\n')
+        self.assertEqual({'http://a/a.tar.gz': 'abc'},
+                         download_cache.read_checksums(checksums_file))
+
+    def test_warm_with_written_checksums_makes_no_requests(self):
+        urls = [self._url('a.tar.gz'), self._url('b.tar.gz')]
+        checksums_file = os.path.join(self.temp_dir, 'artifacts.sha256')
+        with open(checksums_file, 'w') as f:
+            download_cache.write_checksums(
+                download_cache.get_checksums(self.cache, urls), f)
+        checksums = download_cache.read_checksums(checksums_file)
+        self.assertEqual(
+            {self._url('a.tar.gz'): hashlib.sha256('a' * 1000).hexdigest(),
+             self._url('b.tar.gz'): hashlib.sha256('b' * 1000).hexdigest()},
+            checksums)
+        download_cache.warm(self.cache, urls, checksums,
+                            os.path.join(self.temp_dir, 'export'))
+        requests = len(self.server.requests)
+        download_cache.warm(self.cache, urls, checksums,
+                            os.path.join(self.temp_dir, 'export'))
+        self.assertEqual(requests, len(self.server.requests))
@@ -0,0 +1,248 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import mock
+import yaml
+
+import get
+
+
+# the builders run in the pool's worker processes, so they record the
+# packages they built as files in this directory
+BUILT_DIR = None
+
+
+def _builder(duration=0):
+    def build(download=False):
+        time.sleep(duration)
+        open(os.path.join(BUILT_DIR, build.name), 'w').close()
+    return build
+
+
+def _failing_builder(download=False):
+    raise RuntimeError('failed')
+
+
+def _killed_builder(download=False):
+    os._exit(1)
+
+
+def _builders(**builders):
+    for name, builder in builders.items():
+        builder.name = name
+    return mock.patch.dict(get.BUILDERS, builders, clear=True)
+
+
+class ImportTests(unittest.TestCase):
+    def test_import_does_not_create_the_download_cache(self):
+        self.addCleanup(reload, get)
+        with mock.patch('download_cache.DownloadCache') as download_cache:
+            reload(get)
+        self.assertFalse(download_cache.called)
+        self.assertIsNone(get.cache)
+
+
+class LoadBuildGraphTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.packages_file = os.path.join(self.temp_dir, 'packages.yaml')
+        with open(self.packages_file, 'w') as f:
+            yaml.safe_dump({'packages': {
+                'a': {'sources_path': '/sources/a'},
+                'b': {'sources_path': '/sources/b', 'depends': ['a', 'x']},
+                'c': {'sources_path': '/sources/c',
+                      'python_modules': ['celery', '/sources/a/module']},
+                'd': {'sources_path': '/sources/a'},
+            }}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_graph(self):
+        with _builders(a=_builder(), b=_builder(), c=_builder(),
+                       d=_builder()):
+            graph = get.load_build_graph(packages_file=self.packages_file)
+        self.assertEqual({'a': set(), 'b': set(['a']), 'c': set(['a', 'd']),
+                          'd': set(['a'])}, graph)
+
+    def test_graph_of_some_packages(self):
+        with _builders(a=_builder(), b=_builder(), c=_builder(),
+                       d=_builder()):
+            graph = get.load_build_graph(['b', 'c'], self.packages_file)
+        self.assertEqual({'b': set(), 'c': set()}, graph)
+
+    def test_unknown_package(self):
+        with _builders(a=_builder()):
+            self.assertRaises(ValueError, get.load_build_graph,
+                              ['a', 'b'], self.packages_file)
+
+
+class CriticalPathTests(unittest.TestCase):
+    def test_critical_path(self):
+        graph = {'a': set(), 'b': set(['a']), 'c': set(),
+                 'd': set(['b', 'c'])}
+        results = {'a': (0, 1, []), 'b': (1, 3, []), 'c': (0, 5, []),
+                   'd': (5, 6, [])}
+        self.assertEqual(['c', 'd'], get.critical_path(graph, results))
+        results['b'] = (1, 6, [])
+        self.assertEqual(['a', 'b', 'd'], get.critical_path(graph, results))
+
+
+class BuildManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.package = {'name': 'a',
+                        'sources_path': os.path.join(self.temp_dir, 'a')}
+        os.mkdir(self.package['sources_path'])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _save(self, modules, **package):
+        package.update(self.package)
+        manifest = get.BuildManifest(package)
+        manifest.modules.update(modules)
+        manifest.save()
+
+    def test_can_reuse(self):
+        self._save({'celery': 'celery', '/a/module': 'hash'})
+        manifest = get.BuildManifest(self.package)
+        self.assertTrue(manifest.can_reuse(['celery', '/a/module']))
+        self.assertTrue(manifest.can_reuse(['celery', '/a/module', 'pika']))
+
+    def test_cannot_reuse_without_a_previous_build(self):
+        manifest = get.BuildManifest(self.package)
+        self.assertFalse(manifest.can_reuse(['celery']))
+
+    def test_cannot_reuse_without_the_virtualenv(self):
+        self._save({'celery': 'celery'})
+        shutil.rmtree(self.package['sources_path'])
+        manifest = get.BuildManifest(self.package)
+        self.assertFalse(manifest.can_reuse(['celery']))
+
+    def test_cannot_reuse_with_removed_modules(self):
+        self._save({'celery': 'celery', 'pika': 'pika'})
+        manifest = get.BuildManifest(self.package)
+        self.assertFalse(manifest.can_reuse(['celery']))
+
+    def test_cannot_reuse_with_another_python(self):
+        self._save({'celery': 'celery'}, python_path='python3')
+        manifest = get.BuildManifest(self.package)
+        self.assertFalse(manifest.can_reuse(['celery']))
+
+    def test_reset(self):
+        self._save({'celery': 'celery'})
+        manifest = get.BuildManifest(self.package)
+        manifest.reset()
+        self.assertFalse(os.path.exists(manifest.path))
+        self.assertFalse(manifest.can_reuse(['celery']))
+
+    def test_save(self):
+        self._save({'celery': 'celery'})
+        with open('{0}.json'.format(self.package['sources_path'])) as f:
+            data = json.load(f)
+        self.assertEqual({'celery': 'celery'}, data['modules'])
+        self.assertEqual('python', data['python_path'])
+
+
+class BuildTests(unittest.TestCase):
+    def setUp(self):
+        global BUILT_DIR
+        BUILT_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(BUILT_DIR)
+
+    def _built(self):
+        return sorted(os.listdir(BUILT_DIR))
+
+    def test_build_order(self):
+        graph = {'a': set(), 'b': set(['a']), 'c': set(['b'])}
+        with _builders(a=_builder(0.2), b=_builder(0.2), c=_builder()):
+            results = get.build(graph)
+        self.assertEqual(['a', 'b', 'c'], self._built())
+        self.assertLessEqual(results['a'][1], results['b'][0])
+        self.assertLessEqual(results['b'][1], results['c'][0])
+
+    def test_independent_packages_are_built_in_parallel(self):
+        graph = {'a': set(), 'b': set()}
+        with _builders(a=_builder(1), b=_builder(1)):
+            results = get.build(graph)
+        self.assertLess(results['a'][0], results['b'][1])
+        self.assertLess(results['b'][0], results['a'][1])
+
+    def test_workers(self):
+        graph = {'a': set(), 'b': set()}
+        with _builders(a=_builder(0.5), b=_builder(0.5)):
+            results = get.build(graph, workers=1)
+        (_, first_end, _), (second_start, _, _) = sorted(results.values())
+        self.assertLessEqual(first_end, second_start)
+
+    def test_failure_skips_dependent_packages(self):
+        graph = {'a': set(), 'b': set(['a']), 'c': set()}
+        with _builders(a=_failing_builder, b=_builder(), c=_builder()):
+            self.assertRaises(RuntimeError, get.build, graph)
+        self.assertEqual(['c'], self._built())
+
+    def test_circular_dependencies(self):
+        graph = {'a': set(), 'b': set(['c']), 'c': set(['b'])}
+        with _builders(a=_builder(), b=_builder(), c=_builder()):
+            self.assertRaises(ValueError, get.build, graph)
+
+    def test_timeout(self):
+        graph = {'a': set(), 'b': set(['a'])}
+        start = time.time()
+        with _builders(a=_builder(60), b=_builder()):
+            self.assertRaises(RuntimeError, get.build, graph, timeout=1)
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual([], self._built())
+
+    def test_killed_worker(self):
+        graph = {'a': set()}
+        start = time.time()
+        with _builders(a=_killed_builder):
+            self.assertRaises(RuntimeError, get.build, graph, timeout=1)
+        self.assertLess(time.time() - start, 30)
+
+
+class WheelhouseTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @mock.patch('subprocess.check_call')
+    @mock.patch('packman.python.Handler.make_venv')
+    def test_wheels_are_built_with_a_virtualenv_python(self, make_venv,
+                                                       check_call):
+        wheelhouse = get.Wheelhouse(os.path.join(self.temp_dir, 'wheels'))
+        wheelhouse.build(['celery==3.1.17', '/sources/a/module'])
+        venv, = make_venv.call_args[0]
+        python = os.path.join(venv, 'bin', 'python')
+        self.assertEqual(python, check_call.call_args_list[0][0][0][0])
+        pip_wheel = check_call.call_args[0][0]
+        self.assertEqual([python, '-m', 'pip', 'wheel'], pip_wheel[:4])
+        self.assertEqual('celery==3.1.17', pip_wheel[-1])
+        self.assertFalse(os.path.exists(venv))
+        self.assertEqual({'celery==3.1.17': 'celery==3.1.17'},
+                         wheelhouse.requirements)
@@ -0,0 +1,301 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+import subprocess
+
+import mock
+import yaml
+
+import wheelhouse
+
+
+# requirement: the (project, version, requires) of the wheels `pip wheel`
+# builds for it
+WHEELS = {
+    'six': [('six', '1.9.0', [])],
+    'requests==2.7.0': [('requests', '2.7.0', [])],
+    'cloudify-plugins-common': [
+        ('cloudify-plugins-common', '3.3', ['requests', 'six']),
+        ('requests', '2.7.0', []),
+        ('six', '1.9.0', [])],
+    'cloudify==3.3': [
+        ('cloudify', '3.3', ['cloudify-plugins-common', 'six',
+                             'colorama; sys_platform == "win32"',
+                             'nose; extra == "test"']),
+        ('cloudify-plugins-common', '3.3', ['requests', 'six']),
+        ('requests', '2.7.0', []),
+        ('six', '1.9.0', [])],
+}
+# pip runs in the pool's worker processes, so it records the requirements
+# it built in this file
+PIP_LOG = None
+
+
+def _wheel_name(project, version):
+    return '{0}-{1}-py2-none-any.whl'.format(project.replace('-', '_'),
+                                             version)
+
+
+def _write_wheel(path, project, version, requires):
+    metadata = ['Metadata-Version: 2.0', 'Name: {0}'.format(project),
+                'Version: {0}'.format(version)]
+    metadata.extend('Requires-Dist: {0}'.format(r) for r in requires)
+    dist_info = '{0}-{1}.dist-info'.format(
+        project.replace('-', '_'), version)
+    with zipfile.ZipFile(path, 'w') as wheel:
+        # a fixed date, so that rebuilding a wheel gives the same checksum
+        info = zipfile.ZipInfo('{0}/METADATA'.format(dist_info),
+                               date_time=(2015, 1, 1, 0, 0, 0))
+        wheel.writestr(info, '\n'.join(metadata) + '\n')
+
+
+def _pip_wheel(command, stderr=None):
+    wheel_dir = command[command.index('--wheel-dir') + 1]
+    requirement = command[-1]
+    with open(PIP_LOG, 'a') as f:
+        f.write(requirement + '\n')
+    if requirement not in WHEELS:
+        raise subprocess.CalledProcessError(
+            1, command, 'No matching distribution found for {0}'.format(
+                requirement))
+    for project, version, requires in WHEELS[requirement]:
+        _write_wheel(os.path.join(wheel_dir, _wheel_name(project, version)),
+                     project, version, requires)
+    return ''
+
+
+class WheelhouseTests(unittest.TestCase):
+    def setUp(self):
+        global PIP_LOG
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        PIP_LOG = os.path.join(self.temp_dir, 'pip.log')
+        self.wheelhouse = os.path.join(self.temp_dir, 'wheelhouse')
+        patcher = mock.patch('subprocess.check_output',
+                             side_effect=_pip_wheel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _built(self):
+        if not os.path.isfile(PIP_LOG):
+            return []
+        with open(PIP_LOG) as f:
+            return sorted(f.read().splitlines())
+
+    def _build(self, force=False):
+        return wheelhouse.build(
+            self.wheelhouse,
+            [[('six', 'six'), ('requests==2.7.0', 'requests==2.7.0')],
+             [('cloudify', 'cloudify==3.3')]],
+            workers=2, force=force)
+
+    def _path(self, project, version):
+        return os.path.join(self.wheelhouse, _wheel_name(project, version))
+
+    def test_build(self):
+        index = self._build()
+        self.assertEqual(['cloudify==3.3', 'requests==2.7.0', 'six'],
+                         self._built())
+        self.assertEqual(
+            sorted(_wheel_name(p, v) for p, v, _ in WHEELS['cloudify==3.3']),
+            sorted(w for w in os.listdir(self.wheelhouse)
+                   if w.endswith('.whl')))
+        six = index['wheels'][_wheel_name('six', '1.9.0')]
+        self.assertEqual('six', six['built_by'])
+        self.assertEqual(wheelhouse.sha256(self._path('six', '1.9.0')),
+                         six['sha256'])
+        self.assertEqual(os.path.getsize(self._path('six', '1.9.0')),
+                         six['size'])
+        cloudify = index['wheels'][_wheel_name('cloudify', '3.3')]
+        self.assertEqual(
+            ('cloudify', '3.3', ['cloudify-plugins-common', 'six',
+                                 'colorama']),
+            (cloudify['project'], cloudify['version'], cloudify['requires']))
+        self.assertEqual('cloudify==3.3',
+                         index['requirements']['cloudify']['source'])
+        self.assertEqual(
+            sorted(_wheel_name(p, v) for p, v, _ in WHEELS['cloudify==3.3']),
+            index['requirements']['cloudify']['wheels'])
+        self.assertEqual([], [name for name in os.listdir(self.wheelhouse)
+                              if name.startswith('.build-')])
+
+    def test_up_to_date_requirements_are_skipped(self):
+        self._build()
+        index = self._build()
+        self.assertEqual(['cloudify==3.3', 'requests==2.7.0', 'six'],
+                         self._built())
+        self.assertEqual(4, len(index['wheels']))
+
+    def test_changed_wheel_is_rebuilt(self):
+        self._build()
+        checksum = wheelhouse.sha256(self._path('requests', '2.7.0'))
+        with open(self._path('requests', '2.7.0'), 'ab') as f:
+            f.write('changed')
+        self._build()
+        # cloudify is up to date again once requests is rebuilt
+        self.assertEqual(['cloudify==3.3', 'requests==2.7.0',
+                          'requests==2.7.0', 'six'], self._built())
+        # the changed wheel is replaced by the rebuilt one
+        self.assertEqual(checksum,
+                         wheelhouse.sha256(self._path('requests', '2.7.0')))
+        index = wheelhouse.load_index(self.wheelhouse)
+        self.assertEqual(
+            checksum,
+            index['wheels'][_wheel_name('requests', '2.7.0')]['sha256'])
+
+    def test_removed_wheel_is_rebuilt(self):
+        self._build()
+        os.remove(self._path('six', '1.9.0'))
+        self._build()
+        # cloudify is up to date again once six is rebuilt
+        self.assertEqual(['cloudify==3.3', 'requests==2.7.0', 'six', 'six'],
+                         self._built())
+        self.assertTrue(os.path.isfile(self._path('six', '1.9.0')))
+
+    def test_changed_source_is_rebuilt(self):
+        self._build()
+        wheelhouse.build(self.wheelhouse, [[('six', 'six'),
+                                            ('requests', 'requests==2.7.0')]])
+        self.assertEqual(['cloudify==3.3', 'requests==2.7.0',
+                          'requests==2.7.0', 'six'], self._built())
+
+    def test_force(self):
+        self._build()
+        self._build(force=True)
+        self.assertEqual(['cloudify==3.3', 'cloudify==3.3', 'requests==2.7.0',
+                          'requests==2.7.0', 'six', 'six'], self._built())
+
+    def test_failed_build(self):
+        self.assertRaises(
+            RuntimeError, wheelhouse.build, self.wheelhouse,
+            [[('six', 'six'), ('missing', 'missing==1.0')],
+             [('cloudify', 'cloudify==3.3')]])
+        # the stages after a failure aren't built
+        self.assertEqual(['missing==1.0', 'six'], self._built())
+        index = wheelhouse.load_index(self.wheelhouse)
+        self.assertEqual(['six'], index['requirements'].keys())
+
+    def test_requirements_are_expanded(self):
+        with mock.patch.dict(os.environ, {'SIX_VERSION': 'six'}):
+            wheelhouse.build(self.wheelhouse, [[('six', '${SIX_VERSION}')]])
+            wheelhouse.build(self.wheelhouse, [[('six', '${SIX_VERSION}')]])
+        self.assertEqual(['six'], self._built())
+        index = wheelhouse.load_index(self.wheelhouse)
+        self.assertEqual('six', index['requirements']['six']['source'])
+        # a changed variable (e.g. a tag) rebuilds the requirement
+        with mock.patch.dict(os.environ, {'REQUESTS_VERSION': '2.7.0'}):
+            wheelhouse.build(self.wheelhouse,
+                             [[('six', 'requests==${REQUESTS_VERSION}')]])
+        self.assertEqual(['requests==2.7.0', 'six'], self._built())
+
+    def test_get_source(self):
+        with mock.patch.dict(os.environ, {'GITHUB_USERNAME': 'user',
+                                          'GITHUB_PASSWORD': 'password',
+                                          'PLUGINS_TAG_NAME': '1.3'}):
+            self.assertEqual(
+                'git+https://github.com/cloudify-cosmo/'
+                'cloudify-vsphere-plugin@1.3',
+                wheelhouse.get_source(
+                    'git+https://${GITHUB_USERNAME}:${GITHUB_PASSWORD}'
+                    '@github.com/cloudify-cosmo/cloudify-vsphere-plugin'
+                    '@${PLUGINS_TAG_NAME}'))
+
+    def test_write_index(self):
+        index = self._build()
+        os.remove(self._path('requests', '2.7.0'))
+        wheelhouse.write_index(index, self.wheelhouse,
+                               install=['cloudify-plugins-common'])
+        with open(os.path.join(self.wheelhouse, 'index.json')) as f:
+            self.assertEqual(index, json.load(f))
+        self.assertNotIn(_wheel_name('requests', '2.7.0'), index['wheels'])
+        with open(os.path.join(self.wheelhouse, 'index.txt')) as f:
+            self.assertEqual(
+                [_wheel_name('cloudify-plugins-common', '3.3'),
+                 _wheel_name('six', '1.9.0')], f.read().splitlines())
+
+    def test_get_closure(self):
+        index = self._build()
+        self.assertEqual(
+            [_wheel_name('cloudify-plugins-common', '3.3'),
+             _wheel_name('requests', '2.7.0'), _wheel_name('six', '1.9.0')],
+            wheelhouse.get_closure(index, ['Cloudify_Plugins.Common']))
+        # colorama has no wheel in the wheelhouse
+        self.assertEqual(4, len(wheelhouse.get_closure(index, ['cloudify'])))
+        self.assertEqual([], wheelhouse.get_closure(index, ['missing']))
+
+    def test_write_lock(self):
+        index = self._build()
+        wheelhouse.write_lock(index, self.wheelhouse, ['Cloudify'])
+        with open(os.path.join(self.wheelhouse, 'lock.json')) as f:
+            lock = json.load(f)
+        self.assertEqual(['cloudify'], lock['projects'])
+        projects = [wheel['project'] for wheel in lock['wheels']]
+        self.assertEqual(
+            set(['cloudify', 'cloudify-plugins-common', 'requests', 'six']),
+            set(projects))
+        for wheel in lock['wheels']:
+            self.assertEqual(index['wheels'][wheel['file']]['sha256'],
+                             wheel['sha256'])
+            # each wheel comes after the ones it requires
+            for project in wheel['requires']:
+                if project in projects:
+                    self.assertLess(projects.index(project),
+                                    projects.index(wheel['project']))
+        self.assertEqual('cloudify', projects[-1])
+
+    def test_write_lock_with_circular_requirements(self):
+        index = {'wheels': {
+            'a.whl': {'project': 'a', 'version': '1', 'requires': ['b'],
+                      'sha256': 'a', 'size': 1},
+            'b.whl': {'project': 'b', 'version': '1', 'requires': ['a'],
+                      'sha256': 'b', 'size': 1}}}
+        os.makedirs(self.wheelhouse)
+        wheelhouse.write_lock(index, self.wheelhouse, ['a'])
+        with open(os.path.join(self.wheelhouse, 'lock.json')) as f:
+            self.assertEqual(['b.whl', 'a.whl'],
+                             [w['file'] for w in json.load(f)['wheels']])
+
+    def test_rehash(self):
+        self._build()
+        path = self._path('cloudify', '3.3')
+        with zipfile.ZipFile(path, 'a') as wheel:
+            wheel.writestr('cloudify/VERSION', '{"version": "3.3"}')
+        index = wheelhouse.rehash(wheelhouse.load_index(self.wheelhouse),
+                                  self.wheelhouse)
+        entry = index['wheels'][_wheel_name('cloudify', '3.3')]
+        self.assertEqual(wheelhouse.sha256(path), entry['sha256'])
+        self.assertEqual(os.path.getsize(path), entry['size'])
+        self.assertTrue(wheelhouse._is_built(index, self.wheelhouse,
+                                             'cloudify', 'cloudify==3.3'))
+
+    def test_get_requirements(self):
+        packages_file = os.path.join(self.temp_dir, 'packages.yaml')
+        with open(packages_file, 'w') as f:
+            yaml.safe_dump({'packages': {'cli': {
+                'plugins': ['cloudify-script-plugin'],
+                'wheels': {
+                    'dependencies': ['cloudify-plugins-common'],
+                    'sources': {'cloudify': 'cloudify==3.3'}}}}}, f)
+        self.assertEqual(
+            ([('cloudify-plugins-common', 'cloudify-plugins-common')],
+             [('cloudify', 'cloudify==3.3'),
+              ('cloudify-script-plugin', 'cloudify-script-plugin')]),
+            wheelhouse.get_requirements('cli', packages_file))
@@ -0,0 +1,144 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Compares update_wheel.py's `modify_wheel` with the implementation it
+replaced, which decompressed and compressed every member of the wheel.
+
+A large wheel (compressible sources, incompressible binaries and a few
+stored members) is generated, patched by both implementations and the
+results are verified.
+
+Run it from this directory:
+`python benchmark_update_wheel.py [--files N] [--repeat N]`
+"""
+
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+import update_wheel
+
+TARGET = 'cloudify_cli/VERSION'
+RECORD = 'cloudify-3.3.dist-info/RECORD'
+
+
+def legacy_modify_wheel(path, name, data):
+    with ZipFile(path) as zf:
+        zf.getinfo(name)
+        with ZipFile(path + '-new', 'w', ZIP_DEFLATED) as new:
+            for item in zf.infolist():
+                if item.filename.endswith('dist-info/RECORD'):
+                    records = zf.read(item.filename)
+                    newrecord = update_wheel.generate_record(
+                        records, name, data)
+                    new.writestr(item.filename, newrecord)
+                elif item.filename == name:
+                    new.writestr(name, data)
+                else:
+                    new.writestr(item.filename, zf.read(item.filename))
+    os.rename(path + '-new', path)
+
+
+def create_wheel(path, files):
+    rand = random.Random(0)
+    records = []
+
+    def add(zf, name, data, compress_type=ZIP_DEFLATED):
+        info = ZipInfo(name, (2015, 1, 1, 0, 0, 0))
+        info.compress_type = compress_type
+        zf.writestr(info, data)
+        records.append('{0},sha256={1},{2}'.format(
+            name, update_wheel.get_sha(data), len(data)))
+
+    with ZipFile(path, 'w') as zf:
+        for i in range(files):
+            source = ''.join(
+                'def function_{0}_{1}(arg):\n    return arg * {1}\n\n'.format(
+                    i, j) for j in range(rand.randint(50, 400)))
+            add(zf, 'cloudify_cli/module_{0}.py'.format(i), source)
+            if i % 10 == 0:
+                binary = os.urandom(rand.randint(16, 256) * 1024)
+                add(zf, 'cloudify_cli/lib/native_{0}.so'.format(i), binary)
+            if i % 25 == 0:
+                add(zf, 'cloudify_cli/resources/blob_{0}.bin'.format(i),
+                    os.urandom(32 * 1024), ZIP_STORED)
+        add(zf, TARGET, '{"version": "3.3.0"}')
+        zf.writestr(RECORD, '\r\n'.join(records + [RECORD + ',,']))
+
+
+def verify(path, data):
+    with ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert zf.read(TARGET) == data
+        record = zf.read(RECORD)
+        assert update_wheel.get_sha(data) in record
+        return len(zf.infolist())
+
+
+def measure(modify, wheel, data, repeat):
+    timings = []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for _ in range(repeat):
+            path = os.path.join(temp_dir, 'cloudify.whl')
+            shutil.copy(wheel, path)
+            start = time.time()
+            modify(path, TARGET, data)
+            timings.append(time.time() - start)
+            members = verify(path, data)
+        return min(timings), os.path.getsize(path), members
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=3000,
+                        help='Number of source files in the wheel.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs per implementation '
+                             '(best is kept).')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        wheel = os.path.join(temp_dir, 'cloudify-3.3-py27-none-any.whl')
+        create_wheel(wheel, args.files)
+        with ZipFile(wheel) as zf:
+            uncompressed = sum(i.file_size for i in zf.infolist())
+        print('wheel: {0} members, {1:.1f}MB ({2:.1f}MB uncompressed)'.format(
+            args.files, os.path.getsize(wheel) / 1024.0 ** 2,
+            uncompressed / 1024.0 ** 2))
+        data = '{"version": "3.3.0", "build": "85"}'
+        row = '{0:<16} {1:>10} {2:>14} {3:>10}'
+        print(row.format('implementation', 'time (s)', 'size (bytes)',
+                         'members'))
+        for name, modify in [('legacy', legacy_modify_wheel),
+                             ('modify_wheel', update_wheel.modify_wheel)]:
+            duration, size, members = measure(
+                modify, wheel, data, args.repeat)
+            print(row.format(name, '{0:.3f}'.format(duration), size,
+                             members))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
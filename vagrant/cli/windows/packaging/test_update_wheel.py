@@ -0,0 +1,182 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import os
+import re
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import unittest
+import subprocess
+from zipfile import ZipFile
+
+import update_wheel
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'update_wheel.py')
+SETUP_PY = """from setuptools import setup
+setup(name='sample', version='1.0', packages=['sample'],
+      package_data={'sample': ['VERSION']})
+"""
+
+
+def _build_wheel(source_dir, wheel_dir):
+    os.makedirs(os.path.join(source_dir, 'sample'))
+    with open(os.path.join(source_dir, 'setup.py'), 'w') as f:
+        f.write(SETUP_PY)
+    for name, data in (('__init__.py', 'NAME = "sample"\n'),
+                       ('VERSION', '1.0')):
+        with open(os.path.join(source_dir, 'sample', name), 'w') as f:
+            f.write(data)
+    subprocess.check_call(
+        [sys.executable, 'setup.py', '-q', 'bdist_wheel',
+         '--dist-dir', wheel_dir], cwd=source_dir)
+    wheel, = glob.glob(os.path.join(wheel_dir, '*.whl'))
+    return wheel
+
+
+def _rewrite(path, name, data):
+    """Replaces a member of the wheel at `path` without updating RECORD.
+    """
+    with ZipFile(path) as zf:
+        members = [(info, zf.read(info.filename)) for info in zf.infolist()]
+    with ZipFile(path, 'w') as zf:
+        for info, member_data in members:
+            zf.writestr(info, data if info.filename == name else member_data)
+
+
+class UpdateWheelTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.build_dir = tempfile.mkdtemp()
+        cls.sample_wheel = _build_wheel(
+            os.path.join(cls.build_dir, 'source'), cls.build_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.build_dir)
+
+    def setUp(self):
+        # the paths of the wheels shipped on windows often contain spaces
+        self.temp_dir = tempfile.mkdtemp(prefix='update wheel ')
+        self.wheel = os.path.join(self.temp_dir,
+                                  os.path.basename(self.sample_wheel))
+        shutil.copy(self.sample_wheel, self.wheel)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _read(self, name):
+        with ZipFile(self.wheel) as zf:
+            return zf.read(name)
+
+    def _install(self):
+        target = os.path.join(self.temp_dir, 'site packages')
+        subprocess.check_call(
+            [sys.executable, '-m', 'pip', 'install', '-q', '--no-index',
+             '--no-deps', '--target', target, self.wheel])
+        return os.path.join(target, 'sample')
+
+    def test_sample_wheel_is_valid(self):
+        self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+
+    def test_patch_verify_and_install(self):
+        changes = update_wheel.patch_wheel(
+            self.wheel, {'sample/VERSION': '1.1',
+                         'sample/BUILD': '42'}, add=True)
+        self.assertEqual(['sample/BUILD', 'sample/VERSION'],
+                         sorted(name for name, _, _ in changes))
+        self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+        installed = self._install()
+        with open(os.path.join(installed, 'VERSION')) as f:
+            self.assertEqual('1.1', f.read())
+        with open(os.path.join(installed, 'BUILD')) as f:
+            self.assertEqual('42', f.read())
+        with open(os.path.join(installed, '__init__.py')) as f:
+            self.assertEqual('NAME = "sample"\n', f.read())
+
+    def test_patch_to_output(self):
+        output = os.path.join(self.temp_dir, 'patched wheel.whl')
+        update_wheel.modify_wheel(self.wheel, 'sample/VERSION', '1.1',
+                                  output)
+        self.assertEqual('1.0', self._read('sample/VERSION'))
+        self.assertEqual([], update_wheel.verify_wheel(output))
+
+    def test_remove_member(self):
+        update_wheel.patch_wheel(self.wheel, {'sample/VERSION': None})
+        with ZipFile(self.wheel) as zf:
+            self.assertNotIn('sample/VERSION', zf.namelist())
+        self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+        self.assertFalse(os.path.exists(
+            os.path.join(self._install(), 'VERSION')))
+
+    def test_missing_member_is_not_added(self):
+        self.assertRaises(KeyError, update_wheel.patch_wheel,
+                          self.wheel, {'sample/BUILD': '42'})
+        self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+
+    def test_verify_detects_changed_members(self):
+        _rewrite(self.wheel, 'sample/VERSION', '6.6')
+        errors = update_wheel.verify_wheel(self.wheel)
+        self.assertEqual(1, len(errors))
+        self.assertTrue(errors[0].startswith('sample/VERSION is sha256='))
+
+    def _set_hash_algorithm(self, algorithm):
+        record_name = 'sample-1.0.dist-info/RECORD'
+        record = re.sub('(?i)sha256=', algorithm + '=',
+                        self._read(record_name))
+        _rewrite(self.wheel, record_name, record)
+
+    def test_hash_algorithm_case(self):
+        for algorithm in ('sha256', 'SHA256'):
+            self._set_hash_algorithm(algorithm)
+            self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+            update_wheel.patch_wheel(self.wheel, {'sample/VERSION': '1.1'})
+            self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+
+    def test_unexpected_hash_algorithm(self):
+        self._set_hash_algorithm('md5')
+        self.assertRaises(Exception, update_wheel.patch_wheel,
+                          self.wheel, {'sample/VERSION': '1.1'})
+
+    def test_manifest(self):
+        with open(os.path.join(self.temp_dir, 'BUILD'), 'w') as f:
+            f.write('42')
+        manifest = os.path.join(self.temp_dir, 'edits.json')
+        with open(manifest, 'w') as f:
+            json.dump([{'wheels': '*.whl', 'name': 'sample/VERSION',
+                        'data': '1.1'},
+                       {'wheels': '*.whl', 'name': 'sample/BUILD',
+                        'file': 'BUILD'}], f)
+        results = update_wheel.patch_wheels(
+            update_wheel.load_manifest(manifest), add=True)
+        self.assertEqual([None], [error for _, _, error in results])
+        self.assertEqual('1.1', self._read('sample/VERSION'))
+        self.assertEqual('42', self._read('sample/BUILD'))
+        self.assertEqual([], update_wheel.verify_wheel(self.wheel))
+
+    def test_command_line(self):
+        subprocess.check_call(
+            [sys.executable, SCRIPT, '--path', self.wheel,
+             '--name', 'sample/VERSION', '--data', '1.1'])
+        self.assertEqual('1.1', self._read('sample/VERSION'))
+        subprocess.check_call([sys.executable, SCRIPT, '--verify',
+                               self.temp_dir])
+        _rewrite(self.wheel, 'sample/VERSION', '6.6')
+        self.assertEqual(1, subprocess.call(
+            [sys.executable, SCRIPT, '--verify', self.temp_dir]))
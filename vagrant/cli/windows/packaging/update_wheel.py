@@ -1,46 +1,387 @@
+import os
 import sys
+import csv
+import copy
+import time
+import glob
+import json
+import zlib
+import struct
+import shutil
 import argparse
-from zipfile import ZipFile, ZIP_DEFLATED
+import tempfile
+import traceback
+import multiprocessing
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, BadZipfile
 from hashlib import sha256
+from StringIO import StringIO
 from wheel.util import urlsafe_b64encode
-from collections import namedtuple
+from collections import OrderedDict
 
+# a zip local file header is 30 bytes, ending with the lengths of the file
+# name and extra field that follow it (and precede the member's data).
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_LENGTHS = struct.Struct('<HH')
+# general purpose flag indicating that a data descriptor follows the data
+DATA_DESCRIPTOR_FLAG = 0x08
+CHUNK_SIZE = 64 * 1024
+# number of members hashed by each verification task
+VERIFY_BATCH_SIZE = 256
 
-def get_sha(data): 
-    return urlsafe_b64encode(sha256(data).digest())
 
+def get_sha(data):
+    """Returns the urlsafe base64 sha256 of `data`, which is either a string
+    or a file object read in chunks.
+    """
+    if not hasattr(data, 'read'):
+        return urlsafe_b64encode(sha256(data).digest())
+    digest = sha256()
+    for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return urlsafe_b64encode(digest.digest())
 
-def modify_wheel(path, name, data):
-    with ZipFile(path) as zf:
-        zf.getinfo(name)
-        new = ZipFile(path + '-new', 'w', ZIP_DEFLATED)
-        for item in zf.infolist():
-            if item.filename.endswith('dist-info/RECORD'):
-                records = zf.read(item.filename)
-                newrecord = generate_record(records, name, data)
-                new.writestr(item.filename, newrecord)
-            elif item.filename == name:
-                new.writestr(name, data)
+
+def normalize_hash(hash):
+    """Lowercases the algorithm of a RECORD hash (e.g. SHA256=...), which
+    isn't case sensitive, unlike the digest following it.
+    """
+    algorithm, sep, digest = hash.partition('=')
+    return algorithm.lower() + sep + digest
+
+
+class Record(object):
+    """A wheel's RECORD, indexed by path.
+
+    `entries` maps each path to its (hash, size), in the RECORD's order.
+    The changes made by `update` are kept in `changes` as
+    (path, old, new) with None for a missing entry.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = OrderedDict(entries)
+        self.changes = []
+
+    @classmethod
+    def loads(cls, data):
+        return cls((row[0], tuple((row + ['', ''])[1:3]))
+                   for row in csv.reader(data.splitlines()) if row)
+
+    def dumps(self):
+        out = StringIO()
+        writer = csv.writer(out, lineterminator='\r\n')
+        for path, (hash, size) in self.entries.items():
+            writer.writerow((path, hash, size))
+        return out.getvalue()
+
+    def update(self, members):
+        """Records the data of each of the `members` (a dict of path: data),
+        removing the paths whose data is None.
+        """
+        for path, data in members.items():
+            old = self.entries.get(path)
+            if data is None:
+                new = None
+                self.entries.pop(path, None)
             else:
-                zipdata = zf.read(item.filename)
-                new.writestr(item.filename, zipdata)
+                if old and old[0] and \
+                        not normalize_hash(old[0]).startswith('sha256='):
+                    raise Exception('Unexpected checksum method: {0}'.format(
+                        old[0].split('=')[0]))
+                new = ('sha256=' + get_sha(data), str(len(data)))
+                self.entries[path] = new
+            if old != new:
+                self.changes.append((path, old, new))
 
 
-def generate_record(records, name, data):
-    data_sha = 'sha256=' + get_sha(data)
-    data_size = str(len(data))
-    out = []
-    Record = namedtuple('Record', 'name hash size')
-    for item in records.split():
-        record = Record(*item.split(','))
-        if record.name != name:
-            out.append(item)
+def get_record_name(zf):
+    for name in zf.namelist():
+        if name.endswith('.dist-info/RECORD'):
+            return name
+    raise KeyError('{0} has no RECORD'.format(zf.filename))
+
+
+def copy_member(source, info, target):
+    """Copies a member from the `source` ZipFile to the `target` ZipFile
+    (opened for writing) as is, without decompressing and compressing
+    its data again.
+    """
+    source.fp.seek(info.header_offset + LOCAL_HEADER_SIZE - 4)
+    name_length, extra_length = LOCAL_HEADER_LENGTHS.unpack(
+        source.fp.read(LOCAL_HEADER_LENGTHS.size))
+    source.fp.seek(name_length + extra_length, os.SEEK_CUR)
+
+    new = copy.copy(info)
+    # the local header written here already has the crc and sizes
+    new.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    new.header_offset = target.fp.tell()
+    target.fp.write(new.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise IOError('{0} is truncated'.format(info.filename))
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+    target.filelist.append(new)
+    target.NameToInfo[new.filename] = new
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+
+
+def write_member(target, info, data):
+    """Writes `data` as a member of the `target` ZipFile, with the name,
+    compression type and attributes of `info`.
+    """
+    new = ZipInfo(info.filename, info.date_time)
+    new.compress_type = info.compress_type
+    new.external_attr = info.external_attr
+    new.create_system = info.create_system
+    target.writestr(new, data)
+
+
+def replace_file(source, destination):
+    if os.name == 'nt' and os.path.exists(destination):
+        # rename doesn't overwrite on windows
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def modify_wheel(path, name, data, output=None):
+    """Puts `data` into `name` inside the wheel at `path` and updates the
+    wheel's RECORD accordingly.
+    """
+    return patch_wheel(path, {name: data}, output)
+
+
+def patch_wheel(path, members, output=None, add=False):
+    """Puts the data of each of the `members` (a dict of name: data) into
+    the wheel at `path` and updates the wheel's RECORD accordingly, in a
+    single pass over the wheel. Members whose data is None are removed.
+    Members missing from the wheel are added if `add` is set.
+
+    Only the patched files and RECORD are compressed again, all other
+    members are copied as they are. The new wheel is written to a temporary
+    file which then replaces `output` (defaults to `path`), so it's never
+    left half written.
+
+    Returns the RECORD changes as a list of (name, old, new).
+    """
+    output = output or path
+    fd, temp_path = tempfile.mkstemp(
+        suffix='.whl.tmp', dir=os.path.dirname(os.path.abspath(output)))
+    os.close(fd)
+    try:
+        with ZipFile(path) as zf:
+            names = set(zf.namelist())
+            added = [name for name in members if name not in names]
+            if added and not add:
+                raise KeyError('There is no item named {0} in {1}'.format(
+                    added[0], path))
+            record_info = zf.getinfo(get_record_name(zf))
+            record = Record.loads(zf.read(record_info.filename))
+            record.update(members)
+            with ZipFile(temp_path, 'w') as new:
+                for item in zf.infolist():
+                    if item.filename == record_info.filename:
+                        continue
+                    elif item.filename in members:
+                        if members[item.filename] is not None:
+                            write_member(new, item, members[item.filename])
+                    else:
+                        copy_member(zf, item, new)
+                for name in added:
+                    if members[name] is not None:
+                        info = ZipInfo(name, time.localtime()[:6])
+                        info.compress_type = ZIP_DEFLATED
+                        info.external_attr = 0o644 << 16
+                        write_member(new, info, members[name])
+                # RECORD is kept as the last member of the wheel
+                write_member(new, record_info, record.dumps())
+        shutil.copymode(path, temp_path)
+        replace_file(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return record.changes
+
+
+def _hash_members(args):
+    path, names = args
+    hashes = []
+    with ZipFile(path) as zf:
+        for name in names:
+            try:
+                # ZipExtFile checks the member's CRC once it's fully read
+                with zf.open(name) as member:
+                    hashes.append((name, 'sha256=' + get_sha(member),
+                                   str(zf.getinfo(name).file_size), None))
+            except (BadZipfile, IOError, RuntimeError, zlib.error) as ex:
+                hashes.append((name, None, None, str(ex)))
+    return path, hashes
+
+
+def _check_record(path):
+    """Returns the RECORD of the wheel at `path`, the members to hash and
+    the errors found without hashing anything.
+    """
+    with ZipFile(path) as zf:
+        record = Record.loads(zf.read(get_record_name(zf)))
+        names = [name for name in zf.namelist() if not name.endswith('/')]
+    present = set(names)
+    errors = ['{0} is missing'.format(name)
+              for name in record.entries if name not in present]
+    hashed = []
+    for name in names:
+        expected = record.entries.get(name)
+        if expected is None:
+            errors.append('{0} is not in RECORD'.format(name))
+        elif expected[0]:
+            hashed.append(name)
+    return record, hashed, errors
+
+
+def verify_wheels(paths, workers=None):
+    """Checks every member of each of the wheels at `paths` against the
+    wheel's RECORD, without extracting anything to disk. Members are
+    streamed through sha256 in batches by up to `workers` processes
+    (defaults to the number of cores), so large wheels are hashed in
+    parallel as well.
+
+    Returns a dict of path: errors, which are empty for intact wheels.
+    """
+    records = {}
+    results = OrderedDict()
+    tasks = []
+    for path in paths:
+        try:
+            records[path], hashed, results[path] = _check_record(path)
+        except (BadZipfile, IOError, KeyError) as ex:
+            results[path] = [str(ex)]
+            continue
+        tasks.extend((path, hashed[i:i + VERIFY_BATCH_SIZE])
+                     for i in range(0, len(hashed), VERIFY_BATCH_SIZE))
+    workers = min(workers or multiprocessing.cpu_count(), len(tasks))
+    for path, hashes in _map(_hash_members, tasks, workers):
+        entries = records[path].entries
+        errors = results[path]
+        for name, hash, size, error in hashes:
+            if error:
+                errors.append('{0}: {1}'.format(name, error))
+            elif (normalize_hash(entries[name][0]),
+                  entries[name][1]) != (hash, size):
+                errors.append('{0} is {1},{2} instead of {3},{4}'.format(
+                    name, hash, size, *entries[name]))
+    return results
+
+
+def verify_wheel(path, workers=None):
+    """Checks every member of the wheel at `path` against its RECORD.
+
+    Returns a list of errors, empty if the wheel is intact.
+    """
+    return verify_wheels([path], workers)[path]
+
+
+def find_wheels(patterns):
+    """Expands each of the `patterns`, a wheel, a glob or a directory whose
+    wheels are taken, into the paths of the wheels it matches.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.whl')
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise ValueError('No wheels match {0}'.format(pattern))
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def load_manifest(path):
+    """Loads a JSON manifest of edits, each with a `wheels` glob, the `name`
+    of the member to patch and either its `data`, a `file` to read the
+    data from or `"delete": true` to remove it, and returns a dict of
+    wheel path: {name: data}.
+
+    Relative globs and files are resolved against the manifest's directory.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        edits = json.load(f)
+    wheels = OrderedDict()
+    for edit in edits:
+        if edit.get('delete'):
+            data = None
+        elif 'data' in edit:
+            data = edit['data']
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
         else:
-            if not record.hash.startswith('sha256'):
-                raise Exception('Unexpected checksum method: {0}'.format(
-                    record.hash.split('=')[0]))
-            out.append(','.join((record.name, data_sha, data_size)))
-    return '\r\n'.join(out)
+            with open(os.path.join(base_dir, edit['file']), 'rb') as f:
+                data = f.read()
+        paths = sorted(glob.glob(os.path.join(base_dir, edit['wheels'])))
+        if not paths:
+            raise ValueError('No wheels match {0}'.format(edit['wheels']))
+        for wheel in paths:
+            members = wheels.setdefault(wheel, OrderedDict())
+            if members.get(edit['name'], data) != data:
+                raise ValueError('Conflicting edits of {0} in {1}'.format(
+                    edit['name'], wheel))
+            members[edit['name']] = data
+    return wheels
+
+
+def _patch(args):
+    path, members, add = args
+    try:
+        return path, patch_wheel(path, members, add=add), None
+    except Exception:
+        return path, None, traceback.format_exc()
+
+
+def patch_wheels(wheels, workers=None, add=False):
+    """Patches each of the `wheels` (a dict of wheel path: {name: data}) in
+    place, with up to `workers` (defaults to the number of cores) wheels
+    patched concurrently.
+
+    Returns a list of (path, changes, error) for each wheel.
+    """
+    workers = min(workers or multiprocessing.cpu_count(), len(wheels))
+    return _map(_patch, [(path, members, add)
+                         for path, members in wheels.items()], workers)
+
+
+def _map(func, items, workers):
+    if workers <= 1:
+        return [func(item) for item in items]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(results):
+    failed = False
+    for path, changes, error in results:
+        if error:
+            failed = True
+            print('{0}: failed\n{1}'.format(path, error))
+            continue
+        print('{0}:'.format(path))
+        for name, old, new in changes:
+            if old:
+                print('  - {0},{1},{2}'.format(name, *old))
+            if new:
+                print('  + {0},{1},{2}'.format(name, *new))
+    return not failed
+
+
+def generate_record(records, name, data):
+    record = Record.loads(records)
+    record.update({name: data})
+    return record.dumps()
 
 
 def parse_args():
@@ -49,23 +390,75 @@ def parse_args():
     with new checksum and file size"""
     parser = argparse.ArgumentParser(description=description)
 
-    parser.add_argument('--path', required=True, help="wheel's file path")
-    parser.add_argument('--name', required=True, help='name of the target '
-                                                      'file inside wheel')
-    parser.add_argument('--data', required=True, help='data to write into '
-                                                      'target file')
+    parser.add_argument('--path', help="wheel's file path")
+    parser.add_argument('--name', help='name of the target file inside wheel')
+    parser.add_argument('--data', help='data to write into target file')
+    parser.add_argument('--output', help='path to write the modified wheel '
+                                         'to (defaults to modifying the '
+                                         'wheel in place)')
+    parser.add_argument('--manifest', help='JSON list of edits, each with a '
+                                           '`wheels` glob, the `name` of '
+                                           'the target file and its `data` '
+                                           'or a `file` to read it from. '
+                                           'All the edits of a wheel are '
+                                           'applied in a single pass')
+    parser.add_argument('--add', action='store_true',
+                        help='add target files missing from the wheel '
+                             'instead of failing')
+    parser.add_argument('--verify', nargs='+', metavar='WHEELS',
+                        help="check every file inside each of the given "
+                             "wheels (paths, globs or directories of "
+                             "wheels) against the wheel's RECORD")
+    parser.add_argument('-j', '--workers', type=int,
+                        help='number of wheels to patch concurrently in '
+                             'manifest mode, or of processes hashing files '
+                             'in verify mode (defaults to the number of '
+                             'cores)')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.verify:
+        if args.path or args.name or args.data or args.manifest:
+            parser.error('--verify cannot be used with --path, --name, '
+                         '--data or --manifest')
+    elif args.manifest:
+        if args.path or args.name or args.data or args.output:
+            parser.error('--manifest cannot be used with --path, --name, '
+                         '--data or --output')
+    elif not (args.path and args.name and args.data is not None):
+        parser.error('--path, --name and --data are required '
+                     'without --manifest')
+    return args
 
 
 def main():
     args = parse_args()
+    if args.verify:
+        try:
+            paths = find_wheels(args.verify)
+        except ValueError as ex:
+            sys.exit(str(ex))
+        results = verify_wheels(paths, args.workers)
+        for path, errors in results.items():
+            print('{0}: {1}'.format(path, 'FAILED' if errors else 'OK'))
+            for error in errors:
+                print('  {0}'.format(error))
+        if any(results.values()):
+            sys.exit(1)
+        return
+    if args.manifest:
+        results = patch_wheels(load_manifest(args.manifest), args.workers,
+                               args.add)
+        if not report(results):
+            sys.exit(1)
+        return
     if args.data == '-':
         data = sys.stdin.read()
     else:
         data = args.data
-    modify_wheel(path=args.path, name=args.name, data=data)
+    changes = patch_wheel(args.path, {args.name: data}, args.output,
+                          args.add)
+    report([(args.output or args.path, changes, None)])
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
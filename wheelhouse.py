@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Builds the wheelhouse used for offline installations of Cloudify.
+
+The wheels to build are taken from a package in packages.yaml: its
+`wheels.sources` (a {project: pip requirement} dict) for the CLI module
+(`cloudify`) and each of its `plugins`, and its `wheels.dependencies`,
+which are built first so that the CLI and plugins find them in the
+wheelhouse instead of taking them from PyPI.
+
+Each requirement is built by `pip wheel` in its own worker process.
+Requirements whose wheels are already in the wheelhouse with the
+checksums recorded in its index are skipped.
+
+The index (index.json) lists each wheel's checksum, size, the projects it
+requires and the (approximate) time it took to build. Installers use it to
+find the wheels to install instead of having pip scan the wheelhouse.
+index.txt lists the wheels required to install the CLI and plugins, for
+shell based installers.
+
+With --lock, a lock manifest (lock.json) is written as well. It lists the
+exact wheels needed to install the CLI and plugins along with their
+checksums, ordered so that each wheel comes after the ones it requires.
+get-cloudify.py's --unpackwheels uses it to unpack the wheels directly
+into a virtualenv without running pip.
+
+Environment variables in requirements are expanded, so that credentials
+for private repositories can be passed without storing them. The index
+records each requirement expanded, without the credentials of its url,
+so that changing a variable (e.g. a tag) rebuilds it.
+
+usage:
+    wheelhouse.py [-c cloudify-linux-cli] [-w wheelhouse] [-j WORKERS]
+                  [--extra virtualenv==12.0.7 ...] [--force] [--lock]
+    wheelhouse.py [-c cloudify-linux-cli] [-w wheelhouse] --rehash [--lock]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import email
+import shutil
+import hashlib
+import logging
+import zipfile
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import yaml
+
+
+PACKAGES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'packages.yaml')
+INDEX_FILE = 'index.json'
+INSTALL_LIST_FILE = 'index.txt'
+LOCK_FILE = 'lock.json'
+CLI_MODULE = 'cloudify'
+CHUNK_SIZE = 64 * 1024
+
+lgr = logging.getLogger('wheelhouse')
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_wheel_metadata(path):
+    """returns the (normalized) project name, version and requirements of
+    a wheel, ignoring requirements which are only part of extras
+    """
+    with zipfile.ZipFile(path) as wheel:
+        metadata_file = [n for n in wheel.namelist()
+                         if n.endswith('.dist-info/METADATA') and
+                         n.count('/') == 1][0]
+        metadata = email.message_from_string(wheel.read(metadata_file))
+    requires = []
+    for requirement in metadata.get_all('Requires-Dist') or []:
+        if re.search(r'extra\s*==', requirement):
+            continue
+        requires.append(normalize(
+            re.match(r'[A-Za-z0-9._-]+', requirement.strip()).group(0)))
+    return normalize(metadata['Name']), metadata['Version'], requires
+
+
+def get_source(requirement):
+    """returns `requirement` as recorded in the index: with its environment
+    variables expanded and the credentials of its url removed
+    """
+    return re.sub(r'(://)[^/@\s]+@', r'\1', os.path.expandvars(requirement))
+
+
+def get_requirements(package_name, packages_file=PACKAGES_FILE):
+    """returns the package's (dependencies, installables) as lists of
+    (name, pip requirement) tuples
+    """
+    with open(packages_file) as f:
+        package = yaml.safe_load(f)['packages'][package_name]
+    wheels = package.get('wheels', {})
+    sources = wheels.get('sources', {})
+    dependencies = [(r, r) for r in wheels.get('dependencies', [])]
+    installables = [(name, sources.get(name, name))
+                    for name in [CLI_MODULE] + package.get('plugins', [])]
+    return dependencies, installables
+
+
+def load_index(wheelhouse):
+    path = os.path.join(wheelhouse, INDEX_FILE)
+    if not os.path.isfile(path):
+        return {'wheels': {}, 'requirements': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_closure(index, projects):
+    """returns the wheels needed to install `projects`, according to the
+    requirements recorded in the index. Requirements with no wheel in the
+    wheelhouse (e.g. ones conditioned on another python version) are
+    skipped.
+    """
+    by_project = dict((w['project'], name)
+                      for name, w in index['wheels'].items())
+    wheels = set()
+    pending = [normalize(p) for p in projects]
+    while pending:
+        project = pending.pop()
+        wheel = by_project.get(project)
+        if wheel is None or wheel in wheels:
+            continue
+        wheels.add(wheel)
+        pending.extend(index['wheels'][wheel]['requires'])
+    return sorted(wheels)
+
+
+def _is_built(index, wheelhouse, name, requirement):
+    """returns True if `requirement` was built from the same source and all
+    the wheels needed to install it are still in the wheelhouse, unchanged
+    """
+    entry = index['requirements'].get(name)
+    if not entry or entry['source'] != get_source(requirement) \
+            or not entry['wheels'] \
+            or not set(entry['wheels']).issubset(index['wheels']):
+        return False
+    wheels = get_closure(
+        index, [index['wheels'][w]['project'] for w in entry['wheels']])
+    return all(
+        os.path.isfile(os.path.join(wheelhouse, w)) and
+        sha256(os.path.join(wheelhouse, w)) == index['wheels'][w]['sha256']
+        for w in wheels)
+
+
+def _build(args):
+    """Builds the wheels of a single requirement (in a worker process)
+    into a temporary directory within the wheelhouse.
+
+    Returns (name, requirement, build_dir, [(wheel, build_time)],
+    duration, error).
+    """
+    name, requirement, wheelhouse = args
+    build_dir = tempfile.mkdtemp(prefix='.build-', dir=wheelhouse)
+    start = time.time()
+    try:
+        subprocess.check_output(
+            [sys.executable, '-m', 'pip', 'wheel',
+             '--wheel-dir', build_dir, '--find-links', wheelhouse,
+             os.path.expandvars(requirement)], stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as ex:
+        shutil.rmtree(build_dir)
+        return name, requirement, None, [], time.time() - start, ex.output
+    # pip writes the wheels one after the other, so the time between their
+    # modification times is roughly the time each one took to build
+    wheels = []
+    previous = start
+    for wheel in sorted(os.listdir(build_dir), key=lambda w: os.path.getmtime(
+            os.path.join(build_dir, w))):
+        mtime = os.path.getmtime(os.path.join(build_dir, wheel))
+        wheels.append((wheel, max(mtime - previous, 0)))
+        previous = mtime
+    return name, requirement, build_dir, wheels, time.time() - start, None
+
+
+def _add_wheels(index, wheelhouse, result):
+    name, requirement, build_dir, wheels, duration, _ = result
+    try:
+        for wheel, build_time in wheels:
+            path = os.path.join(wheelhouse, wheel)
+            checksum = sha256(os.path.join(build_dir, wheel))
+            if os.path.isfile(path) and sha256(path) == checksum:
+                # copied by pip from the wheelhouse rather than built
+                if index['wheels'].get(wheel, {}).get('sha256') == checksum:
+                    continue
+            else:
+                os.rename(os.path.join(build_dir, wheel), path)
+            project, version, requires = read_wheel_metadata(path)
+            index['wheels'][wheel] = {
+                'project': project,
+                'version': version,
+                'requires': requires,
+                'sha256': checksum,
+                'size': os.path.getsize(path),
+                'build_time': round(build_time, 2),
+                'built_by': name,
+            }
+    finally:
+        shutil.rmtree(build_dir)
+    index['requirements'][name] = {
+        'source': get_source(requirement),
+        'wheels': sorted(wheel for wheel, _ in wheels),
+        'build_time': round(duration, 2),
+    }
+
+
+def build(wheelhouse, stages, workers=None, force=False):
+    """Builds the requirements of each stage (a list of (name, requirement)
+    tuples) in parallel, one stage after the other, and returns the
+    updated index.
+    """
+    if not os.path.isdir(wheelhouse):
+        os.makedirs(wheelhouse)
+    index = load_index(wheelhouse)
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    failed = []
+    try:
+        for stage in stages:
+            todo = []
+            for name, requirement in stage:
+                if not force and \
+                        _is_built(index, wheelhouse, name, requirement):
+                    lgr.info('{0} is up to date.'.format(name))
+                else:
+                    todo.append((name, requirement, wheelhouse))
+            for result in pool.imap_unordered(_build, todo):
+                name, _, _, wheels, duration, error = result
+                if error:
+                    lgr.error('Failed to build {0}:\n{1}'.format(name, error))
+                    failed.append(name)
+                    continue
+                lgr.info('Built {0} ({1} wheels) in {2:.1f}s.'.format(
+                    name, len(wheels), duration))
+                _add_wheels(index, wheelhouse, result)
+            if failed:
+                break
+    finally:
+        pool.close()
+        pool.join()
+        write_index(index, wheelhouse)
+    if failed:
+        raise RuntimeError('Failed to build: {0}'.format(', '.join(failed)))
+    return index
+
+
+def write_index(index, wheelhouse, install=None):
+    # dropping wheels which were removed from the wheelhouse
+    for wheel in list(index['wheels']):
+        if not os.path.isfile(os.path.join(wheelhouse, wheel)):
+            del index['wheels'][wheel]
+    path = os.path.join(wheelhouse, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+    if install is not None:
+        with open(os.path.join(wheelhouse, INSTALL_LIST_FILE), 'w') as f:
+            f.write(''.join(
+                w + '\n' for w in get_closure(index, install)))
+
+
+def write_lock(index, wheelhouse, projects):
+    wheels = get_closure(index, projects)
+    by_project = dict((index['wheels'][w]['project'], w) for w in wheels)
+    ordered = []
+
+    def visit(wheel, visiting):
+        if wheel in ordered or wheel in visiting:
+            return
+        visiting.add(wheel)
+        for project in index['wheels'][wheel]['requires']:
+            if project in by_project:
+                visit(by_project[project], visiting)
+        ordered.append(wheel)
+
+    for wheel in wheels:
+        visit(wheel, set())
+    lock = {
+        'projects': sorted(normalize(p) for p in projects),
+        'wheels': [dict(file=wheel, **dict(
+            (key, index['wheels'][wheel][key])
+            for key in ('project', 'version', 'requires', 'sha256', 'size')))
+            for wheel in ordered],
+    }
+    with open(os.path.join(wheelhouse, LOCK_FILE), 'w') as f:
+        json.dump(lock, f, indent=2, sort_keys=True)
+
+
+def rehash(index, wheelhouse):
+    """Updates the index after wheels were modified in place (e.g. to add
+    a VERSION file to the cli wheel).
+    """
+    for wheel, entry in index['wheels'].items():
+        path = os.path.join(wheelhouse, wheel)
+        if os.path.isfile(path):
+            entry.update(sha256=sha256(path), size=os.path.getsize(path))
+    return index
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '-c', '--package', default='cloudify-linux-cli',
+        help='The package in packages.yaml to build wheels for.')
+    parser.add_argument(
+        '-w', '--wheelhouse', default='wheelhouse',
+        help='The directory to build the wheels in.')
+    parser.add_argument(
+        '-j', '--workers', type=int,
+        help='Number of parallel builds (defaults to the number of CPUs).')
+    parser.add_argument(
+        '--extra', nargs='+', default=[],
+        help='Additional requirements to put in the wheelhouse, which '
+             'aren\'t part of the installation (e.g. virtualenv).')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Rebuild wheels even if they are up to date.')
+    parser.add_argument(
+        '--rehash', action='store_true',
+        help='Only update the checksums in the index of an existing '
+             'wheelhouse.')
+    parser.add_argument(
+        '--lock', action='store_true',
+        help='Write a lock manifest of the wheels to install, for '
+             'installations which don\'t use pip.')
+    parser.add_argument('--packages-file', default=PACKAGES_FILE)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    dependencies, installables = get_requirements(
+        args.package, args.packages_file)
+    extras = [(r, r) for r in args.extra]
+    start = time.time()
+    if args.rehash:
+        index = rehash(load_index(args.wheelhouse), args.wheelhouse)
+    else:
+        try:
+            index = build(args.wheelhouse,
+                          [dependencies + extras, installables],
+                          args.workers, args.force)
+        except RuntimeError as ex:
+            lgr.error(str(ex))
+            sys.exit(1)
+    install = [name for name, _ in installables]
+    write_index(index, args.wheelhouse, install=install)
+    if args.lock:
+        write_lock(index, args.wheelhouse, install)
+    lgr.info('Wheelhouse {0} ready ({1} wheels) in {2:.1f}s.'.format(
+        args.wheelhouse, len(index['wheels']), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()